@@ -242,48 +242,105 @@
 
 #     return True
 
-import time
+import hashlib
+import secrets
+import threading
 import streamlit as st
-import bcrypt
 import base64
-import os
 from datetime import datetime, timedelta
 
-from streamlit_cookies_manager import EncryptedCookieManager
+from cachetools import TTLCache
+from streamlit_cookies_manager import CookieManager
 
+from functions.importing import lazy_module
+from functions.tracing import traced
 from functions.db import (
     get_user_by_email,
     update_password,
     log_login_activity,
-    get_ip
+    get_ip,
+    create_user_session,
+    get_session_user,
+    revoke_user_session,
 )
 
+bcrypt = lazy_module("bcrypt")
+
 # ============================================================
-# CLIENT-ID FOR PER-USER COOKIE ENCRYPTION
+# LOGIN SESSIONS (server-side tokens behind a cookie)
 # ============================================================
-# *if "client_id" not in st.session_state:
-#     st.session_state.client_id = base64.b64encode(os.urandom(32)).decode()
-
-
-# # ============================================================
-# # SAFE COOKIE MANAGER INITIALIZATION (ONCE PER SESSION)
-# # ============================================================
-# if "cookies" not in st.session_state:
-#     cookies = EncryptedCookieManager(
-#         prefix=st.secrets["cookies"]["prefix"],
-#         password=st.secrets["cookies"]["password"],
-#         key=st.session_state.client_id
-#     )
-#     st.session_state.cookies = cookies
-# else:
-#     cookies = st.session_state.cookies
-
-# # CookieManager must be ready before use
-# if not cookies.ready():
-#     st.stop()
-
-# COOKIE_NAME = st.secrets["cookies"]["name"]
-# COOKIE_LIFETIME_SECONDS = 24 * 3600  # 1 day
+# The cookie holds a random token; user_sessions holds its SHA-256, the
+# user and the expiry. The token is opaque, so the cookie needs no
+# encryption (and no per-session key derivation).
+SESSION_LIFETIME_SECONDS = 24 * 3600  # 1 day
+
+# Session lookups are cached per process for SESSION_CACHE_SECONDS, so most
+# reruns validate the cookie without a query. A revoked session stops
+# working within that time.
+SESSION_CACHE_SECONDS = 60
+_session_cache = TTLCache(maxsize=1024, ttl=SESSION_CACHE_SECONDS)
+_session_lock = threading.Lock()
+_MISSING = object()
+
+
+@st.cache_resource(show_spinner=False)
+def cookie_settings():
+    """(cookie name, prefix) from the optional [cookies] secrets section."""
+    settings = st.secrets.get("cookies", {})
+    return settings.get("name", "budget_session"), settings.get("prefix", "")
+
+
+def _token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def lookup_session(token):
+    """User record for a live session token (cached), or None."""
+    key = _token_hash(token)
+    with _session_lock:
+        user = _session_cache.get(key, _MISSING)
+    if user is _MISSING:
+        user = get_session_user(key)
+        with _session_lock:
+            _session_cache[key] = user
+    return dict(user) if user else None
+
+
+def get_cookies():
+    """Cookie manager for this rerun; stops the run until the browser has sent its cookies."""
+    cookies = CookieManager(prefix=cookie_settings()[1])
+    if not cookies.ready():
+        st.stop()
+    st.session_state.cookie_manager = cookies
+    return cookies
+
+
+def start_session(email):
+    """Create a session for a successful login and hand its token to the browser."""
+    token = secrets.token_urlsafe(32)
+    create_user_session(_token_hash(token), email, SESSION_LIFETIME_SECONDS)
+    st.session_state.session_token = token
+
+    cookies = st.session_state.get("cookie_manager")
+    if cookies is not None:
+        cookies[cookie_settings()[0]] = token
+        cookies.save()
+
+
+def end_session():
+    """Revoke this browser's session and forget its cookie."""
+    token = st.session_state.pop("session_token", None)
+    if token:
+        key = _token_hash(token)
+        revoke_user_session(key)
+        with _session_lock:
+            _session_cache.pop(key, None)
+
+    cookies = st.session_state.get("cookie_manager")
+    cookie_name = cookie_settings()[0]
+    if cookies is not None and cookie_name in cookies:
+        del cookies[cookie_name]
+        cookies.save()
 
 
 # ============================================================
@@ -304,38 +361,41 @@ def init_auth_session():
             st.session_state[k] = v
 
 
-# # ============================================================
-# # COOKIE → AUTO LOGIN (WITH EXPIRATION)
-# # ============================================================
-# def cookie_auto_login():
-#     if COOKIE_NAME not in cookies:
-#         return
-
-#     raw_value = cookies[COOKIE_NAME]  # stored as: email|timestamp
-
-#     try:
-#         email, ts = raw_value.split("|")
-#         ts = int(ts)
-#     except:
-#         del cookies[COOKIE_NAME]
-#         cookies.save()
-#         return
+# ============================================================
+# COOKIE → AUTO LOGIN
+# ============================================================
+def restore_session(cookies):
+    """
+    Log a returning browser in from its session cookie, and keep the
+    signed-in user's record current. One cached lookup per rerun: no
+    password check and, while the lookup is cached, no query.
+    """
+    token = st.session_state.get("session_token") or cookies.get(cookie_settings()[0])
+    if not token:
+        return
+
+    user = lookup_session(token)
+    if user is None:
+        if st.session_state.authenticated and st.session_state.get("session_token") == token:
+            # Revoked (e.g. password reset by an admin) or expired.
+            st.warning("🔒 Your session has ended. Please log in again.")
+            logout_user()
+        else:
+            end_session()
+        return
 
-#     # Expired cookie?
-#     if time.time() - ts > COOKIE_LIFETIME_SECONDS:
-#         del cookies[COOKIE_NAME]
-#         cookies.save()
-#         return
+    st.session_state.session_token = token
+    if st.session_state.authenticated:
+        st.session_state.user_record.update(user)
+        st.session_state.name = user["name"]
+        return
 
-#     # Load user
-#     user = get_user_by_email(email)
-#     if user:
-#         st.session_state.authenticated = True
-#         st.session_state.email = email
-#         st.session_state.name = user["name"]
-#         st.session_state.user_record = user
-#         st.session_state.force_pw_change = False
-#         st.session_state.last_active = datetime.now()
+    st.session_state.authenticated = True
+    st.session_state.email = user["email"]
+    st.session_state.name = user["name"]
+    st.session_state.user_record = user
+    st.session_state.force_pw_change = bool(user.get("first_login"))
+    st.session_state.last_active = datetime.now()
 
 
 # ============================================================
@@ -365,10 +425,9 @@ def logout_user():
     st.session_state.name = ""
     st.session_state.user_record = {}
     st.session_state.force_pw_change = False
+    st.session_state.pop("login_logged_for", None)
 
-    # if COOKIE_NAME in cookies:
-    #     del cookies[COOKIE_NAME]
-    #     cookies.save()
+    end_session()
 
 
 # ============================================================
@@ -411,10 +470,8 @@ def render_login_screen():
                 st.session_state.force_pw_change = True
                 st.rerun()
 
-            # Save persistent cookie
-            token_value = f"{email}|{int(time.time())}"
-            # cookies[COOKIE_NAME] = token_value
-            # cookies.save()
+            # Persistent login for this browser
+            start_session(user["email"])
 
             st.rerun()
 
@@ -447,10 +504,9 @@ def render_first_login_reset():
             st.session_state.user_record["hashed_password"] = encoded
             st.session_state.force_pw_change = False
 
-            # Refresh cookie timestamp
-            token_value = f"{st.session_state.email}|{int(time.time())}"
-            # cookies[COOKIE_NAME] = token_value
-            # cookies.save()
+            # Persistent login for this browser
+            if not st.session_state.get("session_token"):
+                start_session(st.session_state.email)
 
             st.success("Password updated successfully.")
             st.rerun()
@@ -459,9 +515,10 @@ def render_first_login_reset():
 # ============================================================
 # MASTER LOGIN FLOW
 # ============================================================
+@traced("auth_flow")
 def auth_flow():
     init_auth_session()
-    #cookie_auto_login()
+    restore_session(get_cookies())
     inactivity_timeout()
 
     #if COOKIE_NAME in cookies and not st.session_state.get("just_logged_in", False):
@@ -0,0 +1,136 @@
+# functions/comparison.py
+"""
+Year-over-year / multi-period comparison of budget files.
+
+Reads the normalized rows the precompute worker stores in budget_rows and
+expense_rows, so no workbook is downloaded or parsed here: one GROUP BY
+query per side and one pivot line the periods up.
+
+Author: Zedaine McDonald
+"""
+
+import pandas as pd
+import streamlit as st
+
+from .db import get_uploaded_files, get_budget_totals, get_expense_totals, get_latest_precompute_job
+from .precompute import BUDGET_TYPES, PENDING_STATUSES, budget_type_of, enqueue_precompute
+from .report_compute import comparison_view
+from .table_view import render_paged_table
+from .export_utils import render_export_buttons
+from .perf import measure
+
+MAX_PERIODS = 6
+NO_EXPENSE = "— None —"
+
+
+def _fmt_growth(value):
+    # No growth rate when the earlier period had nothing budgeted/spent
+    return "—" if pd.isna(value) else f"{value:+.1f}%"
+
+
+def _render_unindexed_files(missing):
+    """
+    Say why files have no stored rows. A file that was never processed is
+    queued once; a failed or empty parse is reported instead of re-queued on
+    every click, with a manual re-index for the ones that can change.
+    """
+    pending, reindex = [], []
+    for name in missing:
+        job = get_latest_precompute_job(name)
+        if job is None:
+            enqueue_precompute(name)
+            pending.append(name)
+        elif job["status"] in PENDING_STATUSES:
+            pending.append(name)
+        elif job["status"] == "failed":
+            st.error(f"❌ '{name}' could not be parsed: {job['detail'] or 'unknown error'}")
+            reindex.append(name)
+        elif job["status"] in ("empty", "skipped"):
+            st.warning(f"'{name}' has nothing to compare: {job['detail']}")
+        else:
+            # Processed before budget_rows / expense_rows were stored.
+            st.warning(f"'{name}' was processed before comparison rows were stored; re-index it to compare.")
+            reindex.append(name)
+
+    if pending:
+        st.info("⏳ These files are being indexed for comparison; try again shortly: " + ", ".join(pending))
+    if reindex and st.button("🔁 Re-index " + ", ".join(reindex), key="cmp_reindex"):
+        for name in reindex:
+            enqueue_precompute(name)
+        st.rerun(scope="fragment")
+
+
+@st.fragment
+@measure("comparison")
+def render_comparison_section():
+    with st.expander("📈 Year-over-Year Comparison", expanded=False):
+        df_files = pd.DataFrame(get_uploaded_files())
+        if df_files.empty:
+            st.info("📭 No uploaded files yet.")
+            return
+
+        ft = df_files["file_type"].astype(str).str.lower()
+        budget_files = df_files[ft.str.startswith("budget")]
+        expense_names = df_files.loc[ft == "expense", "file_name"].tolist()
+        if len(budget_files) < 2:
+            st.info("Upload at least two budget files to compare periods.")
+            return
+
+        budget_names = budget_files["file_name"].tolist()
+        budget_types = dict(zip(budget_files["file_name"], budget_files["file_type"].map(budget_type_of)))
+
+        n_periods = st.number_input("Number of periods", min_value=2, max_value=MAX_PERIODS, value=2, step=1)
+
+        # --- One row of pickers per period (oldest first) ---
+        periods = []
+        for i in range(int(n_periods)):
+            c1, c2, c3, c4 = st.columns([1, 2, 2, 1])
+            label = c1.text_input("Label", value=f"Period {i + 1}", key=f"cmp_label_{i}")
+            budget_file = c2.selectbox("Budget File", budget_names, index=min(i, len(budget_names) - 1), key=f"cmp_budget_{i}")
+            expense_file = c3.selectbox("Expense File (optional)", [NO_EXPENSE] + expense_names, key=f"cmp_expense_{i}")
+            budget_type = budget_types.get(budget_file)
+            if budget_type is None:
+                budget_type = c4.selectbox("Type", BUDGET_TYPES, key=f"cmp_type_{i}")
+            else:
+                c4.text_input("Type", value=budget_type, disabled=True, key=f"cmp_type_shown_{i}")
+            periods.append({
+                "label": label.strip() or f"Period {i + 1}",
+                "budget_file": budget_file,
+                "budget_type": budget_type,
+                "expense_file": None if expense_file == NO_EXPENSE else expense_file,
+            })
+
+        if st.button("Compare", key="cmp_run"):
+            st.session_state.comparison_open = True
+
+        if not st.session_state.get("comparison_open"):
+            return
+
+        if len({p["label"] for p in periods}) != len(periods):
+            st.error("Each period needs a different label.")
+            return
+
+        budget_selected = sorted({p["budget_file"] for p in periods})
+        expense_selected = sorted({p["expense_file"] for p in periods if p["expense_file"]})
+
+        budget_totals = get_budget_totals(budget_selected)
+        spend_totals = get_expense_totals(expense_selected)
+
+        indexed = {r["file_name"] for r in budget_totals} | {r["file_name"] for r in spend_totals}
+        missing = [name for name in budget_selected + expense_selected if name not in indexed]
+        if missing:
+            _render_unindexed_files(missing)
+            return
+
+        view = comparison_view(budget_totals, spend_totals, periods)
+
+        number_cols = [c for c in view.columns if c not in ("Category", "Sub-Category")]
+        render_paged_table(
+            view,
+            key="tbl_comparison",
+            formats={
+                c: (_fmt_growth if c.startswith("Growth %") else "{:,.2f}")
+                for c in number_cols
+            },
+        )
+        render_export_buttons(view, "Budget_Comparison", key="exp_comparison")
@@ -1,5 +1,3 @@
-import streamlit as st
-import pandas as pd
 """
 Provides function to display budget classification dashboard.
 
@@ -7,23 +5,78 @@ Author: Zedaine McDonald
 Date: 2025-11-26
 """
 
+import streamlit as st
+import pandas as pd
+from datetime import datetime, time
+
+from .perf import measure
+from .tracing import span
+from .memprofile import memory_stage, record_frame
+from .db import (
+    get_budget_state_version, get_budget_state_summary,
+    bulk_classify, has_budget_rows, replace_budget_rows,
+    load_budget_state_as_of, get_state_history
+)
+from .precompute import budget_row_tuples
+
+MONTHS = [
+    "January", "February", "March", "April", "May", "June",
+    "July", "August", "September", "October", "November", "December"
+]
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_budget_state(file_name, version, _load_budget_state_grid):
+    """
+    Saved statuses of a budget file in grid shape (one row per
+    Category/Sub-Category, one column per month), shared by every session.
+
+    The cache key is (file_name, version): saving bumps the version, so the
+    next rerun anywhere misses the cache and reloads once.
+    """
+    return _load_budget_state_grid(file_name)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_status_totals(file_name, version):
+    """Per-status totals for the tiles, keyed like cached_budget_state()."""
+    return get_budget_state_summary(file_name)
+
+
+def like_pattern(text):
+    """
+    Sub-category filter text -> SQL LIKE pattern. "*" is a wildcard;
+    without one the text matches anywhere in the name.
+    """
+    text = (text or "").strip()
+    if not text:
+        return None
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    if "*" in escaped:
+        return escaped.replace("*", "%")
+    return f"%{escaped}%"
+
+@st.fragment
+@measure("dashboard")
 def dashboard(df_budget, df_expense, selected_budget,
-              load_budget_state_monthly, save_budget_state_monthly):
+              load_budget_state_grid, save_budget_state_grid):
     
     """
     Logic to display a budget dashboard summary using coloured dashboard buttons.
 
     This function loads, saves and displays budget state as well as well as a summarized dashboard.
+    It runs as a fragment, so editing the grid or saving reruns only the dashboard.
 
     Parameters:
     - df_budget: dataframe
         Budget dataframe.
     - df_expense: dataframe
     -selected budget: file name of budget selected for the dashboard
-    - load_budget_state_monthly: callable 
-        Function that loads the state of the current budget
-    - save_budget_state_monthly: callable
-        Function that saves the current state of the budget
+    - load_budget_state_grid: callable 
+        Function that loads the state of the current budget (one column per month)
+    - save_budget_state_grid: callable
+        Function that saves the edited grid of the current budget, merging
+        it with any save made since the grid was loaded
     """
 
     # ============================================================
@@ -32,50 +85,55 @@ def dashboard(df_budget, df_expense, selected_budget,
     if "editor_version" not in st.session_state:
         st.session_state.editor_version = 0   # bump after save
 
-    months = [
-        "January", "February", "March", "April", "May", "June",
-        "July", "August", "September", "October", "November", "December"
-    ]
+    months = MONTHS
 
     # ============================================================
-    # ALWAYS LOAD STATE FROM MYSQL
+    # LOAD STATE (cached per budget file + state version)
     # ============================================================
-    saved_state = load_budget_state_monthly(selected_budget)
+    # One primary-key lookup per rerun; the full state is only re-read
+    # from MySQL after someone saves.
+    with span("dashboard load"):
+        state_version = get_budget_state_version(selected_budget)
+        saved_grid = cached_budget_state(
+            selected_budget, state_version, load_budget_state_grid
+        )
+
+    # The editor keeps the state it was opened with until this user saves,
+    # so someone else's save does not wipe edits in progress; the two are
+    # merged cell by cell on save instead.
+    pinned = st.session_state.get("state_base")
+    if (not pinned or pinned["budget"] != selected_budget
+            or pinned["editor_version"] != st.session_state.editor_version):
+        pinned = {
+            "budget": selected_budget,
+            "editor_version": st.session_state.editor_version,
+            "version": state_version,
+            "grid": saved_grid,
+        }
+        st.session_state.state_base = pinned
 
     # Build base budget DF with amounts
     base_df = df_budget[["Category", "Sub-Category"] + months].copy()
     base_df = base_df.rename(columns={m: f"{m} Amount" for m in months})
 
-    # Pivot saved statuses
-    if not saved_state.empty:
-        saved_pivot = saved_state.pivot_table(
-            index=["Category", "Sub-Category"],
-            columns="Month",
-            values="Status Category",
-            aggfunc="first"
-        ).reset_index()
-    else:
-        saved_pivot = pd.DataFrame(columns=["Category", "Sub-Category"] + months)
-
-    # Ensure pivot column names exactly match month names
-    saved_pivot = saved_pivot.rename(columns={m: m for m in months})
-
     # ============================================================
     # MERGE BUDGET AMOUNTS + SAVED STATUS
     # ============================================================
-    merged_df = base_df.merge(saved_pivot, on=["Category", "Sub-Category"], how="left")
+    with memory_stage("dashboard merge"):
+        merged_df = base_df.merge(pinned["grid"], on=["Category", "Sub-Category"], how="left")
 
-    # Create missing status columns if not present
-    for m in months:
-        if m not in merged_df.columns:
-            merged_df[m] = None
+        # Create missing status columns if not present
+        for m in months:
+            if m not in merged_df.columns:
+                merged_df[m] = None
 
-    # Column order
-    ordered_cols = ["Category", "Sub-Category"]
-    for m in months:
-        ordered_cols += [f"{m} Amount", m]
+        # Column order
+        ordered_cols = ["Category", "Sub-Category"]
+        for m in months:
+            ordered_cols += [f"{m} Amount", m]
 
-    merged_df = merged_df[ordered_cols]
+        merged_df = merged_df[ordered_cols]
+    record_frame("dashboard merged_df", merged_df)
 
     # ============================================================
     # DASHBOARD SUMMARY — Tiles + Totals
@@ -88,22 +146,14 @@ def dashboard(df_budget, df_expense, selected_budget,
         "Will not be spent", "Out of Budget"
     ]
 
-    # Compute summary
-    if saved_state.empty:
-        rows_summary = pd.DataFrame({
-            "Status Category": status_options,
-            "Total": [0] * len(status_options)
-        })
-    else:
-        rows_summary = (
-            saved_state.groupby("Status Category")["Amount"]
-            .sum()
-            .reset_index()
-            .rename(columns={"Amount": "Total"})
-            .set_index("Status Category")
-            .reindex(status_options, fill_value=0)
-            .reset_index()
-        )
+    # Summary is aggregated by MySQL (one row per status)
+    rows_summary = (
+        cached_status_totals(selected_budget, state_version)
+        .set_index("Status Category")["Total"]
+        .reindex(status_options, fill_value=0)
+        .rename_axis("Status Category")
+        .reset_index()
+    )
 
     # Top totals
     budget_total = df_budget["Total"].sum()
@@ -154,6 +204,53 @@ def dashboard(df_budget, df_expense, selected_budget,
                     unsafe_allow_html=True
                 )
 
+    # ============================================================
+    # BULK CLASSIFICATION — one set-based statement in MySQL
+    # ============================================================
+    with st.expander("⚡ Bulk Classification", expanded=False):
+        any_status, unclassified = "Any status", "Unclassified"
+
+        b1, b2 = st.columns(2)
+        with b1:
+            bulk_categories = st.multiselect(
+                "Categories (empty = all)",
+                sorted(df_budget["Category"].dropna().astype(str).unique()),
+                key=f"bulk_cat_{selected_budget}"
+            )
+            bulk_pattern = st.text_input(
+                "Sub-Category contains (use * as wildcard)",
+                key=f"bulk_sub_{selected_budget}"
+            )
+        with b2:
+            bulk_from, bulk_to = st.select_slider(
+                "Months", options=months, value=(months[0], months[-1]),
+                key=f"bulk_months_{selected_budget}"
+            )
+            bulk_current = st.selectbox(
+                "Only cells currently", [any_status, unclassified] + status_options,
+                key=f"bulk_current_{selected_budget}"
+            )
+        bulk_new = st.selectbox("Set status to", status_options, key=f"bulk_new_{selected_budget}")
+
+        if st.button("Apply to matching cells", key=f"bulk_apply_{selected_budget}"):
+            # Lines that were never saved are added from budget_rows.
+            if not has_budget_rows(selected_budget):
+                replace_budget_rows(selected_budget, budget_row_tuples(df_budget))
+
+            changed = bulk_classify(
+                selected_budget,
+                new_status=bulk_new,
+                months=months[months.index(bulk_from):months.index(bulk_to) + 1],
+                user_email=st.session_state.email,
+                categories=bulk_categories or None,
+                subcategory_pattern=like_pattern(bulk_pattern),
+                current_status={any_status: None, unclassified: ""}.get(bulk_current, bulk_current),
+            )
+
+            st.session_state.editor_version += 1
+            st.success(f"Updated {changed:,} cell(s).")
+            st.rerun(scope="fragment")
+
     # ============================================================
     # MONTHLY EDITOR
     # ============================================================
@@ -166,13 +263,55 @@ def dashboard(df_budget, df_expense, selected_budget,
            for m in months},
     }
 
+    if pinned["version"] != state_version:
+        st.caption(
+            "ℹ️ Someone else saved classifications since you opened this grid; "
+            "your changes will be merged with theirs when you save."
+        )
+
+    # ============================================================
+    # SAVE CONFLICTS — cells both users changed
+    # ============================================================
+    conflict_state = st.session_state.get("state_conflicts")
+    if conflict_state and conflict_state["budget"] == selected_budget:
+        conflicts = conflict_state["conflicts"]
+        st.warning(
+            f"⚠️ {len(conflicts)} cell(s) were also changed by someone else. "
+            "Their status was kept for these cells; the rest of your changes were saved."
+        )
+        st.dataframe(conflicts, width="stretch", hide_index=True)
+
+        k1, k2 = st.columns(2)
+        if k1.button("Apply my values to these cells", key=f"conflict_mine_{selected_budget}"):
+            grid = conflict_state["grid"].copy()
+            for cat, sub, month, mine in conflicts[
+                ["Category", "Sub-Category", "Month", "Your Status"]
+            ].itertuples(index=False, name=None):
+                line = (grid["Category"] == cat) & (grid["Sub-Category"] == sub)
+                grid.loc[line, month] = mine if isinstance(mine, str) and mine else None
+
+            with span("dashboard save"):
+                result = save_budget_state_grid(
+                    selected_budget, grid, st.session_state.email,
+                    base_version=conflict_state["version"], base_grid=conflict_state["grid"]
+                )
+            st.session_state.state_conflicts = (
+                None if result["conflicts"].empty
+                else {"budget": selected_budget, **result}
+            )
+            st.session_state.editor_version += 1
+            st.rerun(scope="fragment")
+        if k2.button("Keep their values", key=f"conflict_theirs_{selected_budget}"):
+            st.session_state.state_conflicts = None
+            st.rerun(scope="fragment")
+
     # Unique key ensures Streamlit never restores old data
     editor_key = f"editor_{selected_budget}_{st.session_state.editor_version}"
 
     edited_df = st.data_editor(
         merged_df,
         column_config=editor_cols,
-        use_container_width=True,
+        width="stretch",
         key=editor_key
     )
 
@@ -181,36 +320,53 @@ def dashboard(df_budget, df_expense, selected_budget,
     # ============================================================
     if st.button("💾 Save Classifications"):
 
-        # Melt statuses
-        melted_status = edited_df.melt(
-            id_vars=["Category", "Sub-Category"],
-            value_vars=months,
-            var_name="Month",
-            value_name="Status Category"
+        # The grid is saved as is: statuses plus the (read-only) budget amounts.
+        # It only overwrites the state it was loaded from; newer changes are merged.
+        with span("dashboard save"):
+            result = save_budget_state_grid(
+                selected_budget, edited_df, st.session_state.email,
+                base_version=pinned["version"], base_grid=pinned["grid"]
+            )
+        st.session_state.state_conflicts = (
+            None if result["conflicts"].empty
+            else {"budget": selected_budget, **result}
         )
 
-        # Melt budget amounts
-        melted_amounts = df_budget[["Category", "Sub-Category"] + months].melt(
-            id_vars=["Category", "Sub-Category"],
-            value_vars=months,
-            var_name="Month",
-            value_name="Amount"
-        )
-
-        # Full final table
-        final_melted = melted_status.merge(
-            melted_amounts,
-            on=["Category", "Sub-Category", "Month"],
-            how="left"
-        )
-
-        # Replace NaN with None for MySQL compatibility
-        final_melted = final_melted.where(pd.notnull(final_melted), None)
-
-        save_budget_state_monthly(selected_budget, final_melted, st.session_state.email)
-
         # Force clean widget reload
         st.session_state.editor_version += 1
 
         st.success("🎉 Saved! Reloading updated classifications...")
-        st.rerun()
+        st.rerun(scope="fragment")
+
+    # ============================================================
+    # CLASSIFICATION HISTORY — grid as it was at a point in time
+    # ============================================================
+    with st.expander("🕒 Classification History", expanded=False):
+        h1, h2 = st.columns(2)
+        with h1:
+            as_of_date = st.date_input("As of date", key=f"asof_date_{selected_budget}")
+        with h2:
+            as_of_time = st.time_input("As of time", value=time(23, 59), key=f"asof_time_{selected_budget}")
+        as_of = datetime.combine(as_of_date, as_of_time)
+
+        if st.button("Show classifications as of then", key=f"asof_show_{selected_budget}"):
+            st.session_state[f"asof_open_{selected_budget}"] = True
+
+        if st.session_state.get(f"asof_open_{selected_budget}"):
+            past_grid = load_budget_state_as_of(selected_budget, as_of)
+            if past_grid is None:
+                st.info("No classification history was recorded for this budget by that time.")
+            else:
+                st.dataframe(past_grid, width="stretch", hide_index=True)
+
+            changes = pd.DataFrame(get_state_history(selected_budget, until=as_of, limit=200))
+            if not changes.empty:
+                st.caption("Latest changes up to that time")
+                st.dataframe(
+                    changes.rename(columns={
+                        "changed_at": "Changed At", "changed_by": "Changed By",
+                        "category": "Category", "subcategory": "Sub-Category",
+                        "month": "Month", "old_status": "Old Status", "new_status": "New Status",
+                    }),
+                    width="stretch", hide_index=True
+                )
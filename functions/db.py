@@ -5,24 +5,38 @@
 import pymysql
 import streamlit as st
 from datetime import datetime
-import requests
-import pandas as pd
-import bcrypt
 import base64
 
-import pathlib
+import queue
+import sys
 import tempfile
+import threading
+import time
+from contextlib import contextmanager
 
-#Database config section
-dbsecrets = st.secrets["MYSQL"]
+from .importing import lazy_module
+from .tracing import span
+from .query_log import record_query
+
+# Imported on first use: the login screen needs none of them.
+pd = lazy_module("pandas")
+requests = lazy_module("requests")
+bcrypt = lazy_module("bcrypt")
+
+#Database config section (read from secrets on first use, not at import)
+@st.cache_resource(show_spinner=False)
+def db_settings():
+    return dict(st.secrets["MYSQL"])
 
 #ssl authentication files.
-ssl_options = {
-    "ca": dbsecrets["sslserverca"],
-    "cert": dbsecrets["sslclientcert"],
-    "key": dbsecrets["sslclientkey"],
-    "check_hostname": dbsecrets["sslcheck_hostname"]
-}
+def ssl_options():
+    dbsecrets = db_settings()
+    return {
+        "ca": dbsecrets["sslserverca"],
+        "cert": dbsecrets["sslclientcert"],
+        "key": dbsecrets["sslclientkey"],
+        "check_hostname": dbsecrets["sslcheck_hostname"]
+    }
 
 def write_cert(b64_data, filename):
     """Function to decode base64 and write to a temportaty file"""
@@ -32,26 +46,193 @@ def write_cert(b64_data, filename):
     f.flush()
     return f.name
 
-# Initial database connection
-def get_db():
+# budget_state storage layout: "wide" (budget_state_wide, one row per
+# sub-category) or "long" (budget_state, one row per sub-category and month).
+@st.cache_resource(show_spinner=False)
+def budget_state_layout():
+    return st.secrets.get("BUDGET_STATE_LAYOUT", "wide")
 
-    home_lib = pathlib.Path.home()
-    target_path = home_lib/"private"
-    dbsecrets = st.secrets["MYSQL"]
-    
+STATE_MONTHS = [
+    "January", "February", "March", "April", "May", "June",
+    "July", "August", "September", "October", "November", "December"
+]
+# Conditional grid saves retried after merging with a concurrent save.
+SAVE_ATTEMPTS = 3
+
+# Wide-layout column names: january_status, january_amount, ...
+WIDE_STATUS_COLS = [f"{m.lower()}_status" for m in STATE_MONTHS]
+WIDE_AMOUNT_COLS = [f"{m.lower()}_amount" for m in STATE_MONTHS]
+
+# Per-thread count of statements executed (see _InstrumentedCursor),
+# read by functions/perf.py to attribute queries to a page region.
+_query_stats = threading.local()
+
+def queries_issued():
+    """Number of queries issued on the current thread so far."""
+    return getattr(_query_stats, "count", 0)
+
+
+# ============================================================
+# CONNECTION POOL
+# ============================================================
+# Each thread keeps one connection while it lives, so query functions no
+# longer open a new connection per call. A session's script thread runs
+# all of that session's reruns one after another, so its connection is held
+# across reruns, not per rerun; it goes back to a process-wide idle pool
+# when the thread ends (the session closes or its script runner is
+# replaced), as do the connections of worker threads when they finish.
+POOL_MAX_IDLE = 8
+# A connection unused for longer than this is pinged (and reconnected) before reuse.
+POOL_PING_SECONDS = 30
+
+_idle_connections = queue.LifoQueue()
+_thread_connection = threading.local()
+
+
+class _ConnectionLease:
+    """A thread's connection; returned to the idle pool when the thread's locals are freed."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.last_used = time.monotonic()
+
+    def __del__(self):
+        _release_connection(self.connection)
+
+
+# ============================================================
+# QUERY EXECUTION
+# ============================================================
+def _query_caller():
+    """Name of the query function: the caller of execute()/executemany()."""
+    # _query_caller ← _run ← execute/executemany ← query function
+    frame = sys._getframe(3)
+    while frame.f_globals.get("__name__", "").startswith("pymysql"):
+        frame = frame.f_back
+    return frame.f_code.co_name
+
+
+class _InstrumentedCursor(pymysql.cursors.DictCursor):
+    """
+    The single execution path for every statement in this module: times
+    it, counts rows returned/affected and errors per statement
+    (functions/query_log.py), and emits a "db: <query function>" span.
+    """
+
+    _batch = False
+    # Exception types the caller handles as an outcome, not a failure (see expecting()).
+    _expected = ()
+
+    @contextmanager
+    def expecting(self, *errors):
+        """Statements run inside that raise one of `errors` are not counted as query errors."""
+        self._expected = errors
+        try:
+            yield self
+        finally:
+            self._expected = ()
+
+    def _run(self, run, query, args, batch):
+        caller = _query_caller()
+        _query_stats.count = queries_issued() + 1
+        t_start = time.perf_counter()
+        error = None
+        try:
+            with span(f"db: {caller}"):
+                return run()
+        except Exception as e:
+            if not isinstance(e, self._expected):
+                error = e
+            raise
+        finally:
+            ms = (time.perf_counter() - t_start) * 1000
+            rows = max(self.rowcount, 0)
+            returns_rows = error is None and self.description is not None
+            record_query(
+                query, ms, caller,
+                returned=rows if returns_rows else 0,
+                affected=0 if returns_rows or error is not None else rows,
+                error=error, args=args, batch=batch,
+            )
+
+    def execute(self, query, args=None):
+        if self._batch:
+            # A statement of an executemany() batch, recorded with the batch.
+            return super().execute(query, args)
+        return self._run(lambda: super(_InstrumentedCursor, self).execute(query, args), query, args, False)
 
+    def executemany(self, query, args):
+        def run():
+            self._batch = True
+            try:
+                return super(_InstrumentedCursor, self).executemany(query, args)
+            finally:
+                self._batch = False
+        return self._run(run, query, args, True)
+
+
+def _connect():
+    dbsecrets = db_settings()
+    return pymysql.connect(
+        host= dbsecrets["host"],
+        user= dbsecrets["user"],
+        password= dbsecrets["password"],
+        database= dbsecrets["database"],
+        cursorclass=_InstrumentedCursor,
+        autocommit=True,
+        charset="utf8mb4",
+    )
+
+
+def _release_connection(connection):
     try:
-        connection = pymysql.connect(
-            host= dbsecrets["host"],
-            user= dbsecrets["user"],
-            password= dbsecrets["password"],
-            database= dbsecrets["database"],
-            cursorclass=pymysql.cursors.DictCursor,
-            autocommit=True,
-            charset="utf8mb4",
-        )
-        return connection
+        if connection.open and _idle_connections.qsize() < POOL_MAX_IDLE:
+            # Never hand a transaction left open by an error to the next thread.
+            connection.rollback()
+            _idle_connections.put((connection, time.monotonic()))
+            return
+    except Exception:
+        pass
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def _checkout_connection():
+    while True:
+        try:
+            connection, idle_since = _idle_connections.get_nowait()
+        except queue.Empty:
+            return _connect()
+        if time.monotonic() - idle_since <= POOL_PING_SECONDS:
+            return connection
+        try:
+            connection.ping(reconnect=True)
+            return connection
+        except pymysql.Error:
+            continue
+
+
+def warm_db_pool(size=2):
+    """Open connections ahead of the first queries; returns the number of idle connections."""
+    for _ in range(max(size - _idle_connections.qsize(), 0)):
+        _release_connection(_connect())
+    return _idle_connections.qsize()
+
+
+# Initial database connection
+def get_db():
+    try:
+        lease = getattr(_thread_connection, "lease", None)
+        if lease is None:
+            lease = _thread_connection.lease = _ConnectionLease(_checkout_connection())
+        elif time.monotonic() - lease.last_used > POOL_PING_SECONDS:
+            lease.connection.ping(reconnect=True)
+        lease.last_used = time.monotonic()
+        return lease.connection
     except pymysql.Error as e:
+        _thread_connection.lease = None
         st.error(f"Error connecting to MySQL database: {e}")
         return None
 
@@ -111,6 +292,8 @@ def reset_user_password(email, hashed_pw):
             SET hashed_password = %s, first_login = TRUE
             WHERE LOWER(email) = LOWER(%s)
         """, (hashed_pw, email))
+        # Existing logins must not survive a reset.
+        _revoke_user_sessions(c, email)
     return True
 
 
@@ -118,9 +301,64 @@ def delete_user(email):
     db = get_db()
     with db.cursor() as c:
         c.execute("DELETE FROM users WHERE LOWER(email) = LOWER(%s)", (email,))
+        _revoke_user_sessions(c, email)
     return True
 
 
+#Login session CRUD (server-side tokens behind the login cookie; see functions/auth.py)
+def create_user_session(token_hash, email, lifetime_seconds):
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            INSERT INTO user_sessions (token_hash, email, created_at, expires_at)
+            VALUES (%s, %s, NOW(), NOW() + INTERVAL %s SECOND)
+        """, (token_hash, email, int(lifetime_seconds)))
+    return True
+
+
+def get_session_user(token_hash):
+    """The user behind a live (unexpired, unrevoked) session token, or None."""
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            SELECT u.id, u.name, u.username, u.email, u.role, u.first_login
+            FROM user_sessions s
+            JOIN users u ON LOWER(u.email) = LOWER(s.email)
+            WHERE s.token_hash = %s
+              AND s.revoked_at IS NULL
+              AND s.expires_at > NOW()
+        """, (token_hash,))
+        return c.fetchone()
+
+
+def revoke_user_session(token_hash):
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            UPDATE user_sessions SET revoked_at = NOW()
+            WHERE token_hash = %s AND revoked_at IS NULL
+        """, (token_hash,))
+    return True
+
+
+def _revoke_user_sessions(c, email):
+    c.execute("""
+        UPDATE user_sessions SET revoked_at = NOW()
+        WHERE LOWER(email) = LOWER(%s) AND revoked_at IS NULL
+    """, (email,))
+
+
+def purge_user_sessions():
+    """Delete expired and revoked sessions."""
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            DELETE FROM user_sessions
+            WHERE expires_at < NOW() OR revoked_at IS NOT NULL
+        """)
+        return c.rowcount
+
+
 
 
 #Login information CRUD
@@ -148,30 +386,157 @@ def get_login_logs():
 
 
 #File Upload CRUD
-def add_uploaded_file(file_name, file_type, uploader_email, file_url):
+def add_uploaded_file(file_name, file_type, uploader_email, file_url, content_hash=None, alias_of=None):
     db = get_db()
     with db.cursor() as c:
         c.execute("""
             INSERT INTO uploadedfiles
-            (file_name, file_type, uploader_email, upload_date, file_url)
-            VALUES (%s, %s, %s, NOW(), %s)
-        """, (file_name, file_type, uploader_email, file_url))
+            (file_name, file_type, uploader_email, upload_date, file_url, content_hash, alias_of)
+            VALUES (%s, %s, %s, NOW(), %s, %s, %s)
+        """, (file_name, file_type, uploader_email, file_url, content_hash, alias_of))
+    return True
+
+
+def find_uploaded_file_by_hash(content_hash, exclude_name=None):
+    """Earliest completed upload with this content (the one that owns the Drive file), or None."""
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            SELECT file_name, file_type, uploader_email, upload_date, file_url, content_hash, alias_of
+            FROM uploadedfiles
+            WHERE content_hash = %s AND file_url <> '' AND NOT (file_name <=> %s)
+            ORDER BY alias_of IS NOT NULL, upload_date
+            LIMIT 1
+        """, (content_hash, exclude_name))
+        return c.fetchone()
+
+
+# A reservation (empty file_url) older than this is treated as an abandoned upload.
+RESERVATION_TIMEOUT_MINUTES = 60
+
+
+def reserve_uploaded_file(file_name, file_type, uploader_email, content_hash=None):
+    """
+    Claim a file name before uploading by inserting its record with an
+    empty file_url. The unique index on file_name makes this atomic:
+    returns False if the name is already taken (or being uploaded).
+    """
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            DELETE FROM uploadedfiles
+            WHERE file_name = %s AND file_url = ''
+              AND upload_date < NOW() - INTERVAL %s MINUTE
+        """, (file_name, RESERVATION_TIMEOUT_MINUTES))
+        try:
+            # A taken name is the expected "no" answer, not a query error.
+            with c.expecting(pymysql.err.IntegrityError):
+                c.execute("""
+                    INSERT INTO uploadedfiles
+                    (file_name, file_type, uploader_email, upload_date, file_url, content_hash)
+                    VALUES (%s, %s, %s, NOW(), '', %s)
+                """, (file_name, file_type, uploader_email, content_hash))
+        except pymysql.err.IntegrityError:
+            return False
+    return True
+
+
+def complete_uploaded_file(file_name, file_url, alias_of=None):
+    """Fill in a reserved record once its upload has finished."""
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            UPDATE uploadedfiles
+            SET file_url = %s, alias_of = %s
+            WHERE file_name = %s AND file_url = ''
+        """, (file_url, alias_of, file_name))
+    return True
+
+
+def release_uploaded_file(file_name):
+    """Drop a reservation whose upload failed."""
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            DELETE FROM uploadedfiles WHERE file_name = %s AND file_url = ''
+        """, (file_name,))
     return True
 
 
+def duplicate_file_names():
+    """File names with more than one uploadedfiles record: name, records, distinct URLs."""
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            SELECT file_name, COUNT(*) AS records, COUNT(DISTINCT file_url) AS urls
+            FROM uploadedfiles
+            GROUP BY file_name
+            HAVING COUNT(*) > 1
+            ORDER BY file_name
+        """)
+        return c.fetchall()
+
+
+def dedupe_uploaded_file_names():
+    """
+    Remove the uploadedfiles records that are redundant copies of another
+    record with the same name: reservations (empty file_url) of a name that
+    has a completed upload, and repeats of the same name and URL. Records of
+    one name with different URLs are left alone; those need an admin.
+    Returns duplicate_file_names() afterwards.
+    """
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            DELETE u FROM uploadedfiles u
+            JOIN (
+                SELECT DISTINCT file_name FROM uploadedfiles WHERE file_url <> ''
+            ) done ON done.file_name = u.file_name
+            WHERE u.file_url = '' OR u.file_url IS NULL
+        """)
+        c.execute("""
+            SELECT file_name, file_url, COUNT(*) AS records
+            FROM uploadedfiles
+            GROUP BY file_name, file_url
+            HAVING COUNT(*) > 1
+        """)
+        repeats = c.fetchall()
+        # No key tells the copies apart, so keep one and delete the rest.
+        for row in repeats:
+            c.execute("""
+                DELETE FROM uploadedfiles
+                WHERE file_name = %s AND file_url <=> %s
+                LIMIT %s
+            """, (row["file_name"], row["file_url"], row["records"] - 1))
+    return duplicate_file_names()
+
+
 def delete_uploaded_file(file_name):
     db = get_db()
     with db.cursor() as c:
         c.execute("DELETE FROM uploadedfiles WHERE file_name = %s", (file_name,))
+    delete_precomputed_for_file(file_name)
     return True
 
 
+def get_uploaded_file(file_name):
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            SELECT file_name, file_type, uploader_email, upload_date, file_url, content_hash, alias_of
+            FROM uploadedfiles
+            WHERE file_name = %s
+        """, (file_name,))
+        return c.fetchone()
+
+
 def get_uploaded_files():
     db = get_db()
     with db.cursor() as c:
         c.execute("""
-            SELECT file_name, file_type, uploader_email, upload_date, file_url
+            SELECT file_name, file_type, uploader_email, upload_date, file_url, content_hash, alias_of
             FROM uploadedfiles
+            WHERE NOT (file_url <=> '')
             ORDER BY upload_date DESC
         """)
         return c.fetchall()
@@ -232,41 +597,908 @@ def load_budget_state_monthly(file_name: str):
 
     return df[required]
 
-def save_budget_state_monthly(file_name, df_melted, user_email):
+
+def _upsert_state_rows(c, file_name, df_melted, user_email, now):
+    """Long-layout upsert of melted rows on an open cursor."""
+    rows = df_melted.to_dict(orient="records")
+    for r in rows:
+        c.execute("""
+            INSERT INTO budget_state
+            (file_name, category, subcategory, month, amount, status_category, updated_by, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+
+            ON DUPLICATE KEY UPDATE
+                amount = VALUES(amount),
+                status_category = VALUES(status_category),
+                updated_by = VALUES(updated_by),
+                updated_at = VALUES(updated_at)
+        """, (
+            file_name,
+            r["Category"],
+            r["Sub-Category"],
+            r["Month"],
+            r["Amount"],
+            r["Status Category"],
+            user_email,
+            now
+        ))
+
+
+def get_budget_state_summary(file_name, by_month=False):
     """
-    Saves budget-state monthly classification using MySQL UPSERT.
-    Only inserts new rows or updates existing ones.
+    Total amount per status category of a budget file (per status and
+    month when by_month is True), aggregated by MySQL.
+    Always returns a DataFrame with "Status Category", ["Month",] "Total".
     """
+    group_cols = "status_category, month" if by_month else "status_category"
+
+    if budget_state_layout() == "wide":
+        ensure_budget_state_wide(file_name)
+        # Unpivot the twelve month columns inside the query.
+        source = " UNION ALL ".join(
+            f"SELECT '{m}' AS month, {s_col} AS status_category, {a_col} AS amount "
+            f"FROM budget_state_wide WHERE file_name = %s"
+            for m, s_col, a_col in zip(STATE_MONTHS, WIDE_STATUS_COLS, WIDE_AMOUNT_COLS)
+        )
+        sql = f"""
+            SELECT {group_cols}, COALESCE(SUM(amount), 0) AS total
+            FROM ({source}) AS cells
+            WHERE status_category IS NOT NULL
+            GROUP BY {group_cols}
+        """
+        params = (file_name,) * len(STATE_MONTHS)
+    else:
+        sql = f"""
+            SELECT {group_cols}, COALESCE(SUM(amount), 0) AS total
+            FROM budget_state
+            WHERE file_name = %s AND status_category IS NOT NULL
+            GROUP BY {group_cols}
+        """
+        params = (file_name,)
+
     db = get_db()
+    with db.cursor() as c:
+        c.execute(sql, params)
+        rows = c.fetchall()
+
+    columns = ["Status Category"] + (["Month"] if by_month else []) + ["Total"]
+    if not rows:
+        return pd.DataFrame(columns=columns)
+
+    df = pd.DataFrame(rows).rename(columns={
+        "status_category": "Status Category",
+        "month": "Month",
+        "total": "Total",
+    })
+    df["Total"] = df["Total"].astype(float)
+    return df[columns]
+
+
+def migrate_budget_state_to_wide(file_name):
+    """
+    Copy the long-layout budget_state rows of a file into budget_state_wide
+    with one INSERT ... SELECT (conditional aggregation per month). Rows
+    already present in the wide table are kept.
+    """
+    pivot_cols = ",\n                ".join(
+        f"MAX(CASE WHEN month = '{m}' THEN status_category END), "
+        f"MAX(CASE WHEN month = '{m}' THEN amount END)"
+        for m in STATE_MONTHS
+    )
+    wide_cols = ", ".join(
+        f"{s_col}, {a_col}" for s_col, a_col in zip(WIDE_STATUS_COLS, WIDE_AMOUNT_COLS)
+    )
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    rows = df_melted.to_dict(orient="records")
+    db = get_db()
+    with db.cursor() as c:
+        c.execute(f"""
+            INSERT IGNORE INTO budget_state_wide
+            (file_name, category, subcategory, {wide_cols}, updated_by, updated_at)
+            SELECT
+                file_name, category, subcategory,
+                {pivot_cols},
+                MAX(updated_by), MAX(updated_at)
+            FROM budget_state
+            WHERE file_name = %s
+            GROUP BY file_name, category, subcategory
+        """, (file_name,))
+        c.execute("""
+            INSERT IGNORE INTO budget_state_migrations (file_name, migrated_at)
+            VALUES (%s, %s)
+        """, (file_name, now))
+    return True
+
+
+def ensure_budget_state_wide(file_name):
+    """Migrate a file to the wide layout the first time it is used (lazy, per file)."""
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            SELECT 1 FROM budget_state_migrations WHERE file_name = %s
+        """, (file_name,))
+        migrated = c.fetchone() is not None
+    if not migrated:
+        migrate_budget_state_to_wide(file_name)
+    return True
+
+
+def load_budget_state_grid(file_name):
+    """
+    Loads the saved status of every sub-category and month of a budget
+    file, shaped like the dashboard grid: Category, Sub-Category, January..December.
+    """
+    columns = ["Category", "Sub-Category"] + STATE_MONTHS
+
+    if budget_state_layout() != "wide":
+        saved_state = load_budget_state_monthly(file_name)
+        if saved_state.empty:
+            return pd.DataFrame(columns=columns)
+        grid = saved_state.pivot_table(
+            index=["Category", "Sub-Category"],
+            columns="Month",
+            values="Status Category",
+            aggfunc="first"
+        ).reset_index()
+        grid.columns.name = None
+        for m in STATE_MONTHS:
+            if m not in grid.columns:
+                grid[m] = None
+        return grid[columns]
 
+    ensure_budget_state_wide(file_name)
+    status_cols = ", ".join(
+        f"{s_col} AS `{m}`" for m, s_col in zip(STATE_MONTHS, WIDE_STATUS_COLS)
+    )
+    db = get_db()
     with db.cursor() as c:
-        for r in rows:
+        c.execute(f"""
+            SELECT category AS `Category`, subcategory AS `Sub-Category`, {status_cols}
+            FROM budget_state_wide
+            WHERE file_name = %s
+        """, (file_name,))
+        rows = c.fetchall()
+
+    if not rows:
+        return pd.DataFrame(columns=columns)
+    return pd.DataFrame(rows, columns=columns)
+
+
+def _upsert_grid_rows(c, file_name, grid_df, user_email, now):
+    """Write the grid on an open cursor, in the configured layout."""
+    if budget_state_layout() != "wide":
+        melted_status = grid_df.melt(
+            id_vars=["Category", "Sub-Category"], value_vars=STATE_MONTHS,
+            var_name="Month", value_name="Status Category"
+        )
+        melted_amounts = grid_df.rename(
+            columns={f"{m} Amount": m for m in STATE_MONTHS}
+        ).melt(
+            id_vars=["Category", "Sub-Category"], value_vars=STATE_MONTHS,
+            var_name="Month", value_name="Amount"
+        )
+        final_melted = melted_status.merge(
+            melted_amounts, on=["Category", "Sub-Category", "Month"], how="left"
+        )
+        final_melted = final_melted.astype(object).where(pd.notnull(final_melted), None)
+        _upsert_state_rows(c, file_name, final_melted, user_email, now)
+        return
+
+    value_cols = [col for m in STATE_MONTHS for col in (m, f"{m} Amount")]
+    grid = grid_df[["Category", "Sub-Category"] + value_cols].astype(object)
+    grid = grid.where(pd.notnull(grid), None)
+    rows = [
+        (file_name, *values, user_email, now)
+        for values in grid.itertuples(index=False, name=None)
+    ]
+
+    wide_cols = [col for pair in zip(WIDE_STATUS_COLS, WIDE_AMOUNT_COLS) for col in pair]
+    placeholders = ", ".join(["%s"] * (len(wide_cols) + 5))
+    updates = ",\n            ".join(
+        f"{col} = VALUES({col})" for col in wide_cols + ["updated_by", "updated_at"]
+    )
+    c.executemany(f"""
+        INSERT INTO budget_state_wide
+        (file_name, category, subcategory, {", ".join(wide_cols)}, updated_by, updated_at)
+        VALUES ({placeholders})
+
+        ON DUPLICATE KEY UPDATE
+            {updates}
+    """, rows)
+
+
+def save_budget_state_grid(file_name, grid_df, user_email, base_version=None, base_grid=None):
+    """
+    Saves the dashboard grid (Category, Sub-Category, "<Month> Amount" and
+    <Month> status columns) and appends the changed cells to
+    budget_state_history.
+
+    With base_version (the state version the editor was loaded at) and
+    base_grid (the statuses it showed), the save only goes through if
+    nobody saved in between. Otherwise the edits are merged with the newer
+    state cell by cell and the save is retried: cells only one side changed
+    merge cleanly; cells both sides changed differently keep the other
+    user's status and are reported back.
+
+    Returns {"version": new state version, "grid": grid that was saved,
+    "conflicts": DataFrame of Category, Sub-Category, Month, Your Status,
+    Their Status}.
+    """
+    if base_version is not None and base_grid is None:
+        raise ValueError("base_grid is required with base_version: without it edits cannot be merged.")
+    if budget_state_layout() == "wide":
+        ensure_budget_state_wide(file_name)
+    ensure_state_baseline(file_name)
+
+    conflicts = []
+    for _ in range(SAVE_ATTEMPTS):
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        db = get_db()
+        db.begin()
+        try:
+            with db.cursor() as c:
+                c.execute("""
+                    INSERT IGNORE INTO budget_state_versions (file_name, version, updated_at)
+                    VALUES (%s, 0, %s)
+                """, (file_name, now))
+                # Claim the next version; the row lock serialises writers.
+                if base_version is None:
+                    c.execute("""
+                        UPDATE budget_state_versions
+                        SET version = version + 1, updated_at = %s
+                        WHERE file_name = %s
+                    """, (now, file_name))
+                else:
+                    c.execute("""
+                        UPDATE budget_state_versions
+                        SET version = version + 1, updated_at = %s
+                        WHERE file_name = %s AND version = %s
+                    """, (now, file_name, base_version))
+
+                if c.rowcount == 1:
+                    c.execute("""
+                        SELECT version FROM budget_state_versions WHERE file_name = %s
+                    """, (file_name,))
+                    new_version = c.fetchone()["version"]
+                    # Other writers wait on the version row, so this is the state being replaced.
+                    previous = load_budget_state_grid(file_name)
+                    _upsert_grid_rows(c, file_name, grid_df, user_email, now)
+                    _insert_history(c, file_name, grid_changes(previous, grid_df), user_email, now)
+                    db.commit()
+                    break
+            db.rollback()
+        except Exception:
+            db.rollback()
+            raise
+
+        # Someone saved since the editor loaded: merge onto their state and retry.
+        theirs_version = get_budget_state_version(file_name)
+        theirs = load_budget_state_grid(file_name)
+        grid_df, new_conflicts = merge_state_grids(base_grid, grid_df, theirs)
+        conflicts.append(new_conflicts)
+        base_version, base_grid = theirs_version, theirs
+    else:
+        raise RuntimeError("Budget state is changing too quickly to save; please try again.")
+
+    maybe_checkpoint_budget_state(file_name)
+
+    conflict_cols = ["Category", "Sub-Category", "Month", "Your Status", "Their Status"]
+    conflicts = [df for df in conflicts if not df.empty]
+    return {
+        "version": new_version,
+        "grid": grid_df,
+        "conflicts": (
+            pd.concat(conflicts, ignore_index=True).drop_duplicates(
+                ["Category", "Sub-Category", "Month"], keep="last"
+            ) if conflicts else pd.DataFrame(columns=conflict_cols)
+        ),
+    }
+
+
+def _bulk_line_filters(categories, subcategory_pattern):
+    """SQL conditions (prefixed with AND) selecting budget lines for a bulk action."""
+    where, params = "", []
+    if categories:
+        where += f" AND category IN ({', '.join(['%s'] * len(categories))})"
+        params += list(categories)
+    if subcategory_pattern:
+        where += " AND subcategory LIKE %s"
+        params.append(subcategory_pattern)
+    return where, params
+
+
+def _status_matches(col, current_status):
+    """Condition on a status column: any (None), unclassified (""), or one status."""
+    if current_status is None:
+        return "TRUE", []
+    if current_status == "":
+        return f"({col} IS NULL OR {col} = '')", []
+    return f"{col} = %s", [current_status]
+
+
+def bulk_classify(file_name, new_status, months, user_email,
+                  categories=None, subcategory_pattern=None, current_status=None):
+    """
+    Set the status of many cells at once, inside MySQL.
+
+    Cells are selected by category (list), sub-category LIKE pattern, month
+    list and current status (None = any, "" = unclassified). Budget lines
+    that were never saved are first added from budget_rows with an
+    INSERT ... SELECT, then one UPDATE sets the status; both run in one
+    transaction. Returns the number of cells (line × month) whose status
+    changed, in either layout.
+    """
+    months = [m for m in STATE_MONTHS if m in months]
+    if not months:
+        return 0
+
+    filters, filter_params = _bulk_line_filters(categories, subcategory_pattern)
+    # Only "any" and "unclassified" can match a cell that has no state row yet.
+    add_missing = current_status in (None, "")
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    if budget_state_layout() == "wide":
+        ensure_budget_state_wide(file_name)
+    ensure_state_baseline(file_name)
+
+    db = get_db()
+    db.begin()
+    try:
+        with db.cursor() as c:
+            if budget_state_layout() == "wide":
+                if add_missing:
+                    c.execute(f"""
+                        INSERT IGNORE INTO budget_state_wide
+                        (file_name, category, subcategory, {", ".join(WIDE_AMOUNT_COLS)}, updated_by, updated_at)
+                        SELECT file_name, category, subcategory, {", ".join(m.lower() for m in STATE_MONTHS)}, %s, %s
+                        FROM budget_rows
+                        WHERE file_name = %s{filters}
+                    """, (user_email, now, file_name, *filter_params))
+
+                sets, set_params, matches, match_params = [], [], [], []
+                changes, change_params = [], []
+                for m in months:
+                    col = f"{m.lower()}_status"
+                    match, params = _status_matches(col, current_status)
+                    sets.append(f"{col} = CASE WHEN {match} THEN %s ELSE {col} END")
+                    set_params += params + [new_status]
+                    matches.append(match)
+                    match_params += params
+                    changes.append(
+                        f"SELECT file_name, category, subcategory, '{m}', {col}, %s, %s, %s "
+                        f"FROM budget_state_wide "
+                        f"WHERE file_name = %s{filters} AND {match} AND NOT ({col} <=> %s)"
+                    )
+                    change_params += [new_status, user_email, now, file_name, *filter_params, *params, new_status]
+
+                c.execute(f"""
+                    INSERT INTO budget_state_history
+                    (file_name, category, subcategory, month, old_status, new_status, changed_by, changed_at)
+                    {" UNION ALL ".join(changes)}
+                """, change_params)
+                # One history record per changed cell.
+                changed = c.rowcount
+
+                c.execute(f"""
+                    UPDATE budget_state_wide
+                    SET {", ".join(sets)}, updated_by = %s, updated_at = %s
+                    WHERE file_name = %s{filters} AND ({" OR ".join(matches)})
+                """, (*set_params, user_email, now, file_name, *filter_params, *match_params))
+            else:
+                month_list = ", ".join(["%s"] * len(months))
+                if add_missing:
+                    cells = " UNION ALL ".join(
+                        f"SELECT file_name, category, subcategory, '{m}' AS month, {m.lower()} AS amount "
+                        f"FROM budget_rows WHERE file_name = %s{filters}"
+                        for m in months
+                    )
+                    c.execute(f"""
+                        INSERT IGNORE INTO budget_state
+                        (file_name, category, subcategory, month, amount, status_category, updated_by, updated_at)
+                        SELECT file_name, category, subcategory, month, amount, NULL, %s, %s
+                        FROM ({cells}) AS cells
+                    """, (user_email, now, *((file_name, *filter_params) * len(months))))
+
+                match, params = _status_matches("status_category", current_status)
+                c.execute(f"""
+                    INSERT INTO budget_state_history
+                    (file_name, category, subcategory, month, old_status, new_status, changed_by, changed_at)
+                    SELECT file_name, category, subcategory, month, status_category, %s, %s, %s
+                    FROM budget_state
+                    WHERE file_name = %s AND month IN ({month_list}){filters} AND {match}
+                        AND NOT (status_category <=> %s)
+                """, (new_status, user_email, now, file_name, *months, *filter_params, *params, new_status))
+                changed = c.rowcount
+
+                c.execute(f"""
+                    UPDATE budget_state
+                    SET status_category = %s, updated_by = %s, updated_at = %s
+                    WHERE file_name = %s AND month IN ({month_list}){filters} AND {match}
+                """, (new_status, user_email, now, file_name, *months, *filter_params, *params))
+
+            # Same transaction as the change, so a concurrent grid save
+            # started from the old version is detected as a conflict.
             c.execute("""
-                INSERT INTO budget_state
-                (file_name, category, subcategory, month, amount, status_category, updated_by, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                INSERT INTO budget_state_versions (file_name, version, updated_at)
+                VALUES (%s, 1, %s)
 
                 ON DUPLICATE KEY UPDATE
-                    amount = VALUES(amount),
-                    status_category = VALUES(status_category),
-                    updated_by = VALUES(updated_by),
+                    version = version + 1,
                     updated_at = VALUES(updated_at)
-            """, (
-                file_name,
-                r["Category"],
-                r["Sub-Category"],
-                r["Month"],
-                r["Amount"],
-                r["Status Category"],
-                user_email,
-                now
-            ))
+            """, (file_name, now))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
 
+    maybe_checkpoint_budget_state(file_name)
+    return changed
+
+
+#Classification history (append-only change log + periodic checkpoints)
+# A checkpoint is the full status grid of a file; at most this many change
+# records separate two checkpoints, which bounds a point-in-time rebuild.
+CHECKPOINT_EVERY = 500
+
+
+def grid_changes(old_grid, new_grid):
+    """
+    Cells whose status differs between two grids, as a DataFrame of
+    Category, Sub-Category, Month, Old Status, New Status.
+    """
+    keys = ["Category", "Sub-Category"]
+
+    def cells(grid):
+        grid = grid.drop_duplicates(keys, keep="last")
+        return grid.melt(id_vars=keys, value_vars=STATE_MONTHS, var_name="Month", value_name="Status")
+
+    # Saves only write the lines in the new grid, so only those can change.
+    merged = cells(old_grid).merge(
+        cells(new_grid), on=keys + ["Month"], how="right", suffixes=(" Old", " New")
+    )
+    changed = merged["Status Old"].fillna("") != merged["Status New"].fillna("")
+    out = merged.loc[changed, keys + ["Month", "Status Old", "Status New"]]
+    return out.rename(columns={"Status Old": "Old Status", "Status New": "New Status"})
+
+
+def merge_state_grids(base, mine, theirs):
+    """
+    Three-way merge of status grids. mine (the edited grid, which keeps its
+    shape and amount columns) and theirs (the newer saved state) both
+    started from base. Returns (merged grid, conflicts) where conflicts
+    lists the cells both sides changed to different statuses; those keep
+    their status in the merged grid.
+    """
+    if base is None:
+        # Without the base every filled cell of mine would count as an edit
+        # and silently overwrite the other side's changes.
+        raise ValueError("merge_state_grids needs the base grid both sides started from.")
+    keys = ["Category", "Sub-Category"]
+
+    def cells(grid, name):
+        grid = grid.drop_duplicates(keys, keep="last")
+        return grid.melt(id_vars=keys, value_vars=STATE_MONTHS, var_name="Month", value_name=name)
+
+    merged = (
+        cells(mine, "mine")
+        .merge(cells(base, "base"), on=keys + ["Month"], how="left")
+        .merge(cells(theirs, "theirs"), on=keys + ["Month"], how="left")
+    )
+    m, b, t = (merged[col].fillna("") for col in ("mine", "base", "theirs"))
+    mine_changed, theirs_changed = m != b, t != b
+    conflict = mine_changed & theirs_changed & (m != t)
+    merged["status"] = merged["mine"].where(mine_changed & ~conflict, merged["theirs"])
+
+    statuses = merged.pivot(index=keys, columns="Month", values="status")
+    result = mine.copy()
+    idx = pd.MultiIndex.from_frame(result[keys])
+    for month in STATE_MONTHS:
+        values = statuses[month].reindex(idx).to_numpy()
+        result[month] = pd.Series(values, index=result.index).where(lambda v: v.notna() & (v != ""), None)
+
+    conflicts = merged.loc[conflict, keys + ["Month", "mine", "theirs"]].rename(
+        columns={"mine": "Your Status", "theirs": "Their Status"}
+    )
+    return result, conflicts.reset_index(drop=True)
+
+
+def _insert_history(c, file_name, changes, user_email, changed_at):
+    """Append change records (see grid_changes) on an open cursor."""
+    if changes.empty:
+        return 0
+    changes = changes.astype(object).where(pd.notnull(changes), None)
+    rows = [
+        (file_name, cat, sub, month, old, new, user_email, changed_at)
+        for cat, sub, month, old, new in changes[
+            ["Category", "Sub-Category", "Month", "Old Status", "New Status"]
+        ].itertuples(index=False, name=None)
+    ]
+    c.executemany("""
+        INSERT INTO budget_state_history
+        (file_name, category, subcategory, month, old_status, new_status, changed_by, changed_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, rows)
+    return len(rows)
+
+
+def _grid_to_bytes(grid):
+    import io
+    buf = io.BytesIO()
+    grid.astype("string").to_parquet(buf, index=False)
+    return buf.getvalue()
+
+
+def _grid_from_bytes(payload):
+    import io
+    grid = pd.read_parquet(io.BytesIO(payload)).astype(object)
+    return grid.where(pd.notnull(grid), None)
+
+
+def save_state_checkpoint(file_name, grid, last_history_id):
+    db = get_db()
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with db.cursor() as c:
+        c.execute("""
+            INSERT INTO budget_state_checkpoints (file_name, taken_at, last_history_id, payload)
+            VALUES (%s, %s, %s, %s)
+        """, (file_name, now, last_history_id, _grid_to_bytes(grid)))
     return True
 
 
+def ensure_state_baseline(file_name, current_grid=None):
+    """
+    Checkpoint the state a file had before its first recorded change, so
+    history rebuilds start from what was there when logging began.
+    """
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            SELECT 1 FROM budget_state_checkpoints WHERE file_name = %s LIMIT 1
+        """, (file_name,))
+        if c.fetchone() is not None:
+            return False
+    if current_grid is None:
+        current_grid = load_budget_state_grid(file_name)
+    save_state_checkpoint(file_name, current_grid[["Category", "Sub-Category"] + STATE_MONTHS], 0)
+    return True
+
+
+def maybe_checkpoint_budget_state(file_name):
+    """Take a checkpoint once CHECKPOINT_EVERY changes have piled up since the last one."""
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            SELECT COALESCE(MAX(last_history_id), 0) AS last_id
+            FROM budget_state_checkpoints
+            WHERE file_name = %s
+        """, (file_name,))
+        last_id = c.fetchone()["last_id"]
+        c.execute("""
+            SELECT COUNT(*) AS pending, MAX(id) AS newest
+            FROM budget_state_history
+            WHERE file_name = %s AND id > %s
+        """, (file_name, last_id))
+        row = c.fetchone()
+
+    if row["pending"] < CHECKPOINT_EVERY:
+        return False
+    # newest is read before the grid: a change landing in between is simply
+    # replayed again on top of the checkpoint, which is harmless.
+    save_state_checkpoint(file_name, load_budget_state_grid(file_name), row["newest"])
+    return True
+
+
+def get_state_history(file_name, since=None, until=None, limit=500):
+    """Most recent change records of a file (optionally within a time range)."""
+    where, params = "file_name = %s", [file_name]
+    if since is not None:
+        where += " AND changed_at >= %s"
+        params.append(since)
+    if until is not None:
+        where += " AND changed_at <= %s"
+        params.append(until)
+    db = get_db()
+    with db.cursor() as c:
+        c.execute(f"""
+            SELECT changed_at, changed_by, category, subcategory, month, old_status, new_status
+            FROM budget_state_history
+            WHERE {where}
+            ORDER BY id DESC
+            LIMIT %s
+        """, (*params, limit))
+        return c.fetchall()
+
+
+def load_budget_state_as_of(file_name, as_of):
+    """
+    Rebuild the status grid of a file as it was at as_of (datetime): the
+    latest checkpoint taken by then plus the changes recorded after it.
+    Returns None when no history was recorded for the file by that time.
+    """
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            SELECT last_history_id, payload
+            FROM budget_state_checkpoints
+            WHERE file_name = %s AND taken_at <= %s
+            ORDER BY taken_at DESC, id DESC
+            LIMIT 1
+        """, (file_name, as_of))
+        checkpoint = c.fetchone()
+        if checkpoint is None:
+            return None
+        c.execute("""
+            SELECT category, subcategory, month, new_status
+            FROM budget_state_history
+            WHERE file_name = %s AND id > %s AND changed_at <= %s
+            ORDER BY id
+        """, (file_name, checkpoint["last_history_id"], as_of))
+        deltas = c.fetchall()
+
+    lines = {
+        (r["Category"], r["Sub-Category"]): r
+        for r in _grid_from_bytes(checkpoint["payload"]).to_dict(orient="records")
+    }
+    # Replay in id order; the last change per cell wins.
+    for d in deltas:
+        line = lines.setdefault(
+            (d["category"], d["subcategory"]),
+            {"Category": d["category"], "Sub-Category": d["subcategory"], **dict.fromkeys(STATE_MONTHS)},
+        )
+        line[d["month"]] = d["new_status"]
+
+    return pd.DataFrame(list(lines.values()), columns=["Category", "Sub-Category"] + STATE_MONTHS)
+
+
+def get_budget_state_version(file_name):
+    """Current state version of a budget file (0 if it was never saved)."""
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            SELECT version FROM budget_state_versions WHERE file_name = %s
+        """, (file_name,))
+        row = c.fetchone()
+    return row["version"] if row else 0
+
+
+
+
+
+#Precomputed report data (filled by the background worker in functions/precompute.py)
+def save_parsed_file(file_name, file_kind, payload, row_count, fx_provider=None, fx_fetched_at=None):
+    db = get_db()
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with db.cursor() as c:
+        c.execute("""
+            INSERT INTO parsed_files
+            (file_name, file_kind, payload, row_count, fx_provider, fx_fetched_at, parsed_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+
+            ON DUPLICATE KEY UPDATE
+                file_kind = VALUES(file_kind),
+                payload = VALUES(payload),
+                row_count = VALUES(row_count),
+                fx_provider = VALUES(fx_provider),
+                fx_fetched_at = VALUES(fx_fetched_at),
+                parsed_at = VALUES(parsed_at)
+        """, (file_name, file_kind, payload, row_count, fx_provider, fx_fetched_at, now))
+    return True
+
+
+def get_parsed_file(file_name):
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            SELECT file_name, file_kind, payload, row_count, fx_provider, fx_fetched_at, parsed_at
+            FROM parsed_files
+            WHERE file_name = %s
+        """, (file_name,))
+        return c.fetchone()
+
+
+def save_report_aggregates(budget_file, expense_file, budget_type, subcategory_view, category_view, hierarchy_view):
+    db = get_db()
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with db.cursor() as c:
+        c.execute("""
+            INSERT INTO report_aggregates
+            (budget_file, expense_file, budget_type, subcategory_view, category_view, hierarchy_view, computed_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+
+            ON DUPLICATE KEY UPDATE
+                subcategory_view = VALUES(subcategory_view),
+                category_view = VALUES(category_view),
+                hierarchy_view = VALUES(hierarchy_view),
+                computed_at = VALUES(computed_at)
+        """, (budget_file, expense_file, budget_type, subcategory_view, category_view, hierarchy_view, now))
+    return True
+
+
+def get_report_aggregates(budget_file, expense_file, budget_type):
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            SELECT subcategory_view, category_view, hierarchy_view, computed_at
+            FROM report_aggregates
+            WHERE budget_file = %s AND expense_file = %s AND budget_type = %s
+        """, (budget_file, expense_file, budget_type))
+        return c.fetchone()
+
+
+def delete_precomputed_for_file(file_name):
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("DELETE FROM parsed_files WHERE file_name = %s", (file_name,))
+        c.execute("DELETE FROM budget_rows WHERE file_name = %s", (file_name,))
+        c.execute("DELETE FROM expense_rows WHERE file_name = %s", (file_name,))
+        c.execute("""
+            DELETE FROM report_aggregates
+            WHERE budget_file = %s OR expense_file = %s
+        """, (file_name, file_name))
+    return True
+
+
+def copy_parsed_file(source_name, target_name):
+    """
+    Copy the stored parse of one file (parsed_files plus its budget/expense
+    rows) to another name, inside MySQL. Returns False if the source has
+    not been parsed yet.
+    """
+    db = get_db()
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with db.cursor() as c:
+        c.execute("""
+            INSERT INTO parsed_files
+            (file_name, file_kind, payload, row_count, fx_provider, fx_fetched_at, parsed_at)
+            SELECT %s, file_kind, payload, row_count, fx_provider, fx_fetched_at, %s
+            FROM parsed_files
+            WHERE file_name = %s
+
+            ON DUPLICATE KEY UPDATE
+                file_kind = VALUES(file_kind),
+                payload = VALUES(payload),
+                row_count = VALUES(row_count),
+                fx_provider = VALUES(fx_provider),
+                fx_fetched_at = VALUES(fx_fetched_at),
+                parsed_at = VALUES(parsed_at)
+        """, (target_name, now, source_name))
+        if c.rowcount == 0:
+            return False
+
+        c.execute("DELETE FROM budget_rows WHERE file_name = %s", (target_name,))
+        c.execute("""
+            INSERT INTO budget_rows
+            (file_name, category, subcategory, january, february, march, april, may, june,
+             july, august, september, october, november, december, total)
+            SELECT %s, category, subcategory, january, february, march, april, may, june,
+                   july, august, september, october, november, december, total
+            FROM budget_rows
+            WHERE file_name = %s
+        """, (target_name, source_name))
+
+        c.execute("DELETE FROM expense_rows WHERE file_name = %s", (target_name,))
+        c.execute("""
+            INSERT INTO expense_rows
+            (file_name, expense_date, category, subcategory, vendor, classification, amount_usd)
+            SELECT %s, expense_date, category, subcategory, vendor, classification, amount_usd
+            FROM expense_rows
+            WHERE file_name = %s
+        """, (target_name, source_name))
+    return True
+
+
+def replace_budget_rows(file_name, rows):
+    """
+    Store the normalized lines of a budget file. rows are tuples of
+    (category, subcategory, january, ..., december, total).
+    """
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("DELETE FROM budget_rows WHERE file_name = %s", (file_name,))
+        c.executemany("""
+            INSERT INTO budget_rows
+            (file_name, category, subcategory, january, february, march, april, may, june,
+             july, august, september, october, november, december, total)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, [(file_name, *r) for r in rows])
+    return True
+
+
+def replace_expense_rows(file_name, rows):
+    """
+    Store the normalized lines of an expense file. rows are tuples of
+    (expense_date, category, subcategory, vendor, classification, amount_usd).
+    """
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("DELETE FROM expense_rows WHERE file_name = %s", (file_name,))
+        c.executemany("""
+            INSERT INTO expense_rows
+            (file_name, expense_date, category, subcategory, vendor, classification, amount_usd)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, [(file_name, *r) for r in rows])
+    return True
+
+
+def has_budget_rows(file_name):
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("SELECT 1 FROM budget_rows WHERE file_name = %s LIMIT 1", (file_name,))
+        return c.fetchone() is not None
+
+
+def get_budget_totals(file_names):
+    """Budgeted total per (file, category, subcategory) for several budget files."""
+    if not file_names:
+        return []
+    placeholders = ", ".join(["%s"] * len(file_names))
+    db = get_db()
+    with db.cursor() as c:
+        c.execute(f"""
+            SELECT file_name, category, subcategory, SUM(total) AS budgeted
+            FROM budget_rows
+            WHERE file_name IN ({placeholders})
+            GROUP BY file_name, category, subcategory
+        """, tuple(file_names))
+        return c.fetchall()
+
+
+def get_expense_totals(file_names):
+    """USD spend per (file, classification, category, subcategory) for several expense files."""
+    if not file_names:
+        return []
+    placeholders = ", ".join(["%s"] * len(file_names))
+    db = get_db()
+    with db.cursor() as c:
+        c.execute(f"""
+            SELECT file_name, classification, category, subcategory, SUM(amount_usd) AS spent
+            FROM expense_rows
+            WHERE file_name IN ({placeholders})
+            GROUP BY file_name, classification, category, subcategory
+        """, tuple(file_names))
+        return c.fetchall()
+
+
+def add_precompute_job(file_name):
+    """Record a queued job and return its id."""
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            INSERT INTO precompute_jobs (file_name, status, enqueued_at)
+            VALUES (%s, 'queued', NOW())
+        """, (file_name,))
+        return c.lastrowid
+
+
+def update_precompute_job(job_id, status, detail=None):
+    db = get_db()
+    with db.cursor() as c:
+        if status == "running":
+            c.execute("""
+                UPDATE precompute_jobs
+                SET status = %s, detail = %s, started_at = NOW()
+                WHERE id = %s
+            """, (status, detail, job_id))
+        else:
+            c.execute("""
+                UPDATE precompute_jobs
+                SET status = %s, detail = %s, finished_at = NOW()
+                WHERE id = %s
+            """, (status, detail, job_id))
+    return True
+
+
+def get_latest_precompute_job(file_name):
+    db = get_db()
+    with db.cursor() as c:
+        c.execute("""
+            SELECT id, file_name, status, detail, enqueued_at, started_at, finished_at
+            FROM precompute_jobs
+            WHERE file_name = %s
+            ORDER BY enqueued_at DESC, id DESC
+            LIMIT 1
+        """, (file_name,))
+        return c.fetchone()
+
 
 
 
@@ -322,4 +1554,5 @@ def seed_admin_user():
             pass
 
     except Exception as e:
-        st.error(f"Error seeding user {e}")
\ No newline at end of file
+        st.error(f"Error seeding user {e}")
+        raise  # the startup step records the failure and retries on the next rerun
\ No newline at end of file
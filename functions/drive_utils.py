@@ -1,16 +1,19 @@
 # Author: Zedaine McDonald
 
-import os
+import hashlib
 import mimetypes
-from datetime import datetime
 import tempfile
+from datetime import datetime
 import streamlit as st
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
 
 # NEW: Import db layer
-from .db import add_uploaded_file, get_uploaded_files
+from .db import (
+    find_uploaded_file_by_hash,
+    reserve_uploaded_file,
+    complete_uploaded_file,
+    release_uploaded_file,
+)
+from .storage import get_storage
 
 # Constants
 SHEET_ID = "1VxrFw6txf_XFf0cxzMbPGHnOn8N5JGeeS0ve5lfLqCU"
@@ -22,15 +25,191 @@ SCOPE = [
     "https://www.googleapis.com/auth/drive.file"
 ]
 
-creds = service_account.Credentials.from_service_account_info(
-    dict(st.secrets["GOOGLE"]), scopes=SCOPE
-)
+
+# ============================================================
+# DRIVE CLIENT (created on first use, shared by the process)
+# ============================================================
+@st.cache_resource(show_spinner=False)
+def drive_credentials():
+    """Service-account credentials; google-auth refreshes the token when it expires."""
+    from google.oauth2 import service_account
+
+    return service_account.Credentials.from_service_account_info(
+        dict(st.secrets["GOOGLE"]), scopes=SCOPE
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_drive_service():
+    """
+    Drive v3 client built once per process from the discovery document
+    bundled with google-api-python-client (no discovery HTTP request).
+
+    The client itself is only used to build requests. httplib2 connections
+    are not thread-safe, so requests are executed with drive_http().
+    """
+    from googleapiclient.discovery import build
+
+    return build(
+        "drive", "v3",
+        credentials=drive_credentials(),
+        static_discovery=True,
+        cache_discovery=False,
+    )
+
+
+def drive_http():
+    """A fresh authorized HTTP transport for executing one request (or batch) on this thread."""
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+
+    return AuthorizedHttp(drive_credentials(), http=httplib2.Http())
+
+
+# ============================================================
+# UPLOADS
+# ============================================================
+# Uploads larger than this go up in resumable chunks; smaller ones in one request.
+RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+# Chunk size for resumable uploads (Drive requires a multiple of 256 KB).
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+# Retries (with exponential backoff) for a failed request or chunk.
+UPLOAD_RETRIES = 5
+
+
+def upload_media(drive_service, metadata, stream, size, mime_type, on_progress=None):
+    """
+    Upload a file-like object to Drive straight from memory and return the
+    new file id. Files above RESUMABLE_THRESHOLD use a resumable session sent
+    in UPLOAD_CHUNK_SIZE chunks; a failed chunk is retried, not the whole file.
+
+    on_progress, if given, is called with the fraction uploaded (0.0–1.0).
+    """
+    from googleapiclient.http import MediaIoBaseUpload
+
+    stream.seek(0)
+    resumable = size > RESUMABLE_THRESHOLD
+    media = MediaIoBaseUpload(
+        stream, mimetype=mime_type, chunksize=UPLOAD_CHUNK_SIZE, resumable=resumable
+    )
+    request = drive_service.files().create(
+        body=metadata,
+        media_body=media,
+        fields="id",
+        supportsAllDrives=True
+    )
+
+    http = drive_http()
+    if not resumable:
+        response = request.execute(http=http, num_retries=UPLOAD_RETRIES)
+    else:
+        response = None
+        while response is None:
+            status, response = request.next_chunk(http=http, num_retries=UPLOAD_RETRIES)
+            if status and on_progress:
+                on_progress(status.progress())
+
+    if on_progress:
+        on_progress(1.0)
+    return response.get("id")
+
+
+# ============================================================
+# DOWNLOADS
+# ============================================================
+# Files up to this size are downloaded into memory; larger ones spill to a temp file.
+DOWNLOAD_SPOOL_BYTES = 32 * 1024 * 1024
+# Downloads arrive in chunks of this size (one ranged request each).
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+# Times a download resumes from its last byte after a chunk fails all its retries.
+DOWNLOAD_RESUMES = 3
+
+
+class DownloadIntegrityError(RuntimeError):
+    """A downloaded file does not match the checksum recorded for it."""
+
+
+def _resumable_error(error):
+    """Transport failures and 429/5xx responses are worth resuming; anything else (403, 404, ...) is final."""
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    if isinstance(error, HttpError):
+        return error.resp.status == 429 or error.resp.status >= 500
+    return isinstance(error, (OSError, httplib2.HttpLib2Error))
+
+
+def download_drive_file(file_id, expected_sha256=None):
+    """
+    Download a Drive file through the service account and return it as a
+    seekable spooled temp file, positioned at the start.
+
+    The body is fetched in DOWNLOAD_CHUNK_SIZE ranged requests; a failed
+    chunk is retried with backoff, and if it still fails with a transient
+    error the download resumes from the last byte received rather than
+    starting over. The result is checked against Drive's md5Checksum and,
+    when given, the SHA-256 recorded at upload (uploadedfiles.content_hash),
+    which also catches a file changed on Drive after it was uploaded.
+    """
+    from googleapiclient.http import MediaIoBaseDownload
+
+    files = get_drive_service().files()
+    meta = files.get(
+        fileId=file_id, fields="md5Checksum, size", supportsAllDrives=True
+    ).execute(http=drive_http(), num_retries=UPLOAD_RETRIES)
+
+    spool = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_BYTES)
+    try:
+        request = files.get_media(fileId=file_id, supportsAllDrives=True)
+        request.http = drive_http()
+        downloader = MediaIoBaseDownload(spool, request, chunksize=DOWNLOAD_CHUNK_SIZE)
+
+        done, resumes = False, 0
+        while not done:
+            try:
+                _, done = downloader.next_chunk(num_retries=UPLOAD_RETRIES)
+            except Exception as e:
+                # The downloader keeps its byte offset, so the next call
+                # requests the remaining range only.
+                resumes += 1
+                if resumes > DOWNLOAD_RESUMES or not _resumable_error(e):
+                    raise
+                print(f"⚠️ Drive download of {file_id} interrupted, resuming: {e}")
+
+        md5, sha256 = hashlib.md5(), hashlib.sha256()
+        spool.seek(0)
+        for chunk in iter(lambda: spool.read(DOWNLOAD_CHUNK_SIZE), b""):
+            md5.update(chunk)
+            sha256.update(chunk)
+        if meta.get("md5Checksum") and md5.hexdigest() != meta["md5Checksum"]:
+            raise DownloadIntegrityError(f"Checksum mismatch for Drive file {file_id}")
+        if expected_sha256 and sha256.hexdigest() != expected_sha256:
+            raise DownloadIntegrityError(
+                f"Drive file {file_id} does not match the content recorded at upload"
+            )
+        spool.seek(0)
+        return spool
+    except Exception:
+        spool.close()
+        raise
+
+
+def content_hash(stream, chunk_size=UPLOAD_CHUNK_SIZE):
+    """SHA-256 of a file-like object, read chunk by chunk from the start."""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
 
 
-def upload_to_drive_and_log(file, file_type, uploader_email, custom_name):
+def upload_to_drive_and_log(file, file_type, uploader_email, custom_name, on_progress=None):
     """
-    Upload a file to Google Drive and log metadata in MySQL.
+    Upload a file to the configured storage backend (Google Drive by
+    default, see functions/storage.py) and log metadata in MySQL.
     The Google Sheets dependency is removed.
+    on_progress(fraction) is called as the upload proceeds.
     """
 
     # Decide suffix based on file_type (case-insensitive)
@@ -45,67 +224,137 @@ def upload_to_drive_and_log(file, file_type, uploader_email, custom_name):
     # -------------------------------
     # ❗ NEW: Check duplicates in MySQL
     # -------------------------------
-    existing = [row["file_name"] for row in get_uploaded_files()]
-    if tagged_name in existing:
+    # Reserve the name before uploading: the unique index on file_name makes
+    # this atomic, so two concurrent uploads of one name cannot both pass.
+    # It also reclaims a reservation abandoned by a crashed upload.
+    file_hash = content_hash(file)
+    if not reserve_uploaded_file(tagged_name, file_type, uploader_email, file_hash):
         st.error(f"❌ A file named '{tagged_name}' already exists. Choose a different name.")
         return None
 
-    # Save file temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-        tmp.write(file.getvalue())
-        temp_path = tmp.name
-
-    # Google Drive service
-    drive_service = build("drive", "v3", credentials=creds)
-
-    # Prepare metadata
-    mime_type = mimetypes.guess_type(file.name)[0] or "application/octet-stream"
-    metadata = {
-        "name": tagged_name,
-        "mimeType": mime_type,
-        "parents": [PARENT_FOLDER_ID],
-    }
-    media = MediaFileUpload(temp_path, mimetype=mime_type, resumable=False)
-
-    # Upload file to Drive
-    uploaded_file = drive_service.files().create(
-        body=metadata,
-        media_body=media,
-        fields="id",
-        supportsAllDrives=True
-    ).execute()
-
-    file_id = uploaded_file.get("id")
-    file_url = f"https://drive.google.com/uc?id={file_id}"
-
-    # Make file publicly accessible
     try:
-        drive_service.permissions().create(
-            fileId=file_id,
-            body={"role": "reader", "type": "anyone"},
-            supportsAllDrives=True
-        ).execute()
-    except Exception as e:
-        print("⚠️ Permission setting failed:", e)
+        # -------------------------------
+        # Identical content already uploaded? Link to it instead of re-uploading.
+        # -------------------------------
+        duplicate = find_uploaded_file_by_hash(file_hash, exclude_name=tagged_name)
+        if duplicate:
+            alias_of = duplicate["alias_of"] or duplicate["file_name"]
+            file_url = duplicate["file_url"]
+            st.info(f"ℹ️ Identical content was already uploaded as '{alias_of}'; linked to it instead of uploading again.")
+            if on_progress:
+                on_progress(1.0)
+        else:
+            alias_of = None
 
-    # Remove temp file
-    try:
-        os.remove(temp_path)
-    except Exception as e:
-        print("⚠️ Failed to delete temp file:", e)
+            # Store the file with the configured backend, streamed from the in-memory upload buffer
+            mime_type = mimetypes.guess_type(file.name)[0] or "application/octet-stream"
+            file_url = get_storage().put(tagged_name, file, file.size, mime_type, on_progress=on_progress)
+    except Exception:
+        release_uploaded_file(tagged_name)
+        raise
 
     # ----------------------------------------
     # ❗ NEW: Log metadata to MySQL instead of Sheets
     # ----------------------------------------
     try:
-        add_uploaded_file(
-            file_name=tagged_name,
-            file_type=file_type,
-            uploader_email=uploader_email,
-            file_url=file_url
-        )
+        complete_uploaded_file(tagged_name, file_url, alias_of=alias_of)
     except Exception as e:
         st.error(f"⚠️ Failed to log file metadata to MySQL: {e}")
+        release_uploaded_file(tagged_name)
         return None
 
+    # Parse + precompute report aggregates in the background.
+    # A failure here only means "Generate Report" computes on demand.
+    try:
+        # Imported here: precompute pulls in pandas and the parsers.
+        from .precompute import enqueue_precompute
+
+        enqueue_precompute(tagged_name)
+    except Exception as e:
+        print("⚠️ Failed to enqueue precompute job:", e)
+
     return file_url
+
+
+# ============================================================
+# BATCHES AND FOLDER SYNC
+# ============================================================
+# Drive accepts at most 100 calls in one batch request.
+BATCH_LIMIT = 100
+LIST_FIELDS = "nextPageToken, files(id, name, size, modifiedTime)"
+
+
+def drive_batch(requests):
+    """
+    Execute Drive requests in batch HTTP calls (BATCH_LIMIT per call).
+    Returns a list of (response, exception) in the order of requests.
+    """
+    results = [None] * len(requests)
+
+    def collect(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    service = get_drive_service()
+    for start in range(0, len(requests), BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=collect)
+        for i, request in enumerate(requests[start:start + BATCH_LIMIT], start):
+            batch.add(request, request_id=str(i))
+        batch.execute(http=drive_http())
+    return results
+
+
+def drive_file_id(file_url):
+    """Drive file id from a stored file_url (https://drive.google.com/uc?id=<id>)."""
+    from urllib.parse import urlparse, parse_qs
+
+    return parse_qs(urlparse(str(file_url or "")).query).get("id", [None])[0]
+
+
+def _not_found(exception):
+    return getattr(getattr(exception, "resp", None), "status", None) == 404
+
+
+def get_drive_files(file_ids):
+    """Metadata for several files in batched lookups: {file_id: metadata or None if missing}."""
+    files = get_drive_service().files()
+    results = drive_batch([
+        files.get(fileId=fid, fields="id, name, size, trashed", supportsAllDrives=True)
+        for fid in file_ids
+    ])
+    found = {}
+    for fid, (response, exception) in zip(file_ids, results):
+        if exception is not None and not _not_found(exception):
+            raise exception
+        found[fid] = response
+    return found
+
+
+def delete_drive_files(file_ids):
+    """Delete several Drive files in batched calls. Returns the ids that could not be deleted."""
+    files = get_drive_service().files()
+    results = drive_batch([files.delete(fileId=fid, supportsAllDrives=True) for fid in file_ids])
+    # Already gone counts as deleted.
+    return [
+        fid for fid, (_, exception) in zip(file_ids, results)
+        if exception is not None and not _not_found(exception)
+    ]
+
+
+def list_folder_files(folder_id=PARENT_FOLDER_ID):
+    """Every (non-trashed) file in the upload folder, listed page by page with a field mask."""
+    files = get_drive_service().files()
+    http = drive_http()
+    listing, page_token = [], None
+    while True:
+        page = files.list(
+            q=f"'{folder_id}' in parents and trashed = false",
+            fields=LIST_FIELDS,
+            pageSize=1000,
+            pageToken=page_token,
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True,
+        ).execute(http=http, num_retries=UPLOAD_RETRIES)
+        listing += page.get("files", [])
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return listing
@@ -0,0 +1,181 @@
+# functions/export_utils.py
+"""
+Export of the report views to XLSX, CSV and Parquet.
+
+Each writer streams the frame into a spooled temporary file in chunks, so
+the export is materialised once (in the file) and read back once for the
+download button:
+- XLSX uses XlsxWriter's constant_memory mode and keeps the variance
+  colours from the on-screen tables.
+- CSV is written by pandas in row chunks.
+- Parquet is written one row group at a time with pyarrow.
+
+Author: Zedaine McDonald
+"""
+
+import tempfile
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+CHUNK_ROWS = 50_000
+MONEY_COLUMNS = ("Amount Budgeted", "Amount Spent (USD)", "Variance (USD)")
+SPOOL_BYTES = 16 * 1024 * 1024
+
+EXPORT_FORMATS = {
+    "XLSX": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+# Same rules as variance_colour_style() in main.py: (fill, font colour)
+VARIANCE_RED = ("8B0000", "FFFFFF")
+VARIANCE_ORANGE = ("FFA500", "000000")
+VARIANCE_GREEN = ("4CAF50", "FFFFFF")
+
+
+def arrow_safe(df):
+    """Cast object columns that mix types (e.g. numeric and text) to strings for Arrow."""
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True).startswith("mixed"):
+            df[col] = df[col].astype("string")
+    return df
+
+
+def variance_colour_codes(df):
+    """
+    Vectorised variance colour per row: 0 = none, 1 = red, 2 = orange,
+    3 = green (see variance_colour_style in main.py).
+    """
+    budget = pd.to_numeric(df["Amount Budgeted"], errors="coerce").fillna(0.0).to_numpy()
+    spent = pd.to_numeric(df["Amount Spent (USD)"], errors="coerce").fillna(0.0).to_numpy()
+    variance = pd.to_numeric(df["Variance (USD)"], errors="coerce").fillna(0.0).to_numpy()
+    return np.select(
+        [variance < 0, (variance > 0) & (spent >= 0.7 * budget), variance > 0],
+        [1, 2, 3],
+        default=0,
+    )
+
+
+# ============================================================
+# WRITERS
+# ============================================================
+def write_xlsx(df, fileobj, sheet_name="Report", bold_rows=None):
+    """
+    Write df with XlsxWriter in constant_memory mode: each row is flushed
+    to disk as soon as the next one starts, so memory stays flat however
+    many rows the view has.
+    """
+    import xlsxwriter
+
+    wb = xlsxwriter.Workbook(fileobj, {"constant_memory": True, "nan_inf_to_errors": True})
+    ws = wb.add_worksheet(sheet_name[:31])
+
+    columns = list(df.columns)
+    money_idx = {i for i, c in enumerate(columns) if c in MONEY_COLUMNS}
+    variance_idx = columns.index("Variance (USD)") if "Variance (USD)" in columns else None
+    colour_codes = variance_colour_codes(df) if variance_idx is not None else np.zeros(len(df), dtype=int)
+    bold_rows = np.zeros(len(df), dtype=bool) if bold_rows is None else np.asarray(bold_rows, dtype=bool)
+
+    # formats[(is_money, colour_code, is_bold)]
+    colours = {1: VARIANCE_RED, 2: VARIANCE_ORANGE, 3: VARIANCE_GREEN}
+    formats = {}
+    for is_money in (False, True):
+        for code in (0, 1, 2, 3):
+            for is_bold in (False, True):
+                props = {}
+                if is_money:
+                    props["num_format"] = "#,##0.00"
+                if code:
+                    props["bg_color"], props["font_color"] = (f"#{c}" for c in colours[code])
+                if is_bold:
+                    props["bold"] = True
+                formats[(is_money, code, is_bold)] = wb.add_format(props) if props else None
+
+    ws.write_row(0, 0, [str(c) for c in columns], wb.add_format({"bold": True}))
+
+    for row_no, values in enumerate(df.itertuples(index=False, name=None)):
+        is_bold = bool(bold_rows[row_no])
+        for i, value in enumerate(values):
+            if value is pd.NA or value is pd.NaT:
+                value = None
+            code = int(colour_codes[row_no]) if i == variance_idx else 0
+            ws.write(row_no + 1, i, value, formats[(i in money_idx, code, is_bold)])
+
+    wb.close()
+
+
+def write_csv(df, fileobj):
+    df.to_csv(fileobj, index=False, chunksize=CHUNK_ROWS, encoding="utf-8")
+
+
+def write_parquet(df, fileobj):
+    """Write df one row group per CHUNK_ROWS rows."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    df = arrow_safe(df)
+    first = pa.Table.from_pandas(df.iloc[:CHUNK_ROWS], preserve_index=False)
+    # A column that is entirely empty in the first chunk has no type yet.
+    schema = pa.schema(
+        [pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in first.schema],
+        metadata=first.schema.metadata,
+    )
+    with pq.ParquetWriter(fileobj, schema) as writer:
+        writer.write_table(first.cast(schema))
+        for start in range(CHUNK_ROWS, len(df), CHUNK_ROWS):
+            chunk = df.iloc[start:start + CHUNK_ROWS]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def export_bytes(df, fmt, sheet_name="Report", bold_rows=None):
+    """Write df in the given format (a key of EXPORT_FORMATS) and return the file contents."""
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as tmp:
+        if fmt == "XLSX":
+            write_xlsx(df, tmp, sheet_name=sheet_name, bold_rows=bold_rows)
+        elif fmt == "CSV":
+            write_csv(df, tmp)
+        elif fmt == "Parquet":
+            write_parquet(df, tmp)
+        else:
+            raise ValueError(f"Unknown export format: {fmt}")
+        tmp.seek(0)
+        return tmp.read()
+
+
+# ============================================================
+# UI
+# ============================================================
+def render_export_buttons(df, base_name, key, bold_rows=None):
+    """
+    Format picker + download button for one report view. The file is only
+    built when "Prepare" is clicked, not on every rerun.
+    """
+    state_key = f"{key}_export"
+    # Identifies the frame a prepared file was built from, so a stale export
+    # is never offered after the filters change.
+    signature = int(pd.util.hash_pandas_object(df, index=False).sum()) if len(df) else 0
+
+    c1, c2, c3 = st.columns([2, 1, 2])
+    with c1:
+        fmt = st.selectbox("Export format", list(EXPORT_FORMATS), key=f"{key}_fmt", label_visibility="collapsed")
+    with c2:
+        if st.button("Prepare export", key=f"{key}_prepare"):
+            st.session_state[state_key] = (
+                fmt, signature, export_bytes(df, fmt, sheet_name=base_name, bold_rows=bold_rows)
+            )
+
+    prepared = st.session_state.get(state_key)
+    if prepared and prepared[:2] == (fmt, signature):
+        ext, mime = EXPORT_FORMATS[fmt]
+        with c3:
+            st.download_button(
+                f"⬇ Download {fmt}",
+                data=prepared[2],
+                file_name=f"{base_name}.{ext}",
+                mime=mime,
+                key=f"{key}_download",
+                on_click="ignore",
+            )
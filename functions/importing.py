@@ -0,0 +1,111 @@
+# functions/importing.py
+"""
+Import cost helpers.
+
+- lazy_module(name) stands in for a module and imports it on first
+  attribute access, so a module can name pandas/requests/... at the top
+  without paying for the import until a function actually uses it.
+- import_time_profile() measures what the app's imports cost in a fresh
+  interpreter (python -X importtime), module by module. It is shown in the
+  admin panel, and can be run from a shell:
+
+      python -m functions.importing
+
+Author: Zedaine McDonald
+"""
+
+import importlib
+import os
+import subprocess
+import sys
+
+# What main.py imports, in order: the cold-start cost of a Streamlit worker.
+APP_MODULES = [
+    "streamlit",
+    "functions.auth",
+    "functions.startup",
+    "functions.db",
+    "functions.drive_utils",
+    "functions.dashboard_classification",
+    "functions.report_generator",
+    "functions.comparison",
+    "analysis",
+    "fxhelper",
+]
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_module(name):
+    """A stand-in for module `name` that imports it on first attribute access."""
+    module = sys.modules.get(name)
+    return module if module is not None else _LazyModule(name)
+
+
+# ============================================================
+# IMPORT-TIME PROFILE
+# ============================================================
+def parse_importtime(stderr):
+    """
+    Rows of `python -X importtime` output as dicts: module, self ms,
+    cumulative ms and depth (0 = imported by the profiled statement itself).
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # the header line
+        name = parts[2].rstrip()
+        rows.append({
+            "module": name.strip(),
+            "self ms": int(parts[0]) / 1000,
+            "cumulative ms": int(parts[1]) / 1000,
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+        })
+    return rows
+
+
+def import_time_profile(modules=None):
+    """
+    Import `modules` (default APP_MODULES) in a fresh interpreter under
+    -X importtime and return (rows, total ms). Modules already imported by
+    an earlier one in the list cost nothing themselves, as in the app.
+    """
+    import pandas as pd
+
+    modules = modules or APP_MODULES
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+        capture_output=True, text=True, env=env, cwd=os.getcwd(), timeout=120,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+
+    df = pd.DataFrame(parse_importtime(result.stderr), columns=["module", "self ms", "cumulative ms", "depth"])
+    total = df.loc[df["depth"] == 0, "cumulative ms"].sum()
+    return df.sort_values("cumulative ms", ascending=False).reset_index(drop=True), round(total, 1)
+
+
+if __name__ == "__main__":
+    profile, total_ms = import_time_profile(sys.argv[1:] or None)
+    print(f"Total import time: {total_ms:,.1f} ms\n")
+    print(profile.head(40).to_string(index=False))
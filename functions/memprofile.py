@@ -0,0 +1,172 @@
+# functions/memprofile.py
+"""
+Opt-in memory profile of the report pipeline.
+
+- record_frame(name, df) notes the deep memory use of a named intermediate
+  frame (df_budget, df_expense, filtered_df, merged_full, ...), with its
+  largest column.
+- memory_stage(stage) measures one pipeline stage with tracemalloc: the
+  peak allocated above the level at its start, the memory it left behind,
+  and the source lines that allocated most of it.
+
+Both do nothing unless profiling is on (BUDGET_MEMORY_PROFILE=1 or the
+admin toggle). tracemalloc slows Python allocations down while it runs, so
+profiling is meant to be switched on to investigate and then off again.
+
+tracemalloc is process-wide: stages that run at the same time in other
+sessions show up in each other's numbers.
+
+Author: Zedaine McDonald
+"""
+
+import itertools
+import os
+import threading
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+MB = 1024 * 1024
+TRACE_FRAMES = 1
+TOP_ALLOCATORS = 10
+MAX_STAGE_RUNS = 100
+
+_state = {"enabled": False, "owns_tracemalloc": False}
+_frames = {}
+_stage_runs = deque(maxlen=MAX_STAGE_RUNS)
+_lock = threading.Lock()
+_run_ids = itertools.count(1)
+
+
+def memory_profiling_enabled():
+    return _state["enabled"]
+
+
+def set_memory_profiling(enabled):
+    """Turn profiling on or off; starts/stops tracemalloc unless something else started it."""
+    with _lock:
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+            _state["owns_tracemalloc"] = True
+        elif not enabled and _state["owns_tracemalloc"]:
+            tracemalloc.stop()
+            _state["owns_tracemalloc"] = False
+        _state["enabled"] = bool(enabled)
+
+
+def record_frame(name, df):
+    """Deep memory use of a named intermediate frame (kept per name: latest and largest seen)."""
+    if not _state["enabled"] or df is None:
+        return
+    usage = df.memory_usage(index=True, deep=True)
+    columns = usage.drop("Index", errors="ignore")
+    total = float(usage.sum())
+    with _lock:
+        previous = _frames.get(name)
+        _frames[name] = {
+            "frame": name,
+            "rows": len(df),
+            "columns": df.shape[1],
+            "deep MB": total / MB,
+            "largest column": str(columns.idxmax()) if len(columns) else "",
+            "largest column MB": float(columns.max()) / MB if len(columns) else 0.0,
+            "max deep MB": max(total / MB, previous["max deep MB"] if previous else 0.0),
+            "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ])
+
+
+@contextmanager
+def memory_stage(stage):
+    """Peak and retained memory of a pipeline stage, with its top allocating lines."""
+    if not _state["enabled"] or not tracemalloc.is_tracing():
+        yield
+        return
+
+    before = _snapshot()
+    start, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        top = [
+            {
+                "allocated at": f"{diff.traceback[0].filename}:{diff.traceback[0].lineno}",
+                "MB": diff.size_diff / MB,
+                "blocks": diff.count_diff,
+            }
+            for diff in _snapshot().compare_to(before, "lineno")[:TOP_ALLOCATORS]
+        ]
+        with _lock:
+            _stage_runs.append({
+                "run": next(_run_ids),
+                "stage": stage,
+                "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "peak MB": (peak - start) / MB,
+                "retained MB": (current - start) / MB,
+                "top": top,
+            })
+
+
+def clear_memory_profile():
+    with _lock:
+        _frames.clear()
+        _stage_runs.clear()
+
+
+# ============================================================
+# REPORTS
+# ============================================================
+def frame_report():
+    """Named intermediates, largest first."""
+    import pandas as pd
+
+    with _lock:
+        rows = list(_frames.values())
+    df = pd.DataFrame(rows, columns=["frame", "rows", "columns", "deep MB", "max deep MB",
+                                     "largest column", "largest column MB", "at"])
+    return df.sort_values("deep MB", ascending=False).round(2)
+
+
+def stage_report():
+    """Profiled stage runs, newest first."""
+    import pandas as pd
+
+    with _lock:
+        rows = [{k: v for k, v in run.items() if k != "top"} for run in _stage_runs]
+    df = pd.DataFrame(rows[::-1], columns=["run", "stage", "at", "peak MB", "retained MB"])
+    return df.round(2)
+
+
+def top_allocators(run=None):
+    """
+    Source lines that allocated the most in one stage run (default: the
+    largest peak recorded), or summed over every recorded run if run="all".
+    """
+    import pandas as pd
+
+    with _lock:
+        runs = list(_stage_runs)
+    columns = ["allocated at", "MB", "blocks"]
+    if not runs:
+        return pd.DataFrame(columns=columns)
+
+    if run == "all":
+        df = pd.DataFrame([row for r in runs for row in r["top"]], columns=columns)
+        return df.groupby("allocated at", as_index=False).sum().sort_values("MB", ascending=False).round(2)
+
+    chosen = next((r for r in runs if r["run"] == run), None) or max(runs, key=lambda r: r["peak MB"])
+    return pd.DataFrame(chosen["top"], columns=columns).round(2)
+
+
+if os.getenv("BUDGET_MEMORY_PROFILE", "").strip().lower() in ("1", "true", "yes"):
+    set_memory_profiling(True)
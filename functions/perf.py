@@ -0,0 +1,71 @@
+# functions/perf.py
+"""
+Per-region rerun cost meter.
+
+measure(label) records wall-clock milliseconds and the number of MySQL
+queries issued while a region of the page runs. It works as a context
+manager or as a decorator, so it can wrap fragments:
+
+    @st.fragment
+    @measure("dashboard")
+    def dashboard(...): ...
+
+Measurements are kept in a process-wide ring buffer and summarised in the
+admin panel. Each region is also a tracing span (see functions/tracing.py).
+
+Author: Zedaine McDonald
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .db import queries_issued
+from .tracing import span
+
+MAX_MEASUREMENTS = 500
+
+_measurements = deque(maxlen=MAX_MEASUREMENTS)
+_lock = threading.Lock()
+
+
+@contextmanager
+def measure(label):
+    q_start = queries_issued()
+    t_start = time.perf_counter()
+    try:
+        with span(label):
+            yield
+    finally:
+        # st.rerun()/st.stop() raise out of the region; the cost still counts.
+        elapsed_ms = (time.perf_counter() - t_start) * 1000
+        with _lock:
+            _measurements.append({
+                "region": label,
+                "ms": round(elapsed_ms, 1),
+                "queries": queries_issued() - q_start,
+                "at": time.time(),
+            })
+
+
+def measurement_summary():
+    """Runs, mean/p95 milliseconds and mean queries per region."""
+    import pandas as pd
+
+    with _lock:
+        rows = list(_measurements)
+    if not rows:
+        return pd.DataFrame(columns=["region", "runs", "mean ms", "p95 ms", "mean queries"])
+
+    df = pd.DataFrame(rows)
+    summary = df.groupby("region").agg(
+        runs=("ms", "size"),
+        mean_ms=("ms", "mean"),
+        p95_ms=("ms", lambda s: s.quantile(0.95)),
+        mean_queries=("queries", "mean"),
+    ).reset_index()
+    summary = summary.rename(columns={
+        "mean_ms": "mean ms", "p95_ms": "p95 ms", "mean_queries": "mean queries"
+    })
+    return summary.round(1).sort_values("mean ms", ascending=False)
@@ -0,0 +1,262 @@
+# functions/precompute.py
+"""
+Background precomputation of report inputs.
+
+After a successful upload, upload_to_drive_and_log() enqueues a job here.
+The job parses the file once, stores the normalized dataset in MySQL
+(parsed_files) and precomputes the report views for every compatible
+counterpart file (report_aggregates). Job progress is recorded in
+precompute_jobs so "Generate Report" can tell whether to serve stored
+results or fall back to computing on demand.
+
+Author: Zedaine McDonald
+"""
+
+import re
+import traceback
+from io import BytesIO
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import streamlit as st
+
+from analysis import MONTHS, process_budget, process_expenses
+from fxhelper import fetch_usd_rates, convert_row_amount_to_usd
+from .db import (
+    get_uploaded_file,
+    get_uploaded_files,
+    save_parsed_file,
+    get_parsed_file,
+    copy_parsed_file,
+    save_report_aggregates,
+    get_report_aggregates,
+    replace_budget_rows,
+    replace_expense_rows,
+    add_precompute_job,
+    update_precompute_job,
+    get_latest_precompute_job,
+)
+from .export_utils import arrow_safe
+from .storage import open_stored_file
+from .tracing import span
+from .report_compute import (
+    clean_budget,
+    convert_expenses,
+    filter_by_budget_type,
+    apply_report_filters,
+    compute_report_views,
+)
+
+BUDGET_TYPES = ["OPEX", "CAPEX"]
+PENDING_STATUSES = ("queued", "running")
+
+
+# ============================================================
+# HELPERS
+# ============================================================
+def frame_to_bytes(df):
+    """Serialize a DataFrame to parquet bytes for LONGBLOB storage."""
+    buffer = BytesIO()
+    arrow_safe(df).to_parquet(buffer)
+    return buffer.getvalue()
+
+
+def frame_from_bytes(payload):
+    return pd.read_parquet(BytesIO(payload))
+
+
+def budget_type_of(file_type):
+    """'budget(opex)' → 'OPEX'; untyped legacy budgets → None."""
+    m = re.search(r"budget\((opex|capex)\)", str(file_type).lower(), flags=re.I)
+    return m.group(1).upper() if m else None
+
+
+def _file_kind(file_type):
+    ft = str(file_type).strip().lower()
+    if ft.startswith("budget"):
+        return "budget"
+    if ft == "expense":
+        return "expense"
+    return None
+
+
+@st.cache_resource(show_spinner=False)
+def _executor():
+    """One worker pool per process, shared by every session."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="precompute")
+
+
+def _sql_value(value):
+    """NaN/NA → None so pymysql writes NULL."""
+    return None if pd.isna(value) else value
+
+
+def _text(value):
+    return "" if pd.isna(value) else str(value)
+
+
+def budget_row_tuples(df_budget):
+    """Rows for replace_budget_rows(): (category, subcategory, 12 months, total)."""
+    return [
+        (_text(r[0]), _text(r[1]), *(float(v) for v in r[2:]))
+        for r in df_budget[["Category", "Sub-Category"] + MONTHS + ["Total"]].itertuples(index=False, name=None)
+    ]
+
+
+def expense_row_tuples(df_expense):
+    """Rows for replace_expense_rows(): (date, category, subcategory, vendor, classification, amount_usd)."""
+    cols = ["Date", "Budget Category", "Sub-Category", "Vendor", "Classification", "Amount (USD)"]
+    return [
+        (_sql_value(d), _text(cat), _text(sub), None if pd.isna(vendor) else str(vendor), _text(cls), _sql_value(amt))
+        for d, cat, sub, vendor, cls, amt in df_expense[cols].itertuples(index=False, name=None)
+    ]
+
+
+# ============================================================
+# PARSING
+# ============================================================
+def _parse_and_store(file_row):
+    """
+    Download, parse and store one uploaded file: the normalized frame in
+    parsed_files and its rows in budget_rows / expense_rows. Returns the
+    parsed frame.
+    """
+    kind = _file_kind(file_row["file_type"])
+    with open_stored_file(file_row["file_url"], file_row.get("content_hash")) as content:
+        if kind == "budget":
+            with span("process_budget"):
+                df = clean_budget(process_budget(content))
+            save_parsed_file(file_row["file_name"], kind, frame_to_bytes(df), len(df))
+            replace_budget_rows(file_row["file_name"], budget_row_tuples(df))
+            return df
+
+        with span("process_expenses"):
+            df = process_expenses(content)
+
+    try:
+        fx_rates, provider = fetch_usd_rates()
+        fetched_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    except RuntimeError as e:
+        print(f"⚠️ FX fetch failed during precompute: {e}")
+        fx_rates, provider, fetched_at = {}, None, None
+
+    df = convert_expenses(df, fx_rates, convert_row_amount_to_usd)
+    save_parsed_file(file_row["file_name"], kind, frame_to_bytes(df), len(df), provider, fetched_at)
+    replace_expense_rows(file_row["file_name"], expense_row_tuples(df))
+    return df
+
+
+def _reuse_alias_parse(file_row):
+    """
+    An upload identical to an earlier one (alias_of) reuses the stored
+    parse of that file when both are the same kind. Returns the frame, or
+    None if there is nothing to reuse yet.
+    """
+    owner = file_row.get("alias_of")
+    owner_row = get_uploaded_file(owner) if owner else None
+    if not owner_row or _file_kind(owner_row["file_type"]) != _file_kind(file_row["file_type"]):
+        return None
+    if not copy_parsed_file(owner, file_row["file_name"]):
+        return None
+    return frame_from_bytes(get_parsed_file(file_row["file_name"])["payload"])
+
+
+def _load_or_parse(file_row):
+    stored = get_parsed_file(file_row["file_name"])
+    if stored:
+        return frame_from_bytes(stored["payload"])
+    return _parse_and_store(file_row)
+
+
+def _store_pair(budget_row, df_budget, expense_row, df_expense):
+    """Precompute the report views for one budget/expense pair."""
+    budget_type = budget_type_of(budget_row["file_type"])
+    for t in ([budget_type] if budget_type else BUDGET_TYPES):
+        filtered_df = filter_by_budget_type(df_expense, t)
+        if filtered_df.empty:
+            continue
+        views = compute_report_views(df_budget, apply_report_filters(filtered_df))
+        save_report_aggregates(
+            budget_row["file_name"], expense_row["file_name"], t,
+            frame_to_bytes(views["subcategory"]),
+            frame_to_bytes(views["category"]),
+            frame_to_bytes(views["hierarchy"]),
+        )
+
+
+# ============================================================
+# JOB
+# ============================================================
+def run_precompute_job(job_id, file_name):
+    """Parse one uploaded file and precompute every pair it takes part in."""
+    try:
+        update_precompute_job(job_id, "running")
+
+        file_row = get_uploaded_file(file_name)
+        kind = _file_kind(file_row["file_type"]) if file_row else None
+        if kind is None:
+            update_precompute_job(job_id, "skipped", "Not a budget or expense file.")
+            return
+
+        df_own = _reuse_alias_parse(file_row)
+        if df_own is None:
+            df_own = _parse_and_store(file_row)
+        if df_own.empty:
+            update_precompute_job(job_id, "empty", "No rows were parsed from the file.")
+            return
+
+        counterpart_kind = "expense" if kind == "budget" else "budget"
+        counterparts = [r for r in get_uploaded_files() if _file_kind(r["file_type"]) == counterpart_kind]
+
+        for other in counterparts:
+            df_other = _load_or_parse(other)
+            if kind == "budget":
+                _store_pair(file_row, df_own, other, df_other)
+            else:
+                _store_pair(other, df_other, file_row, df_own)
+
+        update_precompute_job(job_id, "done", f"{len(counterparts)} counterpart file(s)")
+    except Exception as e:
+        traceback.print_exc()
+        update_precompute_job(job_id, "failed", str(e)[:1000])
+
+
+def enqueue_precompute(file_name):
+    """Queue a precompute job for an uploaded file. Returns the job id."""
+    executor = _executor()
+    job_id = add_precompute_job(file_name)
+    executor.submit(run_precompute_job, job_id, file_name)
+    return job_id
+
+
+# ============================================================
+# READ SIDE (used by Generate Report)
+# ============================================================
+def load_parsed_frame(file_name):
+    """(frame, parsed_files row) for a file, or (None, None) if not precomputed."""
+    stored = get_parsed_file(file_name)
+    if not stored:
+        return None, None
+    return frame_from_bytes(stored["payload"]), stored
+
+
+def load_precomputed_views(budget_file, expense_file, budget_type):
+    """Stored report views for a pair, or None if the job has not finished."""
+    stored = get_report_aggregates(budget_file, expense_file, budget_type)
+    if not stored:
+        return None
+    return {
+        "subcategory": frame_from_bytes(stored["subcategory_view"]),
+        "category": frame_from_bytes(stored["category_view"]),
+        "hierarchy": frame_from_bytes(stored["hierarchy_view"]),
+    }
+
+
+def is_precompute_pending(*file_names):
+    """True if any of the files still has a queued or running job."""
+    for name in file_names:
+        job = get_latest_precompute_job(name)
+        if job and job["status"] in PENDING_STATUSES:
+            return True
+    return False
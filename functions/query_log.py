@@ -0,0 +1,211 @@
+# functions/query_log.py
+"""
+Query statistics for the db layer.
+
+Every statement functions/db.py runs goes through one cursor wrapper
+(_InstrumentedCursor), which reports here: latency, rows returned or
+affected, errors and the calling query function. Per statement (SQL with
+whitespace and repeated placeholders collapsed) this keeps counters and a
+latency histogram. Statements slower than the threshold also go to a slow
+query log. The log keeps parameter shapes only, never values, and records
+errors by exception class and MySQL error code, without the message.
+
+Both are process-wide and shown (and exportable) in the admin panel.
+
+Author: Zedaine McDonald
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Histogram bucket upper bounds (ms); the last bucket is everything slower.
+LATENCY_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+MAX_SLOW_QUERIES = 200
+MAX_STATEMENT_CHARS = 2000
+
+_settings = {"slow_ms": float(os.getenv("BUDGET_SLOW_QUERY_MS", "500"))}
+_stats = {}
+_slow = deque(maxlen=MAX_SLOW_QUERIES)
+_lock = threading.Lock()
+_started = time.time()
+
+_WHITESPACE = re.compile(r"\s+")
+# "%s, %s, %s" (IN lists, generated VALUES rows) → "%s, …"
+_PLACEHOLDER_RUN = re.compile(r"%s(?:\s*,\s*%s)+")
+_VALUES_ROWS = re.compile(r"(\([^()]*\))(?:\s*,\s*\1)+")
+
+
+def slow_query_ms():
+    return _settings["slow_ms"]
+
+
+def set_slow_query_ms(ms):
+    _settings["slow_ms"] = float(ms)
+
+
+def normalize_statement(sql):
+    """The statement a query belongs to: whitespace and repeated placeholders collapsed."""
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    sql = _WHITESPACE.sub(" ", sql).strip()
+    sql = _PLACEHOLDER_RUN.sub("%s, …", sql)
+    sql = _VALUES_ROWS.sub(r"\1, …", sql)
+    return sql[:MAX_STATEMENT_CHARS]
+
+
+def _value_shape(value):
+    if value is None:
+        return "None"
+    if isinstance(value, (list, tuple, set)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def param_shape(args, batch=False):
+    """Types of the parameters, with values redacted: "(str, int, None)"; "12 × (...)" for a batch."""
+    if args is None:
+        return ""
+    if batch:
+        args = list(args)
+        return f"{len(args)} × {param_shape(args[0])}" if args else "0 × ()"
+    if isinstance(args, dict):
+        return "{" + ", ".join(f"{k}: {_value_shape(v)}" for k, v in args.items()) + "}"
+    if isinstance(args, (list, tuple)):
+        return "(" + ", ".join(_value_shape(v) for v in args) + ")"
+    return _value_shape(args)
+
+
+def _bucket(ms):
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if ms <= bound:
+            return i
+    return len(LATENCY_BUCKETS_MS)
+
+
+def _error_label(error):
+    """Exception class and MySQL error code; the message is left out, it can quote values."""
+    if error is None:
+        return ""
+    code = error.args[0] if error.args and isinstance(error.args[0], int) else None
+    return type(error).__name__ if code is None else f"{type(error).__name__} ({code})"
+
+
+def record_query(sql, ms, caller, returned=0, affected=0, error=None, args=None, batch=False):
+    """Account for one statement execution (called by the db cursor wrapper)."""
+    statement = normalize_statement(sql)
+    with _lock:
+        entry = _stats.get(statement)
+        if entry is None:
+            entry = _stats[statement] = {
+                "calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0,
+                "returned": 0, "affected": 0, "callers": {},
+                "histogram": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+            }
+        entry["calls"] += 1
+        entry["errors"] += error is not None
+        entry["total_ms"] += ms
+        entry["max_ms"] = max(entry["max_ms"], ms)
+        entry["returned"] += returned
+        entry["affected"] += affected
+        entry["callers"][caller] = entry["callers"].get(caller, 0) + 1
+        entry["histogram"][_bucket(ms)] += 1
+
+        if ms >= _settings["slow_ms"] or error is not None:
+            _slow.append({
+                "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "ms": round(ms, 1),
+                "caller": caller,
+                "statement": statement,
+                "params": param_shape(args, batch=batch),
+                "rows": returned or affected,
+                "error": _error_label(error),
+            })
+
+
+def reset_query_stats():
+    global _started
+    with _lock:
+        _stats.clear()
+        _slow.clear()
+        _started = time.time()
+
+
+# ============================================================
+# REPORTS
+# ============================================================
+def _bucket_labels():
+    labels = [f"≤{b} ms" for b in LATENCY_BUCKETS_MS]
+    return labels + [f">{LATENCY_BUCKETS_MS[-1]} ms"]
+
+
+def _histogram_percentile(histogram, q):
+    """Upper bound of the bucket holding the q-quantile (None for the open-ended bucket)."""
+    total = sum(histogram)
+    if not total:
+        return None
+    seen = 0
+    for i, count in enumerate(histogram):
+        seen += count
+        if seen >= q * total:
+            return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else None
+    return None
+
+
+def query_stats():
+    """One row per statement: calls, errors, latency (mean/max, p95 bucket), rows, callers, histogram."""
+    import pandas as pd
+
+    with _lock:
+        items = [(statement, dict(entry, callers=dict(entry["callers"]), histogram=list(entry["histogram"])))
+                 for statement, entry in _stats.items()]
+
+    labels = _bucket_labels()
+    rows = []
+    for statement, entry in items:
+        row = {
+            "statement": statement,
+            "callers": ", ".join(sorted(entry["callers"], key=entry["callers"].get, reverse=True)),
+            "calls": entry["calls"],
+            "errors": entry["errors"],
+            "mean ms": round(entry["total_ms"] / entry["calls"], 2),
+            "p95 ≤ ms": _histogram_percentile(entry["histogram"], 0.95),
+            "max ms": round(entry["max_ms"], 1),
+            "total ms": round(entry["total_ms"], 1),
+            "rows returned": entry["returned"],
+            "rows affected": entry["affected"],
+        }
+        row.update(zip(labels, entry["histogram"]))
+        rows.append(row)
+
+    columns = ["statement", "callers", "calls", "errors", "mean ms", "p95 ≤ ms", "max ms",
+               "total ms", "rows returned", "rows affected"] + labels
+    return pd.DataFrame(rows, columns=columns).sort_values("total ms", ascending=False)
+
+
+def slow_queries():
+    """The slow query log, newest first."""
+    import pandas as pd
+
+    with _lock:
+        rows = list(_slow)
+    return pd.DataFrame(rows[::-1], columns=["at", "ms", "caller", "statement", "params", "rows", "error"])
+
+
+def query_stats_json():
+    """Statistics and slow query log as a JSON document (for export)."""
+    with _lock:
+        stats = {statement: dict(entry, callers=dict(entry["callers"])) for statement, entry in _stats.items()}
+        slow = list(_slow)
+    return json.dumps({
+        "since": datetime.fromtimestamp(_started).strftime("%Y-%m-%d %H:%M:%S"),
+        "exported_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "slow_query_ms": _settings["slow_ms"],
+        "latency_buckets_ms": LATENCY_BUCKETS_MS,
+        "statements": stats,
+        "slow_queries": slow,
+    }, indent=2, default=str)
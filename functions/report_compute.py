@@ -0,0 +1,400 @@
+# functions/report_compute.py
+"""
+Pure pandas aggregation behind the Generate Report views.
+
+Nothing in here touches Streamlit, so the same code runs in the page
+(on-demand compute) and in the background precompute worker.
+
+Author: Zedaine McDonald
+"""
+
+import pandas as pd
+
+from .memprofile import record_frame
+from .tracing import traced
+
+MONEY_COLS = ["Amount Budgeted", "Amount Spent (USD)", "Variance (USD)"]
+
+
+# ============================================================
+# INPUT NORMALISATION
+# ============================================================
+def clean_budget(df_budget):
+    """Drop the 'Total' rows a budget sheet may carry."""
+    return df_budget[~df_budget["Sub-Category"].str.strip().str.lower().eq("total")]
+
+
+@traced("fx convert")
+def convert_expenses(df_expense, fx_rates, convert_row_amount_to_usd):
+    """
+    Normalise Classification and add 'Budget Category' and 'Amount (USD)'.
+    Runs over every classification so the result can be stored once and
+    filtered by budget type later.
+    """
+    df_expense = df_expense.copy()
+    df_expense["Classification"] = df_expense["Classification"].astype(str).str.upper().str.strip()
+    df_expense["Budget Category"] = df_expense["Category"]
+    df_expense["Amount (USD)"] = df_expense.apply(
+        lambda r: convert_row_amount_to_usd(r, fx_rates, df_expense),
+        axis=1
+    )
+    return df_expense
+
+
+def filter_by_budget_type(df_expense, budget_type):
+    """Keep only the expenses classified as the given budget type (OPEX/CAPEX)."""
+    return df_expense[df_expense["Classification"] == budget_type].copy()
+
+
+def apply_report_filters(df_expense, categories=None, vendors=None):
+    """
+    Keep expenses in the chosen categories and vendors. None selects every
+    non-blank value, which is what the report filters default to.
+    """
+    if categories is None:
+        categories = df_expense["Budget Category"].dropna().unique()
+    if vendors is None:
+        vendors = df_expense["Vendor"].dropna().unique()
+    return df_expense[
+        df_expense["Budget Category"].isin(categories) &
+        df_expense["Vendor"].isin(vendors)
+    ].copy()
+
+
+# ============================================================
+# REPORT VIEWS
+# ============================================================
+@traced("view: subcategory")
+def subcategory_view(filtered_df, df_budget):
+    """Spend per (Category, Sub-Category) against the budgeted total."""
+    expenses_agg = (
+        filtered_df.groupby(["Budget Category", "Sub-Category"], dropna=False, as_index=False)["Amount (USD)"]
+        .sum()
+    )
+
+    df_budget_for_merge = (
+        df_budget.rename(columns={"Category": "Budget Category"})[
+            ["Budget Category", "Sub-Category", "Total"]
+        ].drop_duplicates()
+    )
+
+    merged = expenses_agg.merge(
+        df_budget_for_merge,
+        how="left",
+        on=["Budget Category", "Sub-Category"]
+    )
+
+    final_view = merged.rename(columns={
+        "Budget Category": "Category",
+        "Total": "Amount Budgeted",
+        "Amount (USD)": "Amount Spent (USD)"
+    }).copy()
+
+    final_view["Variance (USD)"] = final_view["Amount Budgeted"].fillna(0) - final_view["Amount Spent (USD)"].fillna(0)
+    for col in MONEY_COLS:
+        final_view[col] = (final_view[col].astype(float).round(2)).fillna(0)
+
+    final_view = final_view[["Category", "Sub-Category"] + MONEY_COLS]
+    return final_view.sort_values(["Category", "Sub-Category"])
+
+
+@traced("view: category")
+def category_view(filtered_df, df_budget):
+    """Spend per Category against the budgeted total."""
+    budget_per_cat = (
+        df_budget.groupby("Category", as_index=False)["Total"].sum()
+        .rename(columns={"Total": "Amount Budgeted"})
+    )
+
+    spent_per_cat = (
+        filtered_df.groupby("Budget Category", as_index=False)["Amount (USD)"].sum()
+        .rename(columns={"Budget Category": "Category", "Amount (USD)": "Amount Spent (USD)"})
+    )
+
+    cat_view = budget_per_cat.merge(spent_per_cat, how="outer", on="Category")
+    cat_view["Amount Budgeted"] = cat_view["Amount Budgeted"].fillna(0.0)
+    cat_view["Amount Spent (USD)"] = cat_view["Amount Spent (USD)"].fillna(0.0)
+    cat_view["Variance (USD)"] = cat_view["Amount Budgeted"] - cat_view["Amount Spent (USD)"]
+
+    for col in MONEY_COLS:
+        cat_view[col] = cat_view[col].astype(float).round(2)
+
+    cat_view = cat_view[["Category"] + MONEY_COLS]
+    return cat_view.sort_values("Category")
+
+
+@traced("view: hierarchy")
+def hierarchy_view(filtered_df, df_budget):
+    """
+    Full budget view: every budgeted subcategory plus out-of-budget spend,
+    with one total row per category (is_total=True).
+    """
+    # 1. Baseline: every budgeted subcategory
+    budget_full = (
+        df_budget.rename(columns={"Total": "Amount Budgeted"})[
+            ["Category", "Sub-Category", "Amount Budgeted"]
+        ].copy()
+    )
+
+    budget_full["Amount Budgeted"] = pd.to_numeric(
+        budget_full["Amount Budgeted"], errors="coerce"
+    ).fillna(0)
+
+    # 2. Expense aggregates
+    expenses_agg = (
+        filtered_df.groupby(["Budget Category", "Sub-Category"], dropna=False, as_index=False)["Amount (USD)"]
+        .sum()
+        .rename(columns={"Budget Category": "Category", "Amount (USD)": "Amount Spent (USD)"})
+    )
+
+    # 3. Merge budget + expenses
+    merged_full = budget_full.merge(
+        expenses_agg,
+        how="outer",
+        on=["Category", "Sub-Category"]
+    )
+
+    # 4. Variance
+    merged_full["Amount Spent (USD)"] = merged_full["Amount Spent (USD)"].fillna(0)
+    merged_full["Variance (USD)"] = merged_full["Amount Budgeted"] - merged_full["Amount Spent (USD)"]
+
+    # 5. Identify Out-of-Budget
+    budget_keys = set(budget_full.set_index(["Category", "Sub-Category"]).index)
+    expense_keys = set(expenses_agg.set_index(["Category", "Sub-Category"]).index)
+
+    oob_keys = expense_keys - budget_keys
+
+    if oob_keys:
+        oob_items = (
+            expenses_agg.set_index(["Category", "Sub-Category"])
+            .loc[list(oob_keys)]
+            .reset_index()
+        )
+
+        oob_items["Category"] = "Out of Budget"
+        oob_items["Amount Budgeted"] = 0.0
+        oob_items["Variance (USD)"] = -oob_items["Amount Spent (USD)"]
+        oob_items["is_oob"] = True
+
+        merged_full = merged_full[
+            ~merged_full.set_index(["Category", "Sub-Category"]).index.isin(oob_keys)
+        ]
+
+        merged_full = pd.concat([merged_full, oob_items], ignore_index=True)
+
+        # Ensure duplicates removed
+        merged_full = merged_full[
+            ~merged_full.set_index(["Category", "Sub-Category"]).index.isin(oob_keys)
+        ]
+        merged_full = pd.concat([merged_full, oob_items], ignore_index=True)
+
+    # 6. Category totals (OOB categories get total budget = 0)
+    def total_budget(series):
+        if (series == "OOB").any():
+            return 0
+        return series.sum()
+
+    cat_totals = (
+        merged_full.groupby("Category", as_index=False)
+        .agg({
+            "Amount Budgeted": total_budget,
+            "Amount Spent (USD)": "sum",
+            "Variance (USD)": "sum"
+        })
+    )
+    cat_totals["Sub-Category"] = ""
+    cat_totals["is_total"] = True
+    merged_full["is_total"] = False
+    record_frame("merged_full", merged_full)
+
+    hierarchy = pd.concat([cat_totals, merged_full], ignore_index=True)
+
+    # 7. Sorting order: normal → subcats → Out-of-Budget
+    hierarchy["sort_key"] = hierarchy.apply(
+        lambda r: (
+            1 if r["Category"] == "Out of Budget" else 0,
+            0 if r.get("is_total") else 1,
+            str(r["Sub-Category"])
+        ),
+        axis=1
+    )
+    hierarchy.sort_values("sort_key", inplace=True)
+    hierarchy.drop(columns=["sort_key"], inplace=True)
+
+    return hierarchy
+
+
+def compute_report_views(df_budget, filtered_df):
+    """Build all three report views. Returns a dict keyed by view name."""
+    return {
+        "subcategory": subcategory_view(filtered_df, df_budget),
+        "category": category_view(filtered_df, df_budget),
+        "hierarchy": hierarchy_view(filtered_df, df_budget),
+    }
+
+
+def with_variance_status(view, get_variance_status):
+    """Return a copy of a view with the Status column appended."""
+    view = view.copy()
+    if view.empty:
+        view["Status"] = pd.Series(dtype=object)
+        return view
+    view["Status"] = view.apply(
+        lambda row: get_variance_status(
+            row["Amount Budgeted"],
+            row["Amount Spent (USD)"],
+            row["Variance (USD)"],
+        ),
+        axis=1
+    )
+    return view
+
+
+# ============================================================
+# CONSOLIDATED (MULTI-BUDGET) VIEW
+# ============================================================
+def route_expenses(df_budgets, df_expense):
+    """
+    Assign every expense to one of several budgets in a single merge.
+
+    df_budgets holds the budgets stacked, with 'Budget File' and
+    'Budget Type' columns. An expense goes to the budget of its
+    Classification type that lists its (Category, Sub-Category); when none
+    does, to the first selected budget of that type. Expenses whose
+    Classification matches no selected budget are dropped.
+    """
+    keys = (
+        df_budgets[["Budget Type", "Category", "Sub-Category", "Budget File"]]
+        .drop_duplicates(["Budget Type", "Category", "Sub-Category"])
+        .rename(columns={"Budget Type": "Classification", "Category": "Budget Category"})
+    )
+    routed = df_expense.merge(keys, how="left", on=["Classification", "Budget Category", "Sub-Category"])
+
+    default_file = df_budgets.drop_duplicates("Budget Type").set_index("Budget Type")["Budget File"]
+    routed["Budget File"] = routed["Budget File"].fillna(routed["Classification"].map(default_file))
+    return routed[routed["Budget File"].notna()]
+
+
+@traced("view: consolidated")
+def consolidated_view(df_budgets, routed):
+    """
+    Combined hierarchy over several budgets: Budget → Category →
+    Sub-Category, with per-budget and per-category subtotals and a grand
+    total. 'Level' says which of those a row is. Everything is computed
+    with one groupby per level over the stacked rows.
+    """
+    keys = ["Budget File", "Category", "Sub-Category"]
+
+    budget_agg = (
+        df_budgets.groupby(keys, as_index=False)["Total"].sum()
+        .rename(columns={"Total": "Amount Budgeted"})
+    )
+    spend_agg = (
+        routed.groupby(["Budget File", "Budget Category", "Sub-Category"], dropna=False, as_index=False)["Amount (USD)"]
+        .sum()
+        .rename(columns={"Budget Category": "Category", "Amount (USD)": "Amount Spent (USD)"})
+    )
+
+    lines = budget_agg.merge(spend_agg, how="outer", on=keys, indicator=True)
+    lines.loc[lines["_merge"] == "right_only", "Category"] = "Out of Budget"
+    lines = lines.drop(columns="_merge")
+    lines["Amount Budgeted"] = lines["Amount Budgeted"].fillna(0.0)
+    lines["Amount Spent (USD)"] = lines["Amount Spent (USD)"].fillna(0.0)
+    lines["Variance (USD)"] = lines["Amount Budgeted"] - lines["Amount Spent (USD)"]
+    lines["Level"] = "Sub-Category"
+
+    cat_totals = lines.groupby(["Budget File", "Category"], as_index=False)[MONEY_COLS].sum()
+    cat_totals["Sub-Category"] = ""
+    cat_totals["Level"] = "Category"
+
+    budget_totals = lines.groupby("Budget File", as_index=False)[MONEY_COLS].sum()
+    budget_totals["Category"] = ""
+    budget_totals["Sub-Category"] = ""
+    budget_totals["Level"] = "Budget"
+
+    grand = pd.DataFrame([lines[MONEY_COLS].sum()])
+    grand["Budget File"] = "All budgets"
+    grand["Category"] = ""
+    grand["Sub-Category"] = ""
+    grand["Level"] = "Total"
+
+    view = pd.concat([budget_totals, cat_totals, lines, grand], ignore_index=True)
+
+    # Order: budgets as selected (grand total last); within a budget its
+    # total row, then categories in budget-file order (OOB last), each
+    # category's total before its subcategories.
+    file_order = {f: i for i, f in enumerate(df_budgets["Budget File"].drop_duplicates())}
+    cat_order = df_budgets[["Budget File", "Category"]].drop_duplicates()
+    cat_order["cat_rank"] = cat_order.groupby("Budget File").cumcount() + 1
+
+    view = view.merge(cat_order, how="left", on=["Budget File", "Category"])
+    view["file_rank"] = view["Budget File"].map(file_order).fillna(len(file_order))
+    view["cat_rank"] = view["cat_rank"].fillna(len(cat_order) + 1)
+    view.loc[view["Level"].isin(["Budget", "Total"]), "cat_rank"] = 0
+    view["level_rank"] = view["Level"].map({"Budget": 0, "Total": 0, "Category": 1, "Sub-Category": 2})
+
+    view = view.sort_values(["file_rank", "cat_rank", "Category", "level_rank", "Sub-Category"], kind="stable")
+    for col in MONEY_COLS:
+        view[col] = view[col].astype(float).round(2)
+
+    return view[["Budget File", "Category", "Sub-Category"] + MONEY_COLS + ["Level"]].reset_index(drop=True)
+
+
+# ============================================================
+# MULTI-PERIOD COMPARISON
+# ============================================================
+@traced("view: comparison")
+def comparison_view(budget_totals, spend_totals, periods):
+    """
+    Line several periods up by (Category, Sub-Category).
+
+    budget_totals: rows of (file_name, category, subcategory, budgeted)
+    spend_totals: rows of (file_name, classification, category, subcategory, spent)
+    periods: list of dicts with label, budget_file, budget_type and
+        expense_file (optional), oldest first.
+
+    Returns one row per (Category, Sub-Category) with '<label> Budgeted'
+    (and '<label> Spent' when the period has an expense file) and, for each
+    consecutive pair, the delta and growth rate (%) of each measure.
+    """
+    keys = ["Category", "Sub-Category"]
+    labels = [p["label"] for p in periods]
+    period_df = pd.DataFrame(periods)
+
+    budget = pd.DataFrame(budget_totals, columns=["file_name", "category", "subcategory", "budgeted"])
+    budget = budget.merge(period_df[["label", "budget_file"]], left_on="file_name", right_on="budget_file")
+
+    spend = pd.DataFrame(spend_totals, columns=["file_name", "classification", "category", "subcategory", "spent"])
+    spend = spend.merge(
+        period_df[["label", "expense_file", "budget_type"]].dropna(subset=["expense_file"]),
+        left_on=["file_name", "classification"], right_on=["expense_file", "budget_type"]
+    )
+
+    long = pd.concat([
+        budget.assign(measure="Budgeted", value=budget["budgeted"]),
+        spend.assign(measure="Spent", value=spend["spent"]),
+    ], ignore_index=True).rename(columns={"category": "Category", "subcategory": "Sub-Category"})
+    long["value"] = pd.to_numeric(long["value"], errors="coerce").fillna(0.0)
+
+    wide = long.pivot_table(index=keys, columns=["measure", "label"], values="value", aggfunc="sum", fill_value=0.0)
+
+    # Spend columns only exist for periods that have an expense file.
+    measures = {
+        p["label"]: ("Budgeted", "Spent") if p.get("expense_file") else ("Budgeted",)
+        for p in periods
+    }
+
+    out = pd.DataFrame(index=wide.index)
+    for label in labels:
+        for measure in measures[label]:
+            out[f"{label} {measure}"] = wide[(measure, label)] if (measure, label) in wide.columns else 0.0
+
+    for prev, curr in zip(labels, labels[1:]):
+        for measure in ("Budgeted", "Spent"):
+            if measure not in measures[prev] or measure not in measures[curr]:
+                continue
+            before, after = out[f"{prev} {measure}"], out[f"{curr} {measure}"]
+            out[f"Δ {measure} {prev}→{curr}"] = after - before
+            out[f"Growth % {measure} {prev}→{curr}"] = ((after - before) / before.where(before != 0) * 100).round(1)
+
+    return out.round(2).reset_index().sort_values(keys, kind="stable")
@@ -4,11 +4,90 @@ import streamlit as st
 import pandas as pd
 #import gspread
 import re
-import requests
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from .db import get_uploaded_files
+from .storage import open_stored_file
+from .precompute import (
+    BUDGET_TYPES,
+    budget_type_of,
+    load_parsed_frame,
+    load_precomputed_views,
+    is_precompute_pending,
+)
+from .report_compute import (
+    clean_budget,
+    convert_expenses,
+    filter_by_budget_type,
+    apply_report_filters,
+    compute_report_views,
+    with_variance_status,
+    route_expenses,
+    consolidated_view,
+)
+from .table_view import render_paged_table
+from .export_utils import render_export_buttons
+from .perf import measure
+from .tracing import span
+from .memprofile import memory_stage, record_frame
 #from google.oauth2 import service_account
 
+MONEY_FORMATS = {
+    "Amount Budgeted": "{:,.2f}",
+    "Amount Spent (USD)": "{:,.2f}",
+    "Variance (USD)": "{:,.2f}",
+}
+
+
+def load_budget_frame(file_name, file_url, process_budget, file_hash=None):
+    """
+    Parsed budget for a file: the precomputed dataset if the background job
+    stored one, otherwise downloaded and parsed now. Makes no Streamlit
+    calls, so it can run on worker threads.
+    """
+    df_budget, _ = load_parsed_frame(file_name)
+    if df_budget is None:
+        with open_stored_file(file_url, file_hash) as content, span("process_budget"):
+            df_budget = clean_budget(process_budget(content))
+    return df_budget
+
+
+def load_expense_frame(file_name, file_url, process_expenses, get_usd_rates, convert_row_amount_to_usd,
+                       file_hash=None):
+    """
+    Parsed expenses with 'Amount (USD)' for every classification, from the
+    precomputed dataset or parsed and converted now. Stops the page if the
+    file cannot be parsed.
+    """
+    df_expense_all, expense_meta = load_parsed_frame(file_name)
+    if df_expense_all is not None:
+        if expense_meta.get("fx_fetched_at"):
+            st.caption(
+                f"FX provider: {expense_meta.get('fx_provider') or 'unknown'} • "
+                f"fetched {expense_meta['fx_fetched_at']} (precomputed)"
+            )
+        return df_expense_all
+
+    # --- Parse Expenses ---
+    try:
+        with open_stored_file(file_url, file_hash) as content, span("process_expenses"):
+            df_expense_raw = process_expenses(content)
+    except Exception as e:
+        st.error(f"❌ Could not process Expenses file: {e}")
+        st.stop()
+
+    # --- FX Conversion ---
+    try:
+        fx_rates = get_usd_rates()
+        provider = st.session_state.get("fx_provider", "unknown")
+        fetched = st.session_state.get("fx_fetched_at")
+        if fetched:
+            st.caption(f"FX provider: {provider} • fetched {fetched}")
+    except Exception as e:
+        st.error(f"Unable to fetch FX rates: {e}")
+        fx_rates = {}
+
+    return convert_expenses(df_expense_raw, fx_rates, convert_row_amount_to_usd)
+
 
 def render_generate_report_section(
     process_budget,
@@ -16,8 +95,8 @@ def render_generate_report_section(
     get_usd_rates,
     convert_row_amount_to_usd,
     dashboard,
-    load_budget_state_monthly,
-    save_budget_state_monthly,
+    load_budget_state_grid,
+    save_budget_state_grid,
     variance_colour_style,
     get_variance_status
 ):
@@ -50,6 +129,23 @@ def render_generate_report_section(
         budget_files = df_files[is_budget]
         expense_files = df_files[ft == "expense"]
 
+        report_mode = st.radio(
+            "Report mode", ["Single budget", "Consolidated (several budgets)"],
+            horizontal=True, key="report_mode"
+        )
+        if report_mode != "Single budget":
+            render_consolidated_report(
+                budget_files=budget_files,
+                expense_files=expense_files,
+                process_budget=process_budget,
+                process_expenses=process_expenses,
+                get_usd_rates=get_usd_rates,
+                convert_row_amount_to_usd=convert_row_amount_to_usd,
+                variance_colour_style=variance_colour_style,
+                get_variance_status=get_variance_status,
+            )
+            return
+
         budget_options = ["— Select Budget File —"] + budget_files["file_name"].tolist()
         expense_options = ["— Select Expense File —"] + expense_files["file_name"].tolist()
 
@@ -96,42 +192,29 @@ def render_generate_report_section(
             )
             selected_budget_type = legacy_type_choice
 
-        # --- Parse Budget ---
-        df_budget = process_budget(BytesIO(requests.get(budget_url).content))
-        df_budget = df_budget[~df_budget["Sub-Category"].str.strip().str.lower().eq("total")]
-
-        # --- Parse Expenses ---
-        try:
-            df_expense = process_expenses(BytesIO(requests.get(expense_url).content))
-        except Exception as e:
-            st.error(f"❌ Could not process Expenses file: {e}")
-            st.stop()
+        # --- Load inputs: precomputed datasets first, download + parse otherwise ---
+        with memory_stage("load budget"):
+            df_budget = load_budget_frame(
+                selected_budget, budget_url, process_budget, file_hash=budget_row.get("content_hash")
+            )
+        with memory_stage("load expenses"):
+            df_expense_all = load_expense_frame(
+                selected_expense, expense_url, process_expenses, get_usd_rates, convert_row_amount_to_usd,
+                file_hash=expense_row.get("content_hash"),
+            )
 
         # Filter by type
-        df_expense["Classification"] = df_expense["Classification"].astype(str).str.upper().str.strip()
-        df_expense = df_expense[df_expense["Classification"] == selected_budget_type].copy()
+        df_expense = filter_by_budget_type(df_expense_all, selected_budget_type)
+        record_frame("df_budget", df_budget)
+        record_frame("df_expense", df_expense)
 
         if df_expense.empty:
             st.warning(f"No {selected_budget_type} expenses found.")
             st.stop()
 
-        df_expense["Budget Category"] = df_expense["Category"]
-
-        # --- FX Conversion ---
-        try:
-            fx_rates = get_usd_rates()
-            provider = st.session_state.get("fx_provider", "unknown")
-            fetched = st.session_state.get("fx_fetched_at")
-            if fetched:
-                st.caption(f"FX provider: {provider} • fetched {fetched}")
-        except Exception as e:
-            st.error(f"Unable to fetch FX rates: {e}")
-            fx_rates = {}
-
-        df_expense["Amount (USD)"] = df_expense.apply(
-            lambda r: convert_row_amount_to_usd(r, fx_rates, df_expense),
-            axis=1
-        )
+        precomputed_views = load_precomputed_views(selected_budget, selected_expense, selected_budget_type)
+        if precomputed_views is None and is_precompute_pending(selected_budget, selected_expense):
+            st.caption("⏳ Background precompute has not finished for these files — computing on demand.")
 
         # ===============================================================
         # -------------- INSERT YOUR DASHBOARD CALL ---------------------
@@ -140,329 +223,293 @@ def render_generate_report_section(
             df_budget=df_budget,
             df_expense=df_expense,
             selected_budget=selected_budget,
-            load_budget_state_monthly=load_budget_state_monthly,
-            save_budget_state_monthly=save_budget_state_monthly
+            load_budget_state_grid=load_budget_state_grid,
+            save_budget_state_grid=save_budget_state_grid
         )
 
         # ===============================================================
         # EVERYTHING BELOW IS 100% YOUR ORIGINAL REPORT CODE
         # ===============================================================
 
-        # Filters
-        st.markdown("Reports")
-
-        with st.expander("📂 Filter by Categories"):
-            all_cats = sorted(df_expense["Budget Category"].dropna().unique().tolist())
-            select_all_cat = st.checkbox("Select All Categories", value=True, key="all_categories")
-            selected_categories = st.multiselect(
-                "Choose Categories", options=all_cats,
-                default=all_cats if select_all_cat else []
-            )
-
-        with st.expander("🏷️ Filter by Vendors"):
-            all_vendors = sorted(df_expense["Vendor"].dropna().unique().tolist())
-            select_all_ven = st.checkbox("Select All Vendors", value=True, key="all_vendors")
-            selected_vendors = st.multiselect(
-                "Choose Vendors", options=all_vendors,
-                default=all_vendors if select_all_ven else []
-            )
-
-        filtered_df = df_expense[
-            df_expense["Budget Category"].isin(selected_categories) &
-            df_expense["Vendor"].isin(selected_vendors)
-        ].copy()
+        _render_report_views(
+            df_budget=df_budget,
+            df_expense=df_expense,
+            precomputed_views=precomputed_views,
+            variance_colour_style=variance_colour_style,
+            get_variance_status=get_variance_status,
+        )
 
 
-        # ===============================================================
-        # Subcategory view
-        # ===============================================================
-        expenses_agg = (
-            filtered_df.groupby(["Budget Category", "Sub-Category"], dropna=False, as_index=False)["Amount (USD)"]
-            .sum()
+@st.fragment
+@measure("report: views")
+def _render_report_views(df_budget, df_expense, precomputed_views, variance_colour_style, get_variance_status):
+    """
+    Filters and the three report views. Runs as a fragment, so changing a
+    filter or paging a table reruns only this part of the page.
+    """
+    # Filters
+    st.markdown("Reports")
+
+    with st.expander("📂 Filter by Categories"):
+        all_cats = sorted(df_expense["Budget Category"].dropna().unique().tolist())
+        select_all_cat = st.checkbox("Select All Categories", value=True, key="all_categories")
+        selected_categories = st.multiselect(
+            "Choose Categories", options=all_cats,
+            default=all_cats if select_all_cat else []
         )
 
-        df_budget_for_merge = (
-            df_budget.rename(columns={"Category": "Budget Category"})[
-                ["Budget Category", "Sub-Category", "Total"]
-            ].drop_duplicates()
+    with st.expander("🏷️ Filter by Vendors"):
+        all_vendors = sorted(df_expense["Vendor"].dropna().unique().tolist())
+        select_all_ven = st.checkbox("Select All Vendors", value=True, key="all_vendors")
+        selected_vendors = st.multiselect(
+            "Choose Vendors", options=all_vendors,
+            default=all_vendors if select_all_ven else []
         )
 
-        merged = expenses_agg.merge(
-            df_budget_for_merge,
-            how="left",
-            on=["Budget Category", "Sub-Category"]
+    # Precomputed views cover the default "everything selected" filter;
+    # any narrower selection is aggregated on demand.
+    unfiltered = (
+        len(selected_categories) == len(all_cats) and
+        len(selected_vendors) == len(all_vendors)
+    )
+
+    if unfiltered and precomputed_views is not None:
+        views = precomputed_views
+    else:
+        with memory_stage("report views"):
+            filtered_df = apply_report_filters(df_expense, selected_categories, selected_vendors)
+            views = compute_report_views(df_budget, filtered_df)
+        record_frame("filtered_df", filtered_df)
+
+
+    # ===============================================================
+    # Subcategory view
+    # ===============================================================
+    final_view = with_variance_status(views["subcategory"], get_variance_status)
+
+    with st.expander("📄 Expenditures (USD) — Subcategory", expanded=False):
+        render_paged_table(
+            final_view,
+            key="tbl_subcategory",
+            row_styles=[variance_colour_style],
+            formats=MONEY_FORMATS,
         )
+        render_export_buttons(final_view, "Expenditures_Subcategory", key="exp_subcategory")
 
-        final_view = merged.rename(columns={
-            "Budget Category": "Category",
-            "Total": "Amount Budgeted",
-            "Amount (USD)": "Amount Spent (USD)"
-        }).copy()
 
-        final_view["Variance (USD)"] = final_view["Amount Budgeted"].fillna(0) - final_view["Amount Spent (USD)"].fillna(0)
-        for col in ["Amount Budgeted", "Amount Spent (USD)", "Variance (USD)"]:
-            final_view[col] = (final_view[col].astype(float).round(2)).fillna(0)
+    # ===============================================================
+    # Category view
+    # ===============================================================
+    cat_view = with_variance_status(views["category"], get_variance_status)
 
-        final_view["Status"] = final_view.apply(
-            lambda row: get_variance_status(
-                row["Amount Budgeted"],
-                row["Amount Spent (USD)"],
-                row["Variance (USD)"],
-            ),
-            axis=1
+    with st.expander("📊Expenditure Summary (USD) — Category", expanded=False):
+        render_paged_table(
+            cat_view,
+            key="tbl_category",
+            row_styles=[variance_colour_style],
+            formats=MONEY_FORMATS,
         )
+        render_export_buttons(cat_view, "Expenditure_Summary_Category", key="exp_category")
 
-        final_view = final_view[
-            ["Category", "Sub-Category", "Amount Budgeted", "Amount Spent (USD)", "Variance (USD)", "Status"]
-        ]
-        final_view.sort_values(["Category", "Sub-Category"], inplace=True)
-
-        with st.expander("📄 Expenditures (USD) — Subcategory", expanded=False):
-            styled_final = (
-                final_view.style
-                .apply(variance_colour_style, axis=1)
-                .format({
-                    "Amount Budgeted": "{:,.2f}",
-                    "Amount Spent (USD)": "{:,.2f}",
-                    "Variance (USD)": "{:,.2f}",
-                })
-            )
-            st.dataframe(styled_final, use_container_width=True)
 
+    # ===============================================================
+    # Full Budget View — Including Out-of-Budget (OOB)
+    # ===============================================================
+    hierarchy_view = views["hierarchy"]
+    record_frame("hierarchy_view", hierarchy_view)
 
-        # ===============================================================
-        # Category view
-        # ===============================================================
-        budget_per_cat = (
-            df_budget.groupby("Category", as_index=False)["Total"].sum()
-            .rename(columns={"Total": "Amount Budgeted"})
-        )
+    # 8. Formatting helper
+    def fmt_budget(val):
+        if isinstance(val, (int, float)) and val == 0:
+            return "OOB"
+        try:
+            return f"{val:,.2f}"
+        except Exception:
+            return val
 
-        spent_per_cat = (
-            filtered_df.groupby("Budget Category", as_index=False)["Amount (USD)"].sum()
-            .rename(columns={"Budget Category": "Category", "Amount (USD)": "Amount Spent (USD)"})
-        )
+    # 9. Display Full Hierarchy View
+    with st.expander("📘 Full Budget View (USD) — Category + Subcategories", expanded=False):
+
+        df_display = hierarchy_view.copy()
 
-        cat_view = budget_per_cat.merge(spent_per_cat, how="outer", on="Category")
-        cat_view["Amount Budgeted"] = cat_view["Amount Budgeted"].fillna(0.0)
-        cat_view["Amount Spent (USD)"] = cat_view["Amount Spent (USD)"].fillna(0.0)
-        cat_view["Variance (USD)"] = cat_view["Amount Budgeted"] - cat_view["Amount Spent (USD)"]
+        # Sort categories in same order as budget file, OOB last
+        budget_order = df_budget["Category"].drop_duplicates().tolist()
+        df_display["Category"] = pd.Categorical(
+            df_display["Category"],
+            categories=budget_order + ["Out of Budget"],
+            ordered=True
+        )
+        df_display.sort_values(["Category", "Sub-Category"], inplace=True)
+
+        # Add indentation for subcategories
+        INDENT = "\u2003\u2003\u2003"
+        df_display.loc[
+            df_display["Sub-Category"].notna() & (df_display["Sub-Category"] != ""),
+            "Sub-Category"
+        ] = (
+            INDENT + "→ " +
+            df_display.loc[
+                df_display["Sub-Category"].notna() & (df_display["Sub-Category"] != ""),
+                "Sub-Category"
+            ].astype(str)
+        )
 
-        for col in ["Amount Budgeted", "Amount Spent (USD)", "Variance (USD)"]:
-            cat_view[col] = cat_view[col].astype(float).round(2)
+        df_display.reset_index(drop=True, inplace=True)
 
-        cat_view["Status"] = cat_view.apply(
+        # Recalculate variance status
+        df_display["Status"] = df_display.apply(
             lambda row: get_variance_status(
                 row["Amount Budgeted"],
                 row["Amount Spent (USD)"],
-                row["Variance (USD)"]
+                row["Variance (USD)"],
             ),
             axis=1
         )
 
-        cat_view = cat_view[["Category", "Amount Budgeted", "Amount Spent (USD)", "Variance (USD)", "Status"]]
-        cat_view.sort_values("Category", inplace=True)
-
-        with st.expander("📊Expenditure Summary (USD) — Category", expanded=False):
-            styled_cat = (
-                cat_view.style
-                .apply(variance_colour_style, axis=1)
-                .format({
-                    "Amount Budgeted": "{:,.2f}",
-                    "Amount Spent (USD)": "{:,.2f}",
-                    "Variance (USD)": "{:,.2f}",
-                })
-            )
-            st.dataframe(styled_cat, use_container_width=True)
-
-
-                # ===============================================================
-        # Full Budget View (Hierarchy)
-        # ===============================================================
-
-        full_view = final_view.copy()
+        display_cols = [
+            "Category", "Sub-Category",
+            "Amount Budgeted", "Amount Spent (USD)",
+            "Variance (USD)", "Status"
+        ]
 
-        # Add category totals
-        cat_totals = (
-            full_view.groupby("Category", as_index=False)[
-                ["Amount Budgeted", "Amount Spent (USD)", "Variance (USD)"]
-            ].sum()
+        render_paged_table(
+            df_display[display_cols],
+            key="tbl_hierarchy",
+            row_styles=[
+                lambda row: [
+                    "font-weight: bold"
+                    if not row["Sub-Category"] or row["Sub-Category"] == "→ "
+                    else ""
+                    for _ in row
+                ],
+                variance_colour_style,
+            ],
+            formats={
+                "Amount Budgeted": lambda v, is_oob=None: "OOB" if is_oob else f"{v:,.2f}",
+                "Amount Spent (USD)": "{:,.2f}",
+                "Variance (USD)": "{:,.2f}",
+            },
         )
-        cat_totals["Sub-Category"] = ""  # blank
-        cat_totals["is_total"] = True
-        full_view["is_total"] = False
-
-        hierarchy_view = pd.concat([cat_totals, full_view], ignore_index=True)
-        hierarchy_view.sort_values(["Category", "is_total"], ascending=[True, False], inplace=True)
-
-        # ===============================================================
-        # Full Budget View — Including Out-of-Budget (OOB)
-        # ===============================================================
-
-        # 1. Baseline: every budgeted subcategory
-        budget_full = (
-            df_budget.rename(columns={
-                "Category": "Category",
-                "Sub-Category": "Sub-Category",
-                "Total": "Amount Budgeted"
-            })[["Category", "Sub-Category", "Amount Budgeted"]].copy()
+        render_export_buttons(
+            df_display[display_cols],
+            "Full_Budget_View",
+            key="exp_hierarchy",
+            bold_rows=df_display["Sub-Category"].fillna("").eq("").to_numpy(),
         )
 
-        budget_full["Amount Budgeted"] = pd.to_numeric(
-            budget_full["Amount Budgeted"], errors="coerce"
-        ).fillna(0)
 
-        # 2. Expense aggregates
-        expenses_agg = (
-            filtered_df.groupby(["Budget Category", "Sub-Category"], dropna=False, as_index=False)["Amount (USD)"]
-            .sum()
-            .rename(columns={"Budget Category": "Category", "Amount (USD)": "Amount Spent (USD)"})
-        )
+# ===============================================================
+# Consolidated report (several budgets, one expense file)
+# ===============================================================
+def render_consolidated_report(
+    budget_files,
+    expense_files,
+    process_budget,
+    process_expenses,
+    get_usd_rates,
+    convert_row_amount_to_usd,
+    variance_colour_style,
+    get_variance_status
+):
+    """
+    Combine several budget files (e.g. OPEX and CAPEX) into one hierarchy.
+    Budgets are parsed in parallel and expenses are routed to a budget by
+    their Classification in one merge, so the cost follows the total number
+    of rows rather than the number of budgets.
+    """
+    selected_budgets = st.multiselect(
+        "📘 Budget Files", budget_files["file_name"].tolist(), key="consolidated_budgets"
+    )
+    expense_options = ["— Select Expense File —"] + expense_files["file_name"].tolist()
+    selected_expense = st.selectbox("💸 Expense File", expense_options, index=0, key="consolidated_expense")
+
+    # Budget type per file; untyped legacy budgets are asked about, as in single mode
+    budget_rows = budget_files.drop_duplicates("file_name").set_index("file_name")
+    budget_types = {}
+    for name in selected_budgets:
+        budget_type = budget_type_of(budget_rows.loc[name, "file_type"])
+        if budget_type is None:
+            budget_type = st.selectbox(
+                f"🏷️ '{name}' isn’t typed; choose how to treat expenses:",
+                BUDGET_TYPES, index=0, key=f"consolidated_type_{name}"
+            )
+        budget_types[name] = budget_type
 
-        # 3. Merge budget + expenses
-        merged_full = budget_full.merge(
-            expenses_agg,
-            how="outer",
-            on=["Category", "Sub-Category"]
-        )
+    if st.button("Generate Consolidated Report"):
+        st.session_state.consolidated_open = True
 
-        # 4. Variance
-        merged_full["Amount Spent (USD)"] = merged_full["Amount Spent (USD)"].fillna(0)
-        merged_full["Variance (USD)"] = merged_full["Amount Budgeted"] - merged_full["Amount Spent (USD)"]
+    if not st.session_state.get("consolidated_open"):
+        return
 
-        # 5. Identify Out-of-Budget
-        budget_keys = set(budget_full.set_index(["Category", "Sub-Category"]).index)
-        expense_keys = set(expenses_agg.set_index(["Category", "Sub-Category"]).index)
+    if not selected_budgets or selected_expense == expense_options[0]:
+        st.error("Please select at least one Budget file and an Expense file.")
+        return
 
-        oob_keys = expense_keys - budget_keys
+    expense_row = expense_files[expense_files["file_name"] == selected_expense].iloc[0]
 
-        if oob_keys:
-            oob_items = (
-                expenses_agg.set_index(["Category", "Sub-Category"])
-                .loc[list(oob_keys)]
-                .reset_index()
+    # Budgets download + parse on worker threads while the expenses load here
+    with ThreadPoolExecutor(max_workers=min(4, len(selected_budgets))) as pool:
+        futures = {
+            name: pool.submit(
+                load_budget_frame, name, budget_rows.loc[name, "file_url"], process_budget,
+                file_hash=budget_rows.loc[name].get("content_hash"),
             )
-
-            oob_items["Category"] = "Out of Budget"
-            oob_items["Amount Budgeted"] = 0.0
-            oob_items["Variance (USD)"] = -oob_items["Amount Spent (USD)"]
-            oob_items["is_oob"] = True
-
-            merged_full = merged_full[
-                ~merged_full.set_index(["Category", "Sub-Category"]).index.isin(oob_keys)
-            ]
-
-            merged_full = pd.concat([merged_full, oob_items], ignore_index=True)
-
-            # Ensure duplicates removed
-            merged_full = merged_full[
-                ~merged_full.set_index(["Category","Sub-Category"]).index.isin(oob_keys)
-            ]
-            merged_full = pd.concat([merged_full, oob_items], ignore_index=True)
-
-        # 6. Category totals (OOB categories get total budget = 0)
-        def total_budget(series):
-            if (series == "OOB").any():
-                return 0
-            return series.sum()
-
-        cat_totals = (
-            merged_full.groupby("Category", as_index=False)
-            .agg({
-                "Amount Budgeted": total_budget,
-                "Amount Spent (USD)": "sum",
-                "Variance (USD)": "sum"
-            })
-        )
-        cat_totals["Sub-Category"] = ""
-        cat_totals["is_total"] = True
-        merged_full["is_total"] = False
-
-        hierarchy_view = pd.concat([cat_totals, merged_full], ignore_index=True)
-
-        # 7. Sorting order: normal → subcats → Out-of-Budget
-        hierarchy_view["sort_key"] = hierarchy_view.apply(
-            lambda r: (
-                1 if r["Category"] == "Out of Budget" else 0,
-                0 if r.get("is_total") else 1,
-                str(r["Sub-Category"])
-            ),
-            axis=1
+            for name in selected_budgets
+        }
+        df_expense_all = load_expense_frame(
+            selected_expense, expense_row["file_url"], process_expenses, get_usd_rates, convert_row_amount_to_usd,
+            file_hash=expense_row.get("content_hash"),
         )
-        hierarchy_view.sort_values("sort_key", inplace=True)
-        hierarchy_view.drop(columns=["sort_key"], inplace=True)
 
-        # 8. Formatting helper
-        def fmt_budget(val):
-            if isinstance(val, (int, float)) and val == 0:
-                return "OOB"
+        frames = []
+        for name, future in futures.items():
             try:
-                return f"{val:,.2f}"
-            except Exception:
-                return val
-
-        # 9. Display Full Hierarchy View
-        with st.expander("📘 Full Budget View (USD) — Category + Subcategories", expanded=False):
-
-            df_display = hierarchy_view.copy()
-
-            # Sort categories in same order as budget file, OOB last
-            budget_order = df_budget["Category"].drop_duplicates().tolist()
-            df_display["Category"] = pd.Categorical(
-                df_display["Category"],
-                categories=budget_order + ["Out of Budget"],
-                ordered=True
-            )
-            df_display.sort_values(["Category", "Sub-Category"], inplace=True)
-
-            # Add indentation for subcategories
-            INDENT = "\u2003\u2003\u2003"
-            df_display.loc[
-                df_display["Sub-Category"].notna() & (df_display["Sub-Category"] != ""),
-                "Sub-Category"
-            ] = (
-                INDENT + "→ " +
-                df_display.loc[
-                    df_display["Sub-Category"].notna() & (df_display["Sub-Category"] != ""),
-                    "Sub-Category"
-                ].astype(str)
-            )
-
-            df_display.reset_index(drop=True, inplace=True)
-
-            # Recalculate variance status
-            df_display["Status"] = df_display.apply(
-                lambda row: get_variance_status(
-                    row["Amount Budgeted"],
-                    row["Amount Spent (USD)"],
-                    row["Variance (USD)"],
-                ),
-                axis=1
-            )
-
-            display_cols = [
-                "Category", "Sub-Category",
-                "Amount Budgeted", "Amount Spent (USD)",
-                "Variance (USD)", "Status"
-            ]
-
-            st.dataframe(
-                df_display[display_cols].style
-                    .apply(
-                        lambda row: [
-                            "font-weight: bold"
-                            if not row["Sub-Category"] or row["Sub-Category"] == "→ "
-                            else ""
-                            for _ in row
-                        ],
-                        axis=1
-                    )
-                    .apply(variance_colour_style, axis=1)
-                    .format({
-                        "Amount Budgeted": lambda v, is_oob=None: "OOB" if is_oob else f"{v:,.2f}",
-                        "Amount Spent (USD)": "{:,.2f}",
-                        "Variance (USD)": "{:,.2f}",
-                    }),
-                use_container_width=True
-            )
+                df_budget = future.result()
+            except Exception as e:
+                st.error(f"❌ Could not process Budget file '{name}': {e}")
+                return
+            frames.append(df_budget.assign(**{"Budget File": name, "Budget Type": budget_types[name]}))
+
+    with memory_stage("consolidated routing"):
+        df_budgets = pd.concat(frames, ignore_index=True)
+        routed = route_expenses(df_budgets, df_expense_all)
+    record_frame("df_budgets (consolidated)", df_budgets)
+
+    unrouted = len(df_expense_all) - len(routed)
+    if unrouted:
+        st.caption(f"{unrouted:,} expense row(s) have a Classification none of the selected budgets cover.")
+
+    view = with_variance_status(consolidated_view(df_budgets, routed), get_variance_status)
+
+    st.markdown("Consolidated Report")
+
+    st.markdown("**Per-budget subtotals**")
+    with span("styler render"):
+        st.dataframe(
+            view[view["Level"].isin(["Budget", "Total"])]
+                .drop(columns=["Category", "Sub-Category", "Level"])
+                .style.apply(variance_colour_style, axis=1)
+                .format(MONEY_FORMATS),
+            width="stretch",
+            hide_index=True
+        )
 
+    with st.expander("📚 Consolidated Budget View (USD) — Budget + Category + Subcategories", expanded=True):
+        render_paged_table(
+            view,
+            key="tbl_consolidated",
+            row_styles=[
+                lambda row: [
+                    "font-weight: bold" if row["Level"] != "Sub-Category" else ""
+                    for _ in row
+                ],
+                variance_colour_style,
+            ],
+            formats=MONEY_FORMATS,
+        )
+        render_export_buttons(
+            view,
+            "Consolidated_Budget_View",
+            key="exp_consolidated",
+            bold_rows=view["Level"].ne("Sub-Category").to_numpy(),
+        )
@@ -0,0 +1,255 @@
+# Schema for the tables the application creates itself.
+# Author: Zedaine McDonald
+#
+# The core tables (users, loginlogs, uploadedfiles, budget_state) come from
+# the data dump described in the readme. Everything added after that is
+# declared here and created on demand with CREATE TABLE IF NOT EXISTS.
+
+from .db import run_execute, run_query, dedupe_uploaded_file_names
+
+SCHEMA_STATEMENTS = [
+    # Parsed (normalized) budget / expense datasets, one per uploaded file.
+    """
+    CREATE TABLE IF NOT EXISTS parsed_files (
+        file_name VARCHAR(255) NOT NULL PRIMARY KEY,
+        file_kind VARCHAR(16) NOT NULL,
+        payload LONGBLOB NOT NULL,
+        row_count INT NOT NULL,
+        fx_provider VARCHAR(64) NULL,
+        fx_fetched_at DATETIME NULL,
+        parsed_at DATETIME NOT NULL
+    )
+    """,
+    # Precomputed report views for a (budget, expense, budget type) pair.
+    """
+    CREATE TABLE IF NOT EXISTS report_aggregates (
+        budget_file VARCHAR(255) NOT NULL,
+        expense_file VARCHAR(255) NOT NULL,
+        budget_type VARCHAR(8) NOT NULL,
+        subcategory_view LONGBLOB NOT NULL,
+        category_view LONGBLOB NOT NULL,
+        hierarchy_view LONGBLOB NOT NULL,
+        computed_at DATETIME NOT NULL,
+        PRIMARY KEY (budget_file, expense_file, budget_type),
+        INDEX idx_report_aggregates_expense (expense_file)
+    )
+    """,
+    # Normalized budget rows, one per budget line of an uploaded budget file.
+    """
+    CREATE TABLE IF NOT EXISTS budget_rows (
+        id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        file_name VARCHAR(255) NOT NULL,
+        category VARCHAR(255) NOT NULL,
+        subcategory VARCHAR(255) NOT NULL,
+        january DOUBLE NOT NULL DEFAULT 0,
+        february DOUBLE NOT NULL DEFAULT 0,
+        march DOUBLE NOT NULL DEFAULT 0,
+        april DOUBLE NOT NULL DEFAULT 0,
+        may DOUBLE NOT NULL DEFAULT 0,
+        june DOUBLE NOT NULL DEFAULT 0,
+        july DOUBLE NOT NULL DEFAULT 0,
+        august DOUBLE NOT NULL DEFAULT 0,
+        september DOUBLE NOT NULL DEFAULT 0,
+        october DOUBLE NOT NULL DEFAULT 0,
+        november DOUBLE NOT NULL DEFAULT 0,
+        december DOUBLE NOT NULL DEFAULT 0,
+        total DOUBLE NOT NULL DEFAULT 0,
+        INDEX idx_budget_rows_file (file_name, category, subcategory)
+    )
+    """,
+    # Normalized expense rows (amounts already converted to USD).
+    """
+    CREATE TABLE IF NOT EXISTS expense_rows (
+        id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        file_name VARCHAR(255) NOT NULL,
+        expense_date DATE NULL,
+        category VARCHAR(255) NOT NULL,
+        subcategory VARCHAR(255) NOT NULL,
+        vendor VARCHAR(255) NULL,
+        classification VARCHAR(32) NOT NULL,
+        amount_usd DOUBLE NULL,
+        INDEX idx_expense_rows_file (file_name, classification, category, subcategory)
+    )
+    """,
+    # Change counter per budget file's classification state. Bumped on every
+    # save so cached copies of budget_state can be checked with one PK lookup.
+    """
+    CREATE TABLE IF NOT EXISTS budget_state_versions (
+        file_name VARCHAR(255) NOT NULL PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0,
+        updated_at DATETIME NOT NULL
+    )
+    """,
+    # Wide budget_state layout: one row per sub-category, a status and an
+    # amount column per month (see budget_state_layout() in functions/db.py).
+    """
+    CREATE TABLE IF NOT EXISTS budget_state_wide (
+        file_name VARCHAR(255) NOT NULL,
+        category VARCHAR(255) NOT NULL,
+        subcategory VARCHAR(255) NOT NULL,
+        january_status VARCHAR(64) NULL,
+        january_amount DOUBLE NULL,
+        february_status VARCHAR(64) NULL,
+        february_amount DOUBLE NULL,
+        march_status VARCHAR(64) NULL,
+        march_amount DOUBLE NULL,
+        april_status VARCHAR(64) NULL,
+        april_amount DOUBLE NULL,
+        may_status VARCHAR(64) NULL,
+        may_amount DOUBLE NULL,
+        june_status VARCHAR(64) NULL,
+        june_amount DOUBLE NULL,
+        july_status VARCHAR(64) NULL,
+        july_amount DOUBLE NULL,
+        august_status VARCHAR(64) NULL,
+        august_amount DOUBLE NULL,
+        september_status VARCHAR(64) NULL,
+        september_amount DOUBLE NULL,
+        october_status VARCHAR(64) NULL,
+        october_amount DOUBLE NULL,
+        november_status VARCHAR(64) NULL,
+        november_amount DOUBLE NULL,
+        december_status VARCHAR(64) NULL,
+        december_amount DOUBLE NULL,
+        updated_by VARCHAR(255) NULL,
+        updated_at DATETIME NULL,
+        PRIMARY KEY (file_name, category, subcategory)
+    )
+    """,
+    # Budget files whose long-layout budget_state rows were copied to budget_state_wide.
+    """
+    CREATE TABLE IF NOT EXISTS budget_state_migrations (
+        file_name VARCHAR(255) NOT NULL PRIMARY KEY,
+        migrated_at DATETIME NOT NULL
+    )
+    """,
+    # Append-only log of classification changes, one record per changed cell.
+    """
+    CREATE TABLE IF NOT EXISTS budget_state_history (
+        id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        file_name VARCHAR(255) NOT NULL,
+        category VARCHAR(255) NOT NULL,
+        subcategory VARCHAR(255) NOT NULL,
+        month VARCHAR(16) NOT NULL,
+        old_status VARCHAR(64) NULL,
+        new_status VARCHAR(64) NULL,
+        changed_by VARCHAR(255) NULL,
+        changed_at DATETIME NOT NULL,
+        INDEX idx_budget_state_history_time (file_name, changed_at),
+        INDEX idx_budget_state_history_replay (file_name, id)
+    )
+    """,
+    # Full status grid of a file at a point in the history (parquet payload).
+    """
+    CREATE TABLE IF NOT EXISTS budget_state_checkpoints (
+        id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        file_name VARCHAR(255) NOT NULL,
+        taken_at DATETIME NOT NULL,
+        last_history_id BIGINT NOT NULL,
+        payload LONGBLOB NOT NULL,
+        INDEX idx_budget_state_checkpoints_time (file_name, taken_at)
+    )
+    """,
+    # Background precompute job log.
+    """
+    CREATE TABLE IF NOT EXISTS precompute_jobs (
+        id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        file_name VARCHAR(255) NOT NULL,
+        status VARCHAR(16) NOT NULL,
+        detail TEXT NULL,
+        enqueued_at DATETIME NOT NULL,
+        started_at DATETIME NULL,
+        finished_at DATETIME NULL,
+        INDEX idx_precompute_jobs_file (file_name, enqueued_at)
+    )
+    """,
+    # Login sessions: SHA-256 of the token in the browser cookie.
+    """
+    CREATE TABLE IF NOT EXISTS user_sessions (
+        token_hash CHAR(64) NOT NULL PRIMARY KEY,
+        email VARCHAR(255) NOT NULL,
+        created_at DATETIME NOT NULL,
+        expires_at DATETIME NOT NULL,
+        revoked_at DATETIME NULL,
+        INDEX idx_user_sessions_email (email),
+        INDEX idx_user_sessions_expires (expires_at)
+    )
+    """,
+]
+
+# Columns added to tables created outside this module: (table, column, definition).
+SCHEMA_COLUMNS = [
+    # SHA-256 of the uploaded workbook, for duplicate detection.
+    ("uploadedfiles", "content_hash", "CHAR(64) NULL"),
+    # Earlier upload with identical content whose Drive file and parse this record reuses.
+    ("uploadedfiles", "alias_of", "VARCHAR(255) NULL"),
+]
+
+# Secondary indexes on tables created outside this module:
+# (table, index name, column list). MySQL has no CREATE INDEX IF
+# NOT EXISTS, so ensure_schema() checks information_schema first.
+SCHEMA_INDEXES = [
+    # Dashboard status totals group budget_state by file.
+    ("budget_state", "idx_budget_state_file_status", "file_name, status_category"),
+    # Duplicate-upload lookup by content hash.
+    ("uploadedfiles", "idx_uploadedfiles_hash", "content_hash"),
+]
+
+# One record per name; uploads reserve their name with an INSERT, which is
+# only atomic once this index exists (see ensure_unique_file_names()).
+FILE_NAME_INDEX = ("uploadedfiles", "uq_uploadedfiles_file_name", "file_name")
+
+
+def ensure_column(table, column, definition):
+    exists = run_query("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+    """, (table, column))
+    if not exists:
+        run_execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
+
+def index_exists(table, index_name):
+    return bool(run_query("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, index_name)))
+
+
+def ensure_index(table, index_name, columns, unique=False):
+    if not index_exists(table, index_name):
+        run_execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {index_name} ON {table} ({columns})")
+    return True
+
+
+def ensure_unique_file_names():
+    """
+    Create the unique index on uploadedfiles.file_name. Redundant duplicate
+    records are removed first; if names with different files remain, raises
+    with the list so an admin can resolve them (until then two uploads of
+    one name are not kept apart).
+    """
+    table, index_name, columns = FILE_NAME_INDEX
+    if index_exists(table, index_name):
+        return True
+
+    conflicts = dedupe_uploaded_file_names()
+    if conflicts:
+        names = ", ".join(f"{row['file_name']} ({row['records']} records)" for row in conflicts)
+        raise RuntimeError(f"duplicate file names block the unique index: {names}")
+    return ensure_index(table, index_name, columns, unique=True)
+
+
+def ensure_schema():
+    """Create any missing application tables, columns and indexes. Safe to call repeatedly."""
+    for statement in SCHEMA_STATEMENTS:
+        run_execute(statement)
+    for table, column, definition in SCHEMA_COLUMNS:
+        ensure_column(table, column, definition)
+    for index in SCHEMA_INDEXES:
+        ensure_index(*index)
+    return True
+
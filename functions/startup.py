@@ -0,0 +1,97 @@
+# functions/startup.py
+"""
+One-time process startup.
+
+run_startup() does the work a server process needs once. It runs in two
+phases so the login screen only waits for what it needs:
+- "core", before the login screen: reading secrets, opening database
+  connections, creating the application tables and seeding the admin user.
+- "warm", after login: purging old sessions, building the Drive
+  credentials and fetching FX rates (which also imports the heavier
+  modules those need).
+main.py calls it on every rerun; once a phase has run it returns at once.
+
+Each step is timed, so the admin panel can show what a cold start costs.
+A required step that fails is retried on the next call; no step runs
+again once it has succeeded.
+
+Author: Zedaine McDonald
+"""
+
+import threading
+import time
+from datetime import datetime
+
+import streamlit as st
+
+
+def _startup_steps(phase):
+    from .db import db_settings, warm_db_pool, seed_admin_user, purge_user_sessions
+    from .schema import ensure_schema, ensure_unique_file_names
+
+    # (label, step, required): a failed required step is retried on the next
+    # call; the others are warm-ups, tried once.
+    if phase == "core":
+        return [
+            ("secrets", db_settings, True),
+            ("db pool", warm_db_pool, True),
+            ("schema", ensure_schema, True),
+            # Fails while conflicting duplicate names exist; File Management
+            # lists them and retries once they are resolved.
+            ("unique file names", ensure_unique_file_names, False),
+            ("seed admin", seed_admin_user, True),
+        ]
+
+    from fxhelper import shared_usd_rates
+    from .drive_utils import drive_credentials
+
+    return [
+        ("purge sessions", purge_user_sessions, False),
+        ("drive credentials", drive_credentials, False),
+        ("fx rates", shared_usd_rates, False),
+    ]
+
+
+@st.cache_resource(show_spinner=False)
+def _startup_state():
+    return {"lock": threading.Lock(), "done": set(), "complete": set(), "timings": []}
+
+
+def run_startup(phase="core"):
+    """Run the steps of a startup phase ("core" or "warm") still outstanding in this process."""
+    state = _startup_state()
+    if phase in state["complete"]:
+        return
+
+    with state["lock"]:
+        steps = _startup_steps(phase)
+        for label, step, required in steps:
+            if label in state["done"]:
+                continue
+            t_start = time.perf_counter()
+            try:
+                step()
+                status = "ok"
+                state["done"].add(label)
+            except Exception as e:
+                status = f"failed: {e}"
+                print(f"⚠️ Startup step '{label}' failed: {e}")
+                if not required:
+                    state["done"].add(label)
+            state["timings"].append({
+                "phase": phase,
+                "step": label,
+                "ms": round((time.perf_counter() - t_start) * 1000, 1),
+                "status": status,
+                "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            })
+        if all(label in state["done"] for label, _, _ in steps):
+            state["complete"].add(phase)
+
+
+def startup_timings():
+    """Every startup step run in this process, with its duration and outcome."""
+    import pandas as pd
+
+    timings = list(_startup_state()["timings"])
+    return pd.DataFrame(timings, columns=["phase", "step", "ms", "status", "at"])
@@ -0,0 +1,331 @@
+# functions/storage.py
+"""
+Storage backends for uploaded workbooks.
+
+Every uploaded file is addressed by the location stored in
+uploadedfiles.file_url. Two backends implement the same interface
+(put / open / stat / delete / list):
+
+- DriveStorage: Google Drive; locations are https://drive.google.com/uc?id=<id>.
+- LocalStorage: content-addressed files on local disk; locations are
+  local://<sha256>. Reads open the file directly, so serving a workbook
+  needs no HTTP round trip and no in-memory copy.
+
+New uploads go to the backend named by the STORAGE_BACKEND secret
+("drive" by default, or "local" with LOCAL_STORAGE_DIR). Reads dispatch
+on the location, so files already stored by the other backend stay
+readable.
+
+Author: Zedaine McDonald
+"""
+
+import hashlib
+import os
+import pathlib
+import tempfile
+from io import BytesIO
+
+import streamlit as st
+
+from .tracing import span
+
+LOCAL_SCHEME = "local://"
+COPY_CHUNK = 4 * 1024 * 1024
+
+
+class StorageBackend:
+    """Interface shared by the storage backends."""
+
+    name = ""
+
+    def put(self, name, stream, size, mime_type, on_progress=None):
+        """Store a file-like object; returns its location."""
+        raise NotImplementedError
+
+    def open(self, location, expected_hash=None):
+        """
+        Readable, seekable file-like object with the file's content (close
+        it when done). expected_hash is the SHA-256 recorded at upload, if any.
+        """
+        raise NotImplementedError
+
+    def stat(self, location):
+        """{"location", "name", "size"} or None if the file does not exist."""
+        raise NotImplementedError
+
+    def stat_many(self, locations):
+        """
+        {location: stat or None} for several files. A location the backend
+        cannot check is left out rather than reported missing.
+        """
+        return {loc: self.stat(loc) for loc in locations}
+
+    def delete(self, locations):
+        """Delete several files; returns the locations that could not be deleted."""
+        raise NotImplementedError
+
+    def list(self):
+        """Every stored file as {"location", "name", "size"}."""
+        raise NotImplementedError
+
+    def owns(self, location):
+        """True if the location belongs to this backend."""
+        raise NotImplementedError
+
+
+# ============================================================
+# GOOGLE DRIVE
+# ============================================================
+class DriveStorage(StorageBackend):
+    """Files in the upload folder on Google Drive (see functions/drive_utils.py)."""
+
+    name = "drive"
+
+    @staticmethod
+    def location(file_id):
+        return f"https://drive.google.com/uc?id={file_id}"
+
+    def owns(self, location):
+        return str(location or "").startswith("https://drive.google.com/")
+
+    def put(self, name, stream, size, mime_type, on_progress=None):
+        from .drive_utils import PARENT_FOLDER_ID, get_drive_service, upload_media
+
+        # Files stay private to the service account; reads go through open().
+        metadata = {"name": name, "mimeType": mime_type, "parents": [PARENT_FOLDER_ID]}
+        file_id = upload_media(get_drive_service(), metadata, stream, size, mime_type, on_progress=on_progress)
+        return self.location(file_id)
+
+    def open(self, location, expected_hash=None):
+        from .drive_utils import drive_file_id, download_drive_file
+
+        file_id = drive_file_id(location)
+        if file_id:
+            return download_drive_file(file_id, expected_sha256=expected_hash)
+
+        # Links in another format (older records) are fetched as public links.
+        import requests
+
+        response = requests.get(location)
+        response.raise_for_status()
+        return BytesIO(response.content)
+
+    def stat(self, location):
+        return self.stat_many([location]).get(location)
+
+    def stat_many(self, locations):
+        from .drive_utils import drive_file_id, get_drive_files
+
+        # Links without a file id (older formats) cannot be looked up.
+        ids = {loc: fid for loc in locations if (fid := drive_file_id(loc))}
+        found = get_drive_files(sorted(set(ids.values())))
+        stats = {}
+        for loc, fid in ids.items():
+            meta = found.get(fid)
+            stats[loc] = (
+                {"location": loc, "name": meta.get("name"), "size": meta.get("size")}
+                if meta and not meta.get("trashed") else None
+            )
+        return stats
+
+    def delete(self, locations):
+        from .drive_utils import drive_file_id, delete_drive_files
+
+        ids = {drive_file_id(loc): loc for loc in locations}
+        failed = delete_drive_files([fid for fid in ids if fid])
+        return [ids[fid] for fid in failed]
+
+    def list(self):
+        from .drive_utils import list_folder_files
+
+        return [
+            {"location": self.location(f["id"]), "name": f.get("name"), "size": f.get("size")}
+            for f in list_folder_files()
+        ]
+
+
+# ============================================================
+# LOCAL DISK (content-addressed)
+# ============================================================
+class LocalStorage(StorageBackend):
+    """
+    Files stored under <root>/objects/<first 2 hex chars>/<sha256>. Equal
+    content is stored once; the location is derived from the content.
+    """
+
+    name = "local"
+
+    def __init__(self, root):
+        self.root = pathlib.Path(root).expanduser()
+
+    def owns(self, location):
+        return str(location or "").startswith(LOCAL_SCHEME)
+
+    def _path(self, location):
+        digest = str(location)[len(LOCAL_SCHEME):]
+        if len(digest) != 64 or any(ch not in "0123456789abcdef" for ch in digest):
+            raise ValueError(f"Not a local storage location: {location}")
+        return self.root / "objects" / digest[:2] / digest
+
+    def put(self, name, stream, size, mime_type, on_progress=None):
+        # Hash while copying to a temp file, then move it into place.
+        digest = hashlib.sha256()
+        stream.seek(0)
+        written = 0
+        self.root.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.root, delete=False) as tmp:
+            for chunk in iter(lambda: stream.read(COPY_CHUNK), b""):
+                digest.update(chunk)
+                tmp.write(chunk)
+                written += len(chunk)
+                if on_progress and size:
+                    on_progress(min(written / size, 1.0))
+        location = LOCAL_SCHEME + digest.hexdigest()
+
+        target = self._path(location)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if target.exists():
+            os.remove(tmp.name)
+        else:
+            os.replace(tmp.name, target)
+        if on_progress:
+            on_progress(1.0)
+        return location
+
+    def open(self, location, expected_hash=None):
+        # Content-addressed: the location already is the SHA-256 of the content.
+        return open(self._path(location), "rb")
+
+    def stat(self, location):
+        try:
+            path = self._path(location)
+            size = path.stat().st_size
+        except (OSError, ValueError):
+            return None
+        return {"location": location, "name": path.name, "size": size}
+
+    def delete(self, locations):
+        failed = []
+        for location in locations:
+            try:
+                self._path(location).unlink(missing_ok=True)
+            except (OSError, ValueError):
+                failed.append(location)
+        return failed
+
+    def list(self):
+        return [
+            {"location": LOCAL_SCHEME + path.name, "name": path.name, "size": path.stat().st_size}
+            for path in (self.root / "objects").glob("*/*")
+            if path.is_file()
+        ]
+
+
+# ============================================================
+# SELECTION
+# ============================================================
+def _setting(key, default=None):
+    try:
+        return st.secrets[key]
+    except Exception:
+        return os.getenv(key, default)
+
+
+@st.cache_resource(show_spinner=False)
+def _backends():
+    local_dir = _setting("LOCAL_STORAGE_DIR") or str(pathlib.Path.home() / "budget_files")
+    return {"drive": DriveStorage(), "local": LocalStorage(local_dir)}
+
+
+def get_storage():
+    """Backend new uploads are written to (STORAGE_BACKEND, default "drive")."""
+    backends = _backends()
+    name = str(_setting("STORAGE_BACKEND", "drive")).lower()
+    if name not in backends:
+        raise RuntimeError(f"Unknown STORAGE_BACKEND: {name}")
+    return backends[name]
+
+
+def storage_for(location):
+    """Backend a stored location belongs to."""
+    for backend in _backends().values():
+        if backend.owns(location):
+            return backend
+    raise ValueError(f"No storage backend for location: {location}")
+
+
+def open_stored_file(location, expected_hash=None):
+    """
+    Readable file-like object for an uploaded file, wherever it is stored.
+    Pass the record's content_hash so the download is checked against it.
+    """
+    if not isinstance(expected_hash, str) or not expected_hash:
+        expected_hash = None  # records from before content hashes (NULL / NaN)
+    with span("file download"):
+        return storage_for(location).open(location, expected_hash=expected_hash)
+
+
+def delete_stored_files(locations):
+    """Delete files across backends; returns the locations that could not be deleted."""
+    failed = []
+    for backend in _backends().values():
+        mine = [loc for loc in locations if backend.owns(loc)]
+        if mine:
+            failed += backend.delete(mine)
+    return failed
+
+
+# ============================================================
+# SYNC (records vs. stored files)
+# ============================================================
+def plan_storage_sync():
+    """
+    Compare uploadedfiles with the files in the active backend. Returns
+    {"db_orphans": [file_name, ...], "storage_orphans": [{location, name, size}, ...],
+    "unknown": [{file_name, file_url}, ...]}: records whose file is gone,
+    stored files no record points to, and records whose location no
+    configured backend can check (an old link format, or a backend that is
+    not configured). Unknown records are only reported, never removed.
+    """
+    from .db import get_uploaded_files
+
+    backend = get_storage()
+    rows = get_uploaded_files()
+    listing = backend.list()
+
+    listed = {f["location"] for f in listing}
+    row_locations = {r["file_name"]: r["file_url"] for r in rows}
+    referenced = set(row_locations.values())
+
+    # A record whose file is not listed may live elsewhere (moved on Drive,
+    # or stored by the other backend); check those before calling them orphans.
+    unlisted = sorted(loc for loc in referenced if loc and loc not in listed)
+    alive, checked = set(listed), set(listed)
+    for other in _backends().values():
+        mine = [loc for loc in unlisted if other.owns(loc)]
+        if mine:
+            stats = other.stat_many(mine)
+            checked |= set(stats)
+            alive |= {loc for loc, meta in stats.items() if meta}
+
+    return {
+        "db_orphans": [name for name, loc in row_locations.items() if loc in checked and loc not in alive],
+        "storage_orphans": [f for f in listing if f["location"] not in referenced],
+        "unknown": [
+            {"file_name": name, "file_url": loc}
+            for name, loc in row_locations.items() if loc not in checked
+        ],
+    }
+
+
+def apply_storage_sync(plan):
+    """
+    Remove the orphans found by plan_storage_sync() (never the unknown
+    records). Returns (records removed, files deleted, failures).
+    """
+    from .db import delete_uploaded_file
+
+    failed = delete_stored_files([f["location"] for f in plan["storage_orphans"]])
+    for name in plan["db_orphans"]:
+        delete_uploaded_file(name)
+    return len(plan["db_orphans"]), len(plan["storage_orphans"]) - len(failed), failed
@@ -0,0 +1,104 @@
+# functions/table_view.py
+"""
+Paged table renderer for the report views.
+
+st.dataframe(df.style) runs the styling function for every row and ships
+every cell's CSS to the browser, so render cost grows with the report.
+render_paged_table() searches and sorts the underlying frame on the server
+and only styles and sends the visible page.
+
+Author: Zedaine McDonald
+"""
+
+import math
+
+import pandas as pd
+import streamlit as st
+
+from .tracing import span
+
+PAGE_SIZES = [25, 50, 100, 250]
+REPORT_ORDER = "(report order)"
+
+
+def search_frame(df, query):
+    """Rows where any column contains the query text (case-insensitive)."""
+    query = (query or "").strip()
+    if not query or df.empty:
+        return df
+    mask = pd.Series(False, index=df.index)
+    for col in df.columns:
+        mask |= df[col].astype(str).str.contains(query, case=False, regex=False, na=False)
+    return df[mask]
+
+
+def sort_frame(df, column, ascending=True):
+    """Stable sort on one column; REPORT_ORDER keeps the frame's own order."""
+    if not column or column == REPORT_ORDER:
+        return df
+    return df.sort_values(column, ascending=ascending, kind="stable", na_position="last")
+
+
+def page_slice(df, page, page_size):
+    """(rows of the requested page, clamped page number, page count)."""
+    pages = max(1, math.ceil(len(df) / page_size))
+    page = min(max(1, int(page)), pages)
+    start = (page - 1) * page_size
+    return df.iloc[start:start + page_size], page, pages
+
+
+def render_paged_table(df, key, row_styles=(), formats=None, sortable_cols=None):
+    """
+    Render a searchable, sortable, paged table.
+
+    Parameters:
+    - df: dataframe
+        Full (unstyled) frame to display.
+    - key: str
+        Unique widget key prefix for this table.
+    - row_styles: iterable of callables
+        Row-wise Styler functions (axis=1), applied to the visible page only.
+    - formats: dict
+        Styler.format() mapping, applied to the visible page only.
+    - sortable_cols: list
+        Columns offered for sorting (defaults to every column).
+    """
+    sortable_cols = list(sortable_cols or df.columns)
+
+    c1, c2, c3, c4 = st.columns([3, 2, 1, 1])
+    with c1:
+        query = st.text_input("Search", key=f"{key}_search", placeholder="Filter rows…")
+    with c2:
+        sort_col = st.selectbox("Sort by", [REPORT_ORDER] + sortable_cols, key=f"{key}_sort")
+    with c3:
+        ascending = st.toggle("Ascending", value=True, key=f"{key}_asc")
+    with c4:
+        page_size = st.selectbox("Rows", PAGE_SIZES, index=1, key=f"{key}_size")
+
+    view = sort_frame(search_frame(df, query), sort_col, ascending)
+
+    # Keep the page selector inside the range left after searching.
+    pages = max(1, math.ceil(len(view) / page_size))
+    page_key = f"{key}_page"
+    if st.session_state.get(page_key, 1) > pages:
+        st.session_state[page_key] = pages
+
+    page_no = 1
+    if pages > 1:
+        page_no = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=page_key)
+    page, page_no, pages = page_slice(view, page_no, page_size)
+
+    with span("styler render"):
+        styler = page.style
+        for style_fn in row_styles:
+            styler = styler.apply(style_fn, axis=1)
+        if formats:
+            styler = styler.format(formats)
+
+        st.dataframe(styler, width="stretch")
+
+    first = (page_no - 1) * page_size
+    caption = f"Rows {first + 1 if len(page) else 0:,}–{first + len(page):,} of {len(view):,}"
+    if len(view) != len(df):
+        caption += f" (filtered from {len(df):,})"
+    st.caption(caption)
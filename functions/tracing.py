@@ -0,0 +1,175 @@
+# functions/tracing.py
+"""
+Stage timing spans.
+
+span(stage) times one stage of a rerun (a query, a download, a parse, a
+report view, ...) and traced(stage) does the same for a whole function:
+
+    with span("process_budget"):
+        df = process_budget(content)
+
+    @traced("view: category")
+    def category_view(...): ...
+
+Spans go to a process-wide ring buffer, tagged with the rerun they ran in,
+and are summarised in the admin panel (p50/p95 per stage, slowest reruns).
+
+Tracing is off unless BUDGET_TRACING=1 is set or an admin turns it on.
+When off, span() returns a shared no-op and traced() makes one flag check.
+
+Author: Zedaine McDonald
+"""
+
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from functools import wraps
+
+MAX_SPANS = 5000
+
+_spans = deque(maxlen=MAX_SPANS)
+_lock = threading.Lock()
+_state = {"enabled": os.getenv("BUDGET_TRACING", "").strip().lower() in ("1", "true", "yes")}
+_thread_rerun = threading.local()
+_rerun_ids = itertools.count(1)
+
+
+def tracing_enabled():
+    return _state["enabled"]
+
+
+def set_tracing(enabled):
+    _state["enabled"] = bool(enabled)
+
+
+def _current_rerun():
+    """
+    Id of the rerun running on this thread; None on worker threads.
+
+    A session's script thread runs rerun after rerun (queued reruns,
+    st.rerun(), fragment reruns), so the thread alone does not identify a
+    rerun. Streamlit resets the ScriptRunContext at the start of every run,
+    which gives it a fresh `cursors` dict: a new dict means a new rerun.
+    The thread keeps a reference to the dict it saw, so a new one can never
+    reuse its id().
+    """
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None:
+        return None
+    if getattr(_thread_rerun, "marker", None) is not ctx.cursors:
+        _thread_rerun.marker = ctx.cursors
+        _thread_rerun.id = next(_rerun_ids)
+    return _thread_rerun.id
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("stage", "started", "t_start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.time()
+        self.t_start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        # Exceptions (including st.rerun()/st.stop()) still close the span.
+        ms = (time.perf_counter() - self.t_start) * 1000
+        record = {"stage": self.stage, "ms": ms, "rerun": _current_rerun(), "at": self.started}
+        with _lock:
+            _spans.append(record)
+        return False
+
+
+def span(stage):
+    """Context manager timing one stage; a no-op while tracing is off."""
+    if not _state["enabled"]:
+        return _NO_SPAN
+    return _Span(stage)
+
+
+def traced(stage):
+    """Decorator: time every call of the function as `stage`."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _state["enabled"]:
+                return fn(*args, **kwargs)
+            with _Span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def clear_spans():
+    with _lock:
+        _spans.clear()
+
+
+# ============================================================
+# SUMMARIES
+# ============================================================
+def _span_frame():
+    import pandas as pd
+
+    with _lock:
+        rows = list(_spans)
+    return pd.DataFrame(rows, columns=["stage", "ms", "rerun", "at"])
+
+
+def stage_summary():
+    """Calls, p50/p95/max and total milliseconds per stage, slowest p95 first."""
+    df = _span_frame()
+    if df.empty:
+        return df.reindex(columns=["stage", "calls", "p50 ms", "p95 ms", "max ms", "total ms"])
+
+    summary = df.groupby("stage")["ms"].agg(
+        calls="size",
+        p50=lambda s: s.quantile(0.5),
+        p95=lambda s: s.quantile(0.95),
+        max="max",
+        total="sum",
+    ).reset_index()
+    summary = summary.rename(columns={
+        "p50": "p50 ms", "p95": "p95 ms", "max": "max ms", "total": "total ms"
+    })
+    return summary.round(1).sort_values("p95 ms", ascending=False)
+
+
+def slowest_reruns(limit=10):
+    """The slowest recent reruns: wall time (first span start to last span end) and their slowest stage."""
+    import pandas as pd
+
+    df = _span_frame().dropna(subset=["rerun"])
+    if df.empty:
+        return pd.DataFrame(columns=["rerun", "started", "wall ms", "spans", "slowest stage", "slowest ms"])
+
+    df["ended"] = df["at"] + df["ms"] / 1000
+    slowest = df.loc[df.groupby("rerun")["ms"].idxmax(), ["rerun", "stage", "ms"]]
+    reruns = df.groupby("rerun").agg(started=("at", "min"), ended=("ended", "max"), spans=("stage", "size"))
+    reruns = reruns.reset_index().merge(slowest, on="rerun")
+    reruns["wall ms"] = ((reruns["ended"] - reruns["started"]) * 1000).round(1)
+    reruns["started"] = reruns["started"].map(lambda t: datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S"))
+    reruns = reruns.rename(columns={"stage": "slowest stage", "ms": "slowest ms"}).round({"slowest ms": 1})
+    reruns["rerun"] = reruns["rerun"].astype(int)
+    return (
+        reruns.sort_values("wall ms", ascending=False)
+        .head(limit)[["rerun", "started", "wall ms", "spans", "slowest stage", "slowest ms"]]
+    )
@@ -4,6 +4,8 @@ import requests
 import streamlit as st
 from datetime import datetime, timedelta
 
+from functions.tracing import traced
+
 """
 Contains Helper functions that assist in Converting expense amounts into USD.
 """
@@ -77,24 +79,46 @@ def get_usd_rates():
         if now - st.session_state.fx_fetched_at < timedelta(minutes=FX_TTL_MINUTES):
             return st.session_state.fx_rates
 
+    try:
+        rates, provider, fetched_at = shared_usd_rates()
+        st.session_state.fx_rates = rates
+        st.session_state.fx_fetched_at = fetched_at
+        st.session_state.fx_provider = provider
+        return rates
+    except RuntimeError:
+        if "fx_rates" in st.session_state and isinstance(st.session_state.fx_rates, dict):
+            st.warning("Using last known FX rates (providers unavailable).")
+            return st.session_state.fx_rates
+        raise
+
+@traced("fx fetch")
+def fetch_usd_rates() -> tuple[dict, str]:
+    """
+    Fetch USD-base rates from the first provider that answers, without
+    touching session state (safe to call from background threads).
+
+    :return: (rates, provider name)
+    :raises RuntimeError: if every provider fails
+    """
     last_error = None
     for fetcher in (_fetch_exchangerate_host, _fetch_er_api):
         try:
-            rates, provider = fetcher()
-            st.session_state.fx_rates = rates
-            st.session_state.fx_fetched_at = now
-            st.session_state.fx_provider = provider
-            return rates
+            return fetcher()
         except Exception as e:
             last_error = e
             continue
 
-    if "fx_rates" in st.session_state and isinstance(st.session_state.fx_rates, dict):
-        st.warning("Using last known FX rates (providers unavailable).")
-        return st.session_state.fx_rates
-
     raise RuntimeError(f"All FX providers failed: {last_error}")
 
+@st.cache_data(ttl=FX_TTL_MINUTES * 60, show_spinner=False)
+def shared_usd_rates():
+    """
+    fetch_usd_rates() shared by every session of the process for
+    FX_TTL_MINUTES: (rates, provider, fetched_at). Failures are not cached.
+    """
+    rates, provider = fetch_usd_rates()
+    return rates, provider, datetime.now()
+
 def detect_currency_from_row(row: pd.Series, df_expense: pd.DataFrame) -> str | None:
     col = "Currency"
     if col in df_expense.columns and pd.notna(row.get(col)):
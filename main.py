@@ -1,30 +1,17 @@
 import streamlit as st
-import bcrypt
-import base64
-
-import requests
 
 from functions.auth import auth_flow
 from functions.db import *
-from functions.drive_utils import upload_to_drive_and_log
-from analysis import process_budget, process_expenses
-from fxhelper import get_usd_rates, convert_row_amount_to_usd
-from functions.dashboard_classification import dashboard
-from functions.report_generator import render_generate_report_section
+from functions.startup import run_startup, startup_timings
+from functions.perf import measure, measurement_summary
+from functions.tracing import tracing_enabled, set_tracing, clear_spans, stage_summary, slowest_reruns
 
-#Seeding a default admin user if the application has no users at startup.
-seed_admin_user()
+#Process startup (secrets, DB pool, schema, admin seeding): runs once per process.
+with measure("app: startup"):
+    run_startup()
 # Constants
 INACTIVITY_LIMIT_MINUTES = 10
 
-@st.cache_data(ttl=1800)
-def cached_fx_rates():
-    return get_usd_rates()
-
-@st.cache_data(ttl=600)
-def cached_file_download(url: str):
-    return requests.get(url).content
-
 
 #Helper to colour code Variance column conditionally
 ##Rules:
@@ -81,32 +68,56 @@ def get_variance_status(budget, spent, variance):
 
 
 #Authentication Screen(Login)
-if not auth_flow():
-    st.stop()
+with measure("app: auth"):
+    if not auth_flow():
+        st.stop()
+
+# Everything below is for signed-in users. The heavier modules (pandas,
+# bcrypt, the Drive client, Excel parsing, reports) load from here on, so
+# the login screen of a cold worker does not wait for them.
+import base64
+import bcrypt
+import pandas as pd
+
+from functions.drive_utils import upload_to_drive_and_log
+from functions.storage import delete_stored_files, plan_storage_sync, apply_storage_sync
+from functions.schema import ensure_unique_file_names
+from functions.importing import import_time_profile
+from functions.query_log import (
+    query_stats, slow_queries, query_stats_json, reset_query_stats, slow_query_ms, set_slow_query_ms
+)
+from functions.export_utils import render_export_buttons
+from functions.memprofile import (
+    memory_profiling_enabled, set_memory_profiling, clear_memory_profile,
+    frame_report, stage_report, top_allocators,
+)
+
+#Warm-up (Drive credentials, FX rates, ...): once per process.
+with measure("app: warm-up"):
+    run_startup("warm")
 
 # Main dashboard
 st.title("MSGIT Budget Reporter")
 # === Templates download (Budget & Expenses) ===
 
-ip = get_ip()
-log_login_activity(st.session_state.email, "Login", ip)
+# Log the login once per session, not on every rerun.
+if st.session_state.get("login_logged_for") != st.session_state.email:
+    with measure("app: login log"):
+        ip = get_ip()
+        log_login_activity(st.session_state.email, "Login", ip)
+    st.session_state.login_logged_for = st.session_state.email
 
 st.success(f"✅ Logged in as {st.session_state.name}")
 st.caption(f"Role: {st.session_state.user_record.get('role','user')}")
 
 
 # --- Admin panel ---
-_is_admin = str(st.session_state.user_record.get("role", "user")).strip().lower() == "admin"
-if _is_admin:
-    st.subheader("Admin Panel")
-
-    #Global refresh for cached sheets
-    if st.button("♻️ Data Refresh"):
-                #clear_cache()
-                st.success("Cache cleared.")
-                st.rerun()
-
-    #CRUD on Users
+# Each admin section is a fragment, so interacting with one reruns only
+# that section instead of the whole script (auth, queries and the report).
+#CRUD on Users
+@st.fragment
+@measure("admin: user management")
+def render_user_management():
     with st.expander("User Management", expanded=False):
         # --- Load cached sheet data (API-safe) ---
         user_records = get_all_users()
@@ -115,7 +126,7 @@ if _is_admin:
         # Handle refresh manually (clear cache + rerun)
         if st.button("🔄 Refresh Users"):
             #clear_cache()
-            st.rerun()
+            st.rerun(scope="fragment")
 
         # --- Display users ---
         if df_users.empty:
@@ -146,7 +157,7 @@ if _is_admin:
                         encoded = base64.b64encode(hashed).decode()
                         add_user(new_name, new_username, new_email, encoded, new_role)
                         st.success("✅ User added — they’ll be required to change password on first login.")
-                        st.rerun()
+                        st.rerun(scope="fragment")
                     #except APIError:
                     #    st.error("Google API temporarily unavailable. Please try again later.")
                     except Exception as e:
@@ -181,7 +192,7 @@ if _is_admin:
                                     bcrypt.hashpw(new_pw_plain.encode(), bcrypt.gensalt())
                                 ).decode())
                                 st.success("✅ Password reset — user must change it next login.")
-                                st.rerun()
+                                st.rerun(scope="fragment")
                         except Exception as e:
                             st.error(f"Reset failed: {e}")
 
@@ -194,12 +205,16 @@ if _is_admin:
                 
                             delete_user(sel_email)
                             st.success("✅ User removed.")
-                            st.rerun()
+                            st.rerun(scope="fragment")
                         
                         except Exception as e:
                             st.error(f"Delete failed: {e}")
 
-    # To View Logins
+
+# To View Logins
+@st.fragment
+@measure("admin: login activity")
+def render_login_activity():
     with st.expander("Login Activity", expanded=False):
         # --- Load cached sheet data safely ---
         records = get_login_logs()
@@ -208,12 +223,12 @@ if _is_admin:
         # --- Manual refresh button (clear cache + rerun) ---
         if st.button("🔄 Refresh Logs"):
             #clear_cache()
-            st.rerun()
+            st.rerun(scope="fragment")
 
         # --- Handle empty logs ---
         if df_logs.empty:
             st.info("No login activity found.")
-            st.stop()
+            return
 
         # --- Display main log dataframe ---
         st.dataframe(df_logs, width="stretch")
@@ -268,7 +283,10 @@ if _is_admin:
             st.info("No log entries available yet.")
 
 
-    # --- CRUD on Files ---
+# --- CRUD on Files ---
+@st.fragment
+@measure("admin: file management")
+def render_file_management():
     with st.expander("File Management", expanded=False):
         # --- Load cached sheet data safely ---
         file_records = get_uploaded_files()
@@ -277,7 +295,7 @@ if _is_admin:
         # --- Manual refresh button (clear cache + rerun) ---
         if st.button("🔄 Refresh Files"):
             #clear_cache()
-            st.rerun()
+            st.rerun(scope="fragment")
 
         # --- View files ---
         if df_files.empty:
@@ -285,6 +303,22 @@ if _is_admin:
         else:
             st.dataframe(df_files, width="stretch")
 
+        # --- Names with more than one record (block the unique file name index) ---
+        duplicates = duplicate_file_names()
+        if duplicates:
+            st.warning(
+                "⚠️ These file names have more than one record with different files, so the "
+                "unique index on file names could not be created and concurrent uploads of "
+                "one name are not kept apart. Remove or rename the extra records in the database, then retry."
+            )
+            st.dataframe(pd.DataFrame(duplicates), width="stretch", hide_index=True)
+            if st.button("🔁 Retry Unique Index"):
+                try:
+                    ensure_unique_file_names()
+                    st.success("✅ Unique index on file names created.")
+                except Exception as e:
+                    st.error(f"Still blocked: {e}")
+
         st.divider()
 
         # ===========================================================
@@ -304,7 +338,11 @@ if _is_admin:
                     st.error("Please enter a file name.")
                 else:
                     try:
-                        url = upload_to_drive_and_log(uploaded_file, file_type, st.session_state.email, custom_name)
+                        upload_progress = st.progress(0.0, text="Uploading…")
+                        url = upload_to_drive_and_log(
+                            uploaded_file, file_type, st.session_state.email, custom_name,
+                            on_progress=lambda f: upload_progress.progress(f, text=f"Uploading… {f:.0%}")
+                        )
                         if url:
                             #clear_cache()
                             st.success("✅ Uploaded and logged successfully.")
@@ -344,6 +382,7 @@ if _is_admin:
                 pass
 
             confirm = st.checkbox("Yes, delete this record")
+            delete_from_storage = st.checkbox("Also delete the stored file", value=True)
             delete_clicked = st.button("🗑️ Delete File Record")
 
             # --- Delete action ---
@@ -352,12 +391,219 @@ if _is_admin:
                     st.error("Please confirm deletion first.")
                 else:
                     try:
+                        if delete_from_storage:
+                            file_url = df_files.loc[df_files["file_name"] == to_delete, "file_url"].iloc[0]
+                            # Identical uploads share one stored file; keep it while others use it.
+                            shared = (df_files["file_url"] == file_url).sum() > 1
+                            if file_url and not shared and delete_stored_files([file_url]):
+                                st.warning("⚠️ The stored file could not be deleted; removing the record only.")
                         delete_uploaded_file(to_delete)
                         st.success("✅ File record removed successfully.")
                         st.rerun()
                     except Exception as e:
                         st.error(f"Failed to delete record: {e}")
 
+        st.divider()
+
+        # ===========================================================
+        # SYNC WITH FILE STORAGE
+        # ===========================================================
+        st.subheader("Sync with File Storage")
+        st.caption("Finds records whose stored file is gone and stored files no record points to.")
+
+        if st.button("🔍 Scan for orphans"):
+            try:
+                st.session_state.storage_sync_plan = plan_storage_sync()
+            except Exception as e:
+                st.error(f"Storage scan failed: {e}")
+
+        plan = st.session_state.get("storage_sync_plan")
+        if plan:
+            db_orphans, storage_orphans = plan["db_orphans"], plan["storage_orphans"]
+            if plan["unknown"]:
+                st.warning(
+                    f"⚠️ {len(plan['unknown'])} record(s) point to a location no configured storage "
+                    "backend can check. They are left alone by the clean-up."
+                )
+                st.dataframe(pd.DataFrame(plan["unknown"]), width="stretch", hide_index=True)
+            if not db_orphans and not storage_orphans:
+                st.success("✅ Records and stored files are in sync.")
+            else:
+                c1, c2 = st.columns(2)
+                with c1:
+                    st.write(f"**Records without a stored file:** {len(db_orphans)}")
+                    if db_orphans:
+                        st.dataframe(pd.DataFrame({"file_name": db_orphans}), width="stretch", hide_index=True)
+                with c2:
+                    st.write(f"**Stored files without a record:** {len(storage_orphans)}")
+                    if storage_orphans:
+                        st.dataframe(pd.DataFrame(storage_orphans), width="stretch", hide_index=True)
+
+                confirm_sync = st.checkbox("Yes, remove these orphans on both sides")
+                if st.button("🧹 Clean up orphans"):
+                    if not confirm_sync:
+                        st.error("Please confirm the clean-up first.")
+                    else:
+                        try:
+                            removed, deleted, failed = apply_storage_sync(plan)
+                            st.session_state.storage_sync_plan = None
+                            st.success(f"✅ Removed {removed} record(s) and deleted {deleted} stored file(s).")
+                            if failed:
+                                st.warning(f"⚠️ {len(failed)} stored file(s) could not be deleted: {', '.join(failed)}")
+                        except Exception as e:
+                            st.error(f"Clean-up failed: {e}")
+
+
+@st.fragment
+def render_rerun_cost():
+    with st.expander("Rerun Cost", expanded=False):
+        st.caption("Milliseconds and MySQL queries per page region, across all sessions of this process.")
+        if st.button("🔄 Refresh Measurements"):
+            st.rerun(scope="fragment")
+        st.dataframe(measurement_summary(), width="stretch", hide_index=True)
+
+
+@st.fragment
+def render_stage_timing():
+    with st.expander("Stage Timing", expanded=False):
+        st.caption(
+            "Time spent per stage (queries, downloads, parsing, FX, report views, "
+            "rendering) across all sessions of this process."
+        )
+        enabled = st.toggle("Record stage timings", value=tracing_enabled())
+        if enabled != tracing_enabled():
+            set_tracing(enabled)
+
+        c1, c2 = st.columns(2)
+        if c1.button("🔄 Refresh Timings"):
+            st.rerun(scope="fragment")
+        if c2.button("🧹 Clear Timings"):
+            clear_spans()
+            st.rerun(scope="fragment")
+
+        st.markdown("**Per stage**")
+        st.dataframe(stage_summary(), width="stretch", hide_index=True)
+        st.markdown("**Slowest recent reruns**")
+        st.dataframe(slowest_reruns(), width="stretch", hide_index=True)
+
+
+@st.fragment
+def render_query_stats():
+    with st.expander("Query Stats", expanded=False):
+        st.caption("Every MySQL statement run by this process: latency histogram, rows and callers.")
+        c1, c2, c3 = st.columns([2, 1, 1])
+        threshold = c1.number_input(
+            "Slow query threshold (ms)", min_value=0.0, value=float(slow_query_ms()), step=50.0
+        )
+        if threshold != slow_query_ms():
+            set_slow_query_ms(threshold)
+        if c2.button("🔄 Refresh Stats"):
+            st.rerun(scope="fragment")
+        if c3.button("🧹 Reset Stats"):
+            reset_query_stats()
+            st.rerun(scope="fragment")
+
+        stats = query_stats()
+        st.markdown("**Per statement**")
+        st.dataframe(stats, width="stretch", hide_index=True)
+        render_export_buttons(stats, "Query_Stats", key="exp_query_stats")
+
+        st.markdown("**Slow query log** (parameter values redacted)")
+        st.dataframe(slow_queries(), width="stretch", hide_index=True)
+        st.download_button(
+            "⬇ Download stats + slow log (JSON)",
+            data=query_stats_json(),
+            file_name="query_stats.json",
+            mime="application/json",
+            key="dl_query_stats_json",
+            on_click="ignore",
+        )
+
+
+@st.fragment
+def render_memory_profile():
+    with st.expander("Memory Profile", expanded=False):
+        st.caption(
+            "Deep memory use of the report pipeline's frames and tracemalloc peaks per stage. "
+            "Allocations are slower while this is on, and tracemalloc covers the whole "
+            "process, so concurrent sessions show up in each other's stages."
+        )
+        enabled = st.toggle("Profile memory", value=memory_profiling_enabled())
+        if enabled != memory_profiling_enabled():
+            set_memory_profiling(enabled)
+
+        c1, c2 = st.columns(2)
+        if c1.button("🔄 Refresh Profile"):
+            st.rerun(scope="fragment")
+        if c2.button("🧹 Clear Profile"):
+            clear_memory_profile()
+            st.rerun(scope="fragment")
+
+        st.markdown("**Frames** (deep memory usage, latest and largest seen)")
+        st.dataframe(frame_report(), width="stretch", hide_index=True)
+
+        stages = stage_report()
+        st.markdown("**Stages** (peak and retained MB above the level at stage start)")
+        st.dataframe(stages, width="stretch", hide_index=True)
+
+        choices = ["all"] + stages["run"].tolist()
+        run = st.selectbox(
+            "Largest allocators for", choices,
+            format_func=lambda r: "all recorded stages" if r == "all"
+            else f"run {r}: {stages.loc[stages['run'] == r, 'stage'].iloc[0]}",
+        )
+        st.dataframe(top_allocators(run), width="stretch", hide_index=True)
+
+
+def render_startup_timings():
+    with st.expander("Startup", expanded=False):
+        st.caption("One-time startup steps of this server process and how long each took.")
+        st.dataframe(startup_timings(), width="stretch", hide_index=True)
+
+
+@st.fragment
+def render_import_profile():
+    with st.expander("Import Profile", expanded=False):
+        st.caption(
+            "Import cost of the app's modules in a fresh Python process "
+            "(python -X importtime), i.e. the cold-start cost of a worker."
+        )
+        if st.button("⏱ Profile Imports"):
+            try:
+                with st.spinner("Importing in a fresh interpreter..."):
+                    st.session_state.import_profile = import_time_profile()
+            except Exception as e:
+                st.error(f"Import profiling failed: {e}")
+
+        if st.session_state.get("import_profile"):
+            profile, total_ms = st.session_state.import_profile
+            st.metric("Total import time", f"{total_ms:,.0f} ms")
+            top_level_only = st.checkbox("Only modules imported directly by the app", value=True)
+            view = profile[profile["depth"] == 0] if top_level_only else profile
+            st.dataframe(view.head(50), width="stretch", hide_index=True)
+
+
+_is_admin = str(st.session_state.user_record.get("role", "user")).strip().lower() == "admin"
+if _is_admin:
+    st.subheader("Admin Panel")
+
+    #Global refresh for cached sheets
+    if st.button("♻️ Data Refresh"):
+                #clear_cache()
+                st.success("Cache cleared.")
+                st.rerun()
+
+    render_user_management()
+    render_login_activity()
+    render_file_management()
+    render_rerun_cost()
+    render_stage_timing()
+    render_query_stats()
+    render_memory_profile()
+    render_startup_timings()
+    render_import_profile()
+
+
 
 
 # =========================================================
@@ -393,7 +639,11 @@ with st.expander("⬆ Upload File (Budget or Expense)", expanded=False):
             else:
                 try:
                     # ✅ Perform upload and log it
-                    url = upload_to_drive_and_log(uploaded_file, file_type, st.session_state.email, custom_name)
+                    upload_progress = st.progress(0.0, text="Uploading…")
+                    url = upload_to_drive_and_log(
+                        uploaded_file, file_type, st.session_state.email, custom_name,
+                        on_progress=lambda f: upload_progress.progress(f, text=f"Uploading… {f:.0%}")
+                    )
 
                     if url:
                         # ✅ Clear cache so admins see it instantly in their tables
@@ -405,18 +655,28 @@ with st.expander("⬆ Upload File (Budget or Expense)", expanded=False):
                 except Exception as e:
                     st.error(f"Upload failed: {e}")
 
-#Report Generator
-render_generate_report_section(
-    process_budget=process_budget,
-    process_expenses=process_expenses,
-    get_usd_rates=get_usd_rates,
-    convert_row_amount_to_usd=convert_row_amount_to_usd,
-    load_budget_state_monthly=load_budget_state_monthly,
-    save_budget_state_monthly=save_budget_state_monthly,
-    dashboard=dashboard,
-    variance_colour_style=variance_colour_style,
-    get_variance_status=get_variance_status    
-)
+#Year-over-year comparison (reads stored rows; no Excel parsing)
+from functions.comparison import render_comparison_section
 
-                
+render_comparison_section()
+
+#Report modules (Excel parsing, FX, report views) are only needed from here.
+from analysis import process_budget, process_expenses
+from fxhelper import get_usd_rates, convert_row_amount_to_usd
+from functions.dashboard_classification import dashboard
+from functions.report_generator import render_generate_report_section
 
+#Report Generator (file selection and loading; the dashboard and the report
+#views inside it run as their own fragments)
+with measure("report: select + load"):
+    render_generate_report_section(
+        process_budget=process_budget,
+        process_expenses=process_expenses,
+        get_usd_rates=get_usd_rates,
+        convert_row_amount_to_usd=convert_row_amount_to_usd,
+        load_budget_state_grid=load_budget_state_grid,
+        save_budget_state_grid=save_budget_state_grid,
+        dashboard=dashboard,
+        variance_colour_style=variance_colour_style,
+        get_variance_status=get_variance_status
+    )